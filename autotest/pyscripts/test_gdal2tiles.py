@@ -104,6 +104,57 @@ def test_gdal2tiles_py_zoom_option():
     assert ds is not None, 'did not get kml'
 
 
+def test_gdal2tiles_py_threads():
+
+    script_path = test_py_scripts.get_py_script('gdal2tiles')
+    if script_path is None:
+        pytest.skip()
+
+    shutil.rmtree('tmp/out_gdal2tiles_smallworld', ignore_errors=True)
+
+    test_py_scripts.run_py_script_as_external_script(
+        script_path,
+        'gdal2tiles',
+        '-q --processes=2 --threads -z 0-1 '+test_py_scripts.get_data_path('gdrivers')+'small_world.tif tmp/out_gdal2tiles_smallworld')
+
+    _verify_raster_band_checksums(
+        'tmp/out_gdal2tiles_smallworld/1/0/0.png',
+        expected_cs = [24063, 23632, 14707, 17849]
+    )
+
+    shutil.rmtree('tmp/out_gdal2tiles_smallworld', ignore_errors=True)
+
+
+def test_gdal2tiles_py_profiling():
+
+    script_path = test_py_scripts.get_py_script('gdal2tiles')
+    if script_path is None:
+        pytest.skip()
+
+    import json
+
+    shutil.rmtree('tmp/out_gdal2tiles_smallworld', ignore_errors=True)
+    report_filename = 'tmp/out_gdal2tiles_profiling.json'
+
+    test_py_scripts.run_py_script_as_external_script(
+        script_path,
+        'gdal2tiles',
+        '-q --processes=2 --profiling=' + report_filename + ' -z 0-1 ' +
+        test_py_scripts.get_data_path('gdrivers')+'small_world.tif tmp/out_gdal2tiles_smallworld')
+
+    with open(report_filename) as f:
+        report = json.load(f)
+    assert report['mode'] == 'processes'
+    assert report['workers'] == 2
+    assert report['counters']['base_tiles'] == 4
+    assert report['counters']['overview_tiles'] == 1
+    assert report['counters']['bytes_written'] > 0
+    assert 'read_mask' in report['stage_time']
+
+    os.unlink(report_filename)
+    shutil.rmtree('tmp/out_gdal2tiles_smallworld', ignore_errors=True)
+
+
 def test_gdal2tiles_py_resampling_option():
 
     script_path = test_py_scripts.get_py_script('gdal2tiles')
@@ -114,10 +165,8 @@ def test_gdal2tiles_py_resampling_option():
         'average', 'near', 'bilinear', 'cubic', 'cubicspline', 'lanczos',
         'antialias', 'mode', 'max', 'min', 'med', 'q1', 'q3']
     try:
-        from PIL import Image
         import numpy
-        import osgeo.gdal_array as gdalarray
-        del Image, numpy, gdalarray
+        del numpy
     except ImportError:
         # 'antialias' resampling is not available
         resampling_list.remove('antialias')
@@ -299,6 +348,297 @@ def test_python3_handle_utf8_by_default():
         pass
 
 
+def test_gdal2tiles_py_metatile():
+
+    script_path = test_py_scripts.get_py_script('gdal2tiles')
+    if script_path is None:
+        pytest.skip()
+
+    for out_folder in ['tmp/out_gdal2tiles_smallworld', 'tmp/out_gdal2tiles_smallworld_metatile']:
+        shutil.rmtree(out_folder, ignore_errors=True)
+
+    test_py_scripts.run_py_script_as_external_script(
+        script_path,
+        'gdal2tiles',
+        '-q -p raster -z 0-1 '+test_py_scripts.get_data_path('gdrivers')+'small_world.tif tmp/out_gdal2tiles_smallworld')
+
+    test_py_scripts.run_py_script_as_external_script(
+        script_path,
+        'gdal2tiles',
+        '-q -p raster -z 0-1 --metatile=2 '+test_py_scripts.get_data_path('gdrivers')+'small_world.tif tmp/out_gdal2tiles_smallworld_metatile')
+
+    for tz, tx, ty in [(1, 0, 0), (1, 1, 0), (0, 0, 0)]:
+        filename = '%d/%d/%d.png' % (tz, tx, ty)
+        ds = gdal.Open('tmp/out_gdal2tiles_smallworld/' + filename)
+        expected_cs = [ds.GetRasterBand(i + 1).Checksum() for i in range(ds.RasterCount)]
+        ds = None
+        _verify_raster_band_checksums('tmp/out_gdal2tiles_smallworld_metatile/' + filename, expected_cs)
+
+    for out_folder in ['tmp/out_gdal2tiles_smallworld', 'tmp/out_gdal2tiles_smallworld_metatile']:
+        shutil.rmtree(out_folder, ignore_errors=True)
+
+
+@pytest.mark.parametrize('ext,tile_row', [('mbtiles', 0), ('gpkg', 1)])
+def test_gdal2tiles_py_tile_database(ext, tile_row):
+
+    script_path = test_py_scripts.get_py_script('gdal2tiles')
+    if script_path is None:
+        pytest.skip()
+
+    import sqlite3
+
+    out_filename = 'tmp/out_gdal2tiles_smallworld.' + ext
+    gdal.Unlink(out_filename)
+
+    test_py_scripts.run_py_script_as_external_script(
+        script_path,
+        'gdal2tiles',
+        '-q --processes=2 -z 0-1 '+test_py_scripts.get_data_path('gdrivers')+'small_world.tif '+out_filename)
+
+    assert not os.path.exists(out_filename + '-wal')
+
+    conn = sqlite3.connect(out_filename)
+    table = 'tiles' if ext == 'mbtiles' else 'out_gdal2tiles_smallworld'
+    assert conn.execute('SELECT COUNT(*) FROM "%s"' % table).fetchone()[0] == 5
+    data = conn.execute('SELECT tile_data FROM "%s" WHERE zoom_level = 1 AND tile_column = 0 AND tile_row = ?' % table,
+                        (tile_row,)).fetchone()[0]
+    conn.close()
+
+    # Same tile as 1/0/0.png in test_gdal2tiles_py_zoom_option()
+    gdal.FileFromMemBuffer('/vsimem/out_gdal2tiles_tile.png', data)
+    _verify_raster_band_checksums('/vsimem/out_gdal2tiles_tile.png',
+                                  expected_cs=[24063, 23632, 14707, 17849])
+    gdal.Unlink('/vsimem/out_gdal2tiles_tile.png')
+
+    ds = gdal.Open(out_filename)
+    assert ds is not None
+    assert ds.RasterCount == 4
+    ds = None
+
+    gdal.Unlink(out_filename)
+
+
+def test_gdal2tiles_py_tile_database_write_error():
+
+    script_path = test_py_scripts.get_py_script('gdal2tiles')
+    if script_path is None:
+        pytest.skip()
+
+    import sqlite3
+    import subprocess
+
+    out_filename = 'tmp/out_gdal2tiles_write_error.mbtiles'
+    gdal.Unlink(out_filename)
+
+    args = '-q -z 0-1 ' + test_py_scripts.get_data_path('gdrivers') + 'small_world.tif ' + out_filename
+    test_py_scripts.run_py_script_as_external_script(script_path, 'gdal2tiles', args)
+
+    # Make the inserts of the tiles fail as on a full disk. The file is created by the main
+    # process before the tiles are written, so the error happens in the writer thread.
+    conn = sqlite3.connect(out_filename)
+    conn.execute('DELETE FROM tiles WHERE zoom_level = 1')
+    conn.execute("CREATE TRIGGER fail_insert BEFORE INSERT ON tiles "
+                 "BEGIN SELECT RAISE(FAIL, 'database or disk is full'); END")
+    conn.commit()
+    conn.close()
+
+    # gdal2tiles must exit with the error instead of waiting for the tiles to be written
+    ret = subprocess.run([sys.executable, os.path.join(script_path, 'gdal2tiles.py'), '--resume'] + args.split(),
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=120)
+    assert ret.returncode != 0
+    assert b'Cannot write the tiles' in ret.stderr
+
+    gdal.Unlink(out_filename)
+
+
+def test_gdal2tiles_py_antialias_tile_database():
+
+    script_path = test_py_scripts.get_py_script('gdal2tiles')
+    if script_path is None:
+        pytest.skip()
+
+    pytest.importorskip('numpy')
+    import sqlite3
+
+    out_filename = 'tmp/out_gdal2tiles_smallworld.mbtiles'
+    gdal.Unlink(out_filename)
+
+    test_py_scripts.run_py_script_as_external_script(
+        script_path,
+        'gdal2tiles',
+        '-q -r antialias --metatile=2 -z 0-1 '+test_py_scripts.get_data_path('gdrivers')+'small_world.tif '+out_filename)
+
+    conn = sqlite3.connect(out_filename)
+    assert conn.execute('SELECT COUNT(*) FROM tiles').fetchone()[0] == 5
+    conn.close()
+
+    ds = gdal.Open(out_filename)
+    assert ds is not None
+    assert ds.RasterCount == 4
+    ds = None
+
+    gdal.Unlink(out_filename)
+
+
+def test_gdal2tiles_py_antialias_downsample():
+
+    script_path = test_py_scripts.get_py_script('gdal2tiles')
+    if script_path is None:
+        pytest.skip()
+
+    numpy = pytest.importorskip('numpy')
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location('gdal2tiles', os.path.join(script_path, 'gdal2tiles.py'))
+    gdal2tiles = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(gdal2tiles)
+
+    # Steps of 4 pixels, downsampled by 4: the filter is symmetric around each step
+    array = numpy.empty((2, 8, 1024), numpy.uint8)
+    array[0] = numpy.arange(1024) // 4
+    array[1] = 255
+    result = gdal2tiles.antialias_downsample(array, 256, 2)
+    assert result.shape == (2, 2, 256)
+    assert (result[1] == 255).all()
+    assert (result[0, :, 3:253] == numpy.arange(3, 253)).all()
+
+    # The color under a transparent alpha does not bleed into the other pixels
+    array[0, :, 512:] = 255
+    array[1, :, 512:] = 0
+    result = gdal2tiles.antialias_downsample(array, 256, 2)
+    assert (result[0, :, 3:125] == numpy.arange(3, 125)).all()
+    assert (result[1, :, 3:125] == 255).all()
+    assert (result[:, :, 131:] == 0).all()
+
+
+def test_gdal2tiles_py_antialias_mosaic():
+
+    script_path = test_py_scripts.get_py_script('gdal2tiles')
+    if script_path is None:
+        pytest.skip()
+
+    pytest.importorskip('numpy')
+
+    # On the pixels of the tile at zoom level 0, sampled by 4
+    input_filename = 'tmp/out_gdal2tiles_antialias.tif'
+    gdal.Warp(input_filename, test_py_scripts.get_data_path('gdrivers') + 'small_world.tif',
+              options='-t_srs EPSG:3857 -te -20037508.342789244 -20037508.342789244 '
+                      '20037508.342789244 20037508.342789244 -ts 1024 1024')
+    shutil.rmtree('tmp/out_gdal2tiles_antialias', ignore_errors=True)
+    shutil.rmtree('tmp/out_gdal2tiles_antialias_mosaic', ignore_errors=True)
+
+    test_py_scripts.run_py_script_as_external_script(
+        script_path,
+        'gdal2tiles',
+        '-q -r antialias -z 0 ' + input_filename + ' tmp/out_gdal2tiles_antialias')
+
+    # The western and eastern halves generated in the same directory, the second one
+    # composited over the tile of the first one
+    for i, srcwin in enumerate(('0 0 512 1024', '512 0 512 1024')):
+        gdal.Translate('tmp/out_gdal2tiles_antialias_%d.tif' % i, input_filename, options='-srcwin ' + srcwin)
+        test_py_scripts.run_py_script_as_external_script(
+            script_path,
+            'gdal2tiles',
+            '-q -r antialias -z 0 tmp/out_gdal2tiles_antialias_%d.tif tmp/out_gdal2tiles_antialias_mosaic' % i)
+
+    ds = gdal.Open('tmp/out_gdal2tiles_antialias/0/0/0.png')
+    expected = ds.ReadAsArray()
+    ds = None
+    ds = gdal.Open('tmp/out_gdal2tiles_antialias_mosaic/0/0/0.png')
+    got = ds.ReadAsArray()
+    ds = None
+
+    assert expected.shape == (4, 256, 256)
+    assert (expected[3] == 255).all()
+    # Identical out of the reach of the filter around the seam
+    assert (got[:, :, :124] == expected[:, :, :124]).all()
+    assert (got[:, :, 132:] == expected[:, :, 132:]).all()
+
+    shutil.rmtree('tmp/out_gdal2tiles_antialias', ignore_errors=True)
+    shutil.rmtree('tmp/out_gdal2tiles_antialias_mosaic', ignore_errors=True)
+    for i in range(2):
+        gdal.Unlink('tmp/out_gdal2tiles_antialias_%d.tif' % i)
+    gdal.Unlink(input_filename)
+
+
+def test_gdal2tiles_py_dedup():
+
+    script_path = test_py_scripts.get_py_script('gdal2tiles')
+    if script_path is None:
+        pytest.skip()
+
+    import sqlite3
+
+    # Uniform world raster: all the tiles are identical
+    ds = gdal.GetDriverByName('GTiff').Create('tmp/out_gdal2tiles_uniform.tif', 512, 256, 3)
+    ds.SetGeoTransform([-180, 360. / 512, 0, 90, 0, -180. / 256])
+    ds.SetProjection('GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]]')
+    ds = None
+
+    out_folder = 'tmp/out_gdal2tiles_uniform'
+    shutil.rmtree(out_folder, ignore_errors=True)
+    gdal.Unlink(out_folder + '.mbtiles')
+
+    for output in (out_folder, out_folder + '.mbtiles'):
+        test_py_scripts.run_py_script_as_external_script(
+            script_path,
+            'gdal2tiles',
+            '-q --dedup -z 0-1 tmp/out_gdal2tiles_uniform.tif ' + output)
+
+    assert os.stat(out_folder + '/1/1/1.png').st_nlink > 1
+
+    # A run without --dedup over the same folder does not write through the hardlinks
+    test_py_scripts.run_py_script_as_external_script(
+        script_path,
+        'gdal2tiles',
+        '-q -z 0-1 tmp/out_gdal2tiles_uniform.tif ' + out_folder)
+    for tile in ('0/0/0.png', '1/0/0.png', '1/0/1.png', '1/1/0.png', '1/1/1.png'):
+        assert os.stat(os.path.join(out_folder, tile)).st_nlink == 1
+
+    conn = sqlite3.connect(out_folder + '.mbtiles')
+    assert conn.execute('SELECT COUNT(*) FROM map').fetchone()[0] == 5
+    assert conn.execute('SELECT COUNT(*) FROM images').fetchone()[0] < 5
+    conn.close()
+
+    shutil.rmtree(out_folder, ignore_errors=True)
+    gdal.Unlink(out_folder + '.mbtiles')
+    gdal.Unlink('tmp/out_gdal2tiles_uniform.tif')
+
+
+def test_gdal2tiles_py_resume_manifest():
+
+    script_path = test_py_scripts.get_py_script('gdal2tiles')
+    if script_path is None:
+        pytest.skip()
+
+    out_folder = 'tmp/out_gdal2tiles_smallworld'
+    shutil.rmtree(out_folder, ignore_errors=True)
+
+    args = '-q -z 0-1 ' + test_py_scripts.get_data_path('gdrivers') + 'small_world.tif ' + out_folder
+    test_py_scripts.run_py_script_as_external_script(script_path, 'gdal2tiles', args)
+
+    manifest_dir = out_folder + '/.gdal2tiles_resume'
+    assert os.path.exists(manifest_dir + '/manifest')
+    assert [f for f in os.listdir(manifest_dir) if f.endswith('.journal')]
+
+    # The journals are merged in the manifest, and no tile is missing
+    mtime = os.stat(out_folder + '/1/0/0.png').st_mtime
+    test_py_scripts.run_py_script_as_external_script(script_path, 'gdal2tiles', '--resume ' + args)
+    assert not [f for f in os.listdir(manifest_dir) if f.endswith('.journal')]
+    assert os.stat(out_folder + '/1/0/0.png').st_mtime == mtime
+
+    # Without the manifest, the tiles are checked on disk
+    os.unlink(out_folder + '/1/0/0.png')
+    shutil.rmtree(manifest_dir)
+    test_py_scripts.run_py_script_as_external_script(script_path, 'gdal2tiles', '--resume ' + args)
+    _verify_raster_band_checksums(
+        out_folder + '/1/0/0.png',
+        expected_cs=[24063, 23632, 14707, 17849]
+    )
+
+    shutil.rmtree(out_folder, ignore_errors=True)
+
+
 def test_gdal2tiles_py_cleanup():
 
     lst = ['tmp/out_gdal2tiles_smallworld', 'tmp/out_gdal2tiles_bounds_approx']
@@ -464,3 +804,132 @@ def test_gdal2tiles_py_mapml():
 
     shutil.rmtree('tmp/out_gdal2tiles_mapml', ignore_errors=True)
     gdal.Unlink('tmp/byte_APS.tif')
+
+
+def _get_tile_checksums(output_folder):
+    checksums = {}
+    for root, _, filenames in os.walk(output_folder):
+        for filename in filenames:
+            if filename.endswith('.png'):
+                ds = gdal.Open(os.path.join(root, filename))
+                checksums[os.path.relpath(os.path.join(root, filename), output_folder)] = \
+                    [ds.GetRasterBand(i + 1).Checksum() for i in range(ds.RasterCount)]
+                ds = None
+    return checksums
+
+
+def test_gdal2tiles_py_processes_same_as_serial():
+
+    script_path = test_py_scripts.get_py_script('gdal2tiles')
+    if script_path is None:
+        pytest.skip()
+
+    shutil.rmtree('tmp/out_gdal2tiles_serial', ignore_errors=True)
+    shutil.rmtree('tmp/out_gdal2tiles_processes', ignore_errors=True)
+
+    # The base tiles are grouped under a different zoom level with 1 and 2 processes
+    test_py_scripts.run_py_script(
+        script_path,
+        'gdal2tiles',
+        '-q -z 0-5 ' + test_py_scripts.get_data_path('gdrivers') + 'small_world.tif tmp/out_gdal2tiles_serial')
+    test_py_scripts.run_py_script_as_external_script(
+        script_path,
+        'gdal2tiles',
+        '-q --processes=2 -z 0-5 ' + test_py_scripts.get_data_path('gdrivers') + 'small_world.tif tmp/out_gdal2tiles_processes')
+
+    serial = _get_tile_checksums('tmp/out_gdal2tiles_serial')
+    assert sorted(set(name.split(os.sep)[0] for name in serial)) == ['0', '1', '2', '3', '4', '5']
+    assert _get_tile_checksums('tmp/out_gdal2tiles_processes') == serial
+
+    shutil.rmtree('tmp/out_gdal2tiles_serial', ignore_errors=True)
+    shutil.rmtree('tmp/out_gdal2tiles_processes', ignore_errors=True)
+
+
+def test_gdal2tiles_py_resume_overview_tile():
+
+    script_path = test_py_scripts.get_py_script('gdal2tiles')
+    if script_path is None:
+        pytest.skip()
+
+    output_folder = 'tmp/out_gdal2tiles_resume'
+    shutil.rmtree(output_folder, ignore_errors=True)
+
+    args = '-q -z 0-4 ' + test_py_scripts.get_data_path('gdrivers') + 'small_world.tif ' + output_folder
+    test_py_scripts.run_py_script(script_path, 'gdal2tiles', args)
+    expected = _get_tile_checksums(output_folder)
+
+    # Overview tiles above base tiles which all exist, within and above the subtrees
+    # of the base tiles
+    for tile in ('3/4/2.png', '1/0/0.png'):
+        os.unlink(os.path.join(output_folder, tile))
+
+    test_py_scripts.run_py_script(script_path, 'gdal2tiles', '--resume ' + args)
+    assert _get_tile_checksums(output_folder) == expected
+
+    shutil.rmtree(output_folder, ignore_errors=True)
+
+
+@pytest.mark.parametrize('case', ['rotated', 'antimeridian', 'pole'])
+def test_gdal2tiles_py_exclude_footprint(case):
+
+    script_path = test_py_scripts.get_py_script('gdal2tiles')
+    if script_path is None:
+        pytest.skip()
+
+    import json
+
+    input_filename = 'tmp/out_gdal2tiles_footprint.tif'
+    small_world = test_py_scripts.get_data_path('gdrivers') + 'small_world.tif'
+    if case == 'rotated':
+        # Its outline in EPSG:3857 leaves tiles of its extent uncovered
+        zoom = '0-6'
+        ds = gdal.Translate(input_filename, small_world, options='-srcwin 100 0 200 200')
+        ds.SetGeoTransform([-40, 0.3, 0.1, 50, 0.1, -0.3])
+        ds = None
+    elif case == 'antimeridian':
+        # From 168E to 170W
+        zoom = '0-4'
+        gdal.Translate(input_filename, small_world,
+                       options='-srcwin 0 0 100 50 -a_srs EPSG:3832 -a_ullr 2000000 3000000 4500000 0')
+    else:
+        # Up to the poles, out of the area of use of EPSG:3857
+        zoom = '0-2'
+        shutil.copy(small_world, input_filename)
+
+    report_filename = 'tmp/out_gdal2tiles_footprint.json'
+    shutil.rmtree('tmp/out_gdal2tiles_footprint', ignore_errors=True)
+    shutil.rmtree('tmp/out_gdal2tiles_footprint_x', ignore_errors=True)
+
+    test_py_scripts.run_py_script_as_external_script(
+        script_path,
+        'gdal2tiles',
+        '-q -z ' + zoom + ' ' + input_filename + ' tmp/out_gdal2tiles_footprint')
+    test_py_scripts.run_py_script_as_external_script(
+        script_path,
+        'gdal2tiles',
+        '-q -x --profiling=' + report_filename + ' -z ' + zoom + ' ' + input_filename +
+        ' tmp/out_gdal2tiles_footprint_x')
+
+    with open(report_filename) as f:
+        skipped = json.load(f)['counters'].get('footprint_tiles_skipped', 0)
+    if case == 'rotated':
+        assert skipped > 0
+    else:
+        # The footprint is not used
+        assert skipped == 0
+
+    # The tiles dropped by the footprint must be the transparent ones
+    expected = {}
+    for tile, checksums in _get_tile_checksums('tmp/out_gdal2tiles_footprint').items():
+        ds = gdal.Open(os.path.join('tmp/out_gdal2tiles_footprint', tile))
+        alpha = ds.GetRasterBand(ds.RasterCount).ReadRaster()
+        ds = None
+        if alpha.count(b'\x00') != len(alpha):
+            expected[tile] = checksums
+    assert expected
+    assert _get_tile_checksums('tmp/out_gdal2tiles_footprint_x') == expected
+
+    os.unlink(report_filename)
+    gdal.Unlink(input_filename)
+    shutil.rmtree('tmp/out_gdal2tiles_footprint', ignore_errors=True)
+    shutil.rmtree('tmp/out_gdal2tiles_footprint_x', ignore_errors=True)
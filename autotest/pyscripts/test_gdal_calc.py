@@ -290,6 +290,55 @@ def test_gdal_calc_py_8():
         check_file(out[0], checksum, 1, bnd_idx=i+1)
 
 
+def test_gdal_calc_py_allbands_read_once(monkeypatch):
+    """ test that each input block is read once with several output bands """
+
+    script_path = test_py_scripts.get_py_script('gdal_calc')
+    if script_path is None:
+        pytest.skip("gdal_calc script not found, skipping all tests", allow_module_level=True)
+
+    test_id, test_count = 'allbands', 3
+    out = make_temp_filename_list(test_id, test_count)
+
+    # 4 x 4 blocks of 16 x 16 pixels, the last ones partial
+    gdal.Translate(out[0], test_py_scripts.get_data_path('gcore') + 'rgbsmall.tif',
+                   options='-co TILED=YES -co BLOCKXSIZE=16 -co BLOCKYSIZE=16')
+    gdal.Translate(out[1], out[0], options='-b 2')
+    ds = gdal.Open(out[0])
+    a = [ds.GetRasterBand(i + 1).ReadAsArray() for i in range(3)]
+    ds = None
+
+    reads = defaultdict(int)
+    band_read_as_array = gdal_array.BandReadAsArray
+    dataset_read_as_array = gdal_array.DatasetReadAsArray
+
+    def counting_band_read_as_array(band, xoff=0, yoff=0, win_xsize=None, win_ysize=None, *args, **kwargs):
+        reads[(band.GetDataset().GetDescription(), band.GetBand(), xoff, yoff, win_xsize, win_ysize)] += 1
+        return band_read_as_array(band, xoff, yoff, win_xsize, win_ysize, *args, **kwargs)
+
+    def counting_dataset_read_as_array(ds, xoff=0, yoff=0, win_xsize=None, win_ysize=None, *args, **kwargs):
+        for band_no in kwargs.get('band_list') or range(1, ds.RasterCount + 1):
+            reads[(ds.GetDescription(), band_no, xoff, yoff, win_xsize, win_ysize)] += 1
+        return dataset_read_as_array(ds, xoff, yoff, win_xsize, win_ysize, *args, **kwargs)
+
+    monkeypatch.setattr(gdal_array, 'BandReadAsArray', counting_band_read_as_array)
+    monkeypatch.setattr(gdal_array, 'DatasetReadAsArray', counting_dataset_read_as_array)
+    gdal_calc.Calc('A*2+B', A=out[0], B=out[1], allBands='A', type='Int16', overwrite=True, quiet=True,
+                   outfile=out[2])
+    monkeypatch.undo()
+
+    assert len(reads) == 4 * 4 * 4
+    assert set(reads.values()) == {1}
+    assert set((filename, band_no) for filename, band_no, _, _, _, _ in reads) == \
+        {(out[0], 1), (out[0], 2), (out[0], 3), (out[1], 1)}
+
+    ds = gdal.Open(out[2])
+    assert ds.RasterCount == 3
+    for i in range(3):
+        assert np.array_equal(ds.GetRasterBand(i + 1).ReadAsArray(), a[i] * 2 + a[1])
+    ds = None
+
+
 def my_sum(a, gdal_dt=None):
     """ sum using numpy """
     np_dt = GDALTypeCodeToNumericTypeCode(gdal_dt)
@@ -404,6 +453,339 @@ def test_gdal_calc_py_9():
     i += 1
 
 
+def test_gdal_calc_py_10():
+    """ test --threads option """
+
+    script_path = test_py_scripts.get_py_script('gdal_calc')
+    if script_path is None:
+        pytest.skip("gdal_calc script not found, skipping all tests", allow_module_level=True)
+
+    infile = get_input_file()
+    test_id, test_count = 10, 3
+    out = make_temp_filename_list(test_id, test_count)
+
+    test_py_scripts.run_py_script(script_path, 'gdal_calc', '-A {} --A_band 1 -B {} --B_band 2 --calc=A+B --threads 4 --overwrite --outfile {}'.format(infile, infile, out[0]))
+    gdal_calc.Calc(['A', 'B', 'Z'], A=infile, B=infile, B_band=2, Z=infile, Z_band=2, num_threads=3, overwrite=True, quiet=True, outfile=out[1])
+    gdal_calc.Calc('A', A=infile, allBands='A', num_threads=2, overwrite=True, quiet=True, outfile=out[2])
+
+    check_file(out[0], 12368, 1)
+    bnd_count = 3
+    for i, checksum in zip(range(bnd_count), (input_checksum[0], input_checksum[1], input_checksum[1])):
+        check_file(out[1], checksum, 2, bnd_idx=i+1)
+    bnd_count = 4
+    for i, checksum in zip(range(bnd_count), input_checksum[0:bnd_count]):
+        check_file(out[2], checksum, 3, bnd_idx=i+1)
+
+
+def test_gdal_calc_py_11():
+    """ test --window-size and --max-memory options """
+
+    script_path = test_py_scripts.get_py_script('gdal_calc')
+    if script_path is None:
+        pytest.skip("gdal_calc script not found, skipping all tests", allow_module_level=True)
+
+    assert gdal_calc.get_window_size([(256, 256), (512, 128)], (1000, 1000), window_size=(300, 10)) == (512, 256)
+    assert gdal_calc.get_window_size([(20, 1)], (20, 20), max_memory=20 * 10 * 4, bytes_per_pixel=4) == (20, 10)
+    assert gdal_calc.get_window_size([(256, 256)], (100000, 100000), max_memory=256 * 1024 * 8, bytes_per_pixel=8) == (1024, 256)
+
+    infile = get_input_file()
+    test_id, test_count = 11, 3
+    out = make_temp_filename_list(test_id, test_count)
+
+    test_py_scripts.run_py_script(script_path, 'gdal_calc', '-A {} --A_band 1 -B {} --B_band 2 --calc=A+B --window-size 50 20 --overwrite --outfile {}'.format(infile, infile, out[0]))
+    test_py_scripts.run_py_script(script_path, 'gdal_calc', '-A {} --A_band 1 -B {} --B_band 2 --calc=A+B --max-memory 1 --overwrite --outfile {}'.format(infile, infile, out[1]))
+    gdal_calc.Calc('A', A=infile, allBands='A', max_memory=0.01, num_threads=2, overwrite=True, quiet=True, outfile=out[2])
+
+    check_file(out[0], 12368, 1)
+    check_file(out[1], 12368, 2)
+    bnd_count = 4
+    for i, checksum in zip(range(bnd_count), input_checksum[0:bnd_count]):
+        check_file(out[2], checksum, 3, bnd_idx=i+1)
+
+
+def test_gdal_calc_py_12():
+    """ test VRT output format (lazy calculation) """
+
+    script_path = test_py_scripts.get_py_script('gdal_calc')
+    if script_path is None:
+        pytest.skip("gdal_calc script not found, skipping all tests", allow_module_level=True)
+
+    infile = get_input_file()
+    out = 'tmp/test_gdal_calc_py_12.vrt'
+
+    test_py_scripts.run_py_script(script_path, 'gdal_calc', '-A {} --A_band 1 -B {} --B_band 2 --calc=A+B --calc=B --format VRT --overwrite --outfile {}'.format(infile, infile, out))
+
+    with open(out) as f:
+        assert f.read().count('VRTDerivedRasterBand') == 2
+
+    ds = gdal.Open(out)
+    assert ds is not None
+    assert ds.RasterCount == 2
+    gdal.SetConfigOption('GDAL_VRT_ENABLE_PYTHON', 'YES')
+    try:
+        cs = [ds.GetRasterBand(i + 1).Checksum() for i in range(2)]
+        # a buffer of another size than the window
+        xsize, ysize = ds.RasterXSize // 2, ds.RasterYSize // 2
+        half = ds.GetRasterBand(2).ReadAsArray(buf_xsize=xsize, buf_ysize=ysize)
+    finally:
+        gdal.SetConfigOption('GDAL_VRT_ENABLE_PYTHON', None)
+    ds = None
+    if cs[0] == 0:
+        gdal.Unlink(out)
+        pytest.skip('python pixel functions are not available')
+    assert cs == [12368, input_checksum[1]]
+    ds = gdal.Open(infile)
+    assert np.array_equal(half, ds.GetRasterBand(2).ReadAsArray(buf_xsize=xsize, buf_ysize=ysize))
+    ds = None
+
+    with pytest.raises(Exception):
+        gdal_calc.Calc('A', A=infile, outfile=out, format='VRT', user_namespace={'f': abs}, overwrite=True, quiet=True)
+
+    # the sources of the VRT must be files
+    with pytest.raises(Exception, match='not backed by a file'):
+        gdal_calc.Calc('A', A=gdal.Translate('', infile, format='MEM'), outfile=out, format='VRT', overwrite=True,
+                       quiet=True)
+
+    gdal.Unlink(out)
+
+
+def test_gdal_calc_py_13():
+    """ test skipping blocks without data """
+
+    script_path = test_py_scripts.get_py_script('gdal_calc')
+    if script_path is None:
+        pytest.skip("gdal_calc script not found, skipping all tests", allow_module_level=True)
+
+    test_id, test_count = 13, 2
+    out = make_temp_filename_list(test_id, test_count)
+
+    ds = gdal.GetDriverByName('GTiff').Create(out[0], 512, 512, 1, gdal.GDT_Byte, options=['TILED=YES', 'SPARSE_OK=YES'])
+    ds.GetRasterBand(1).SetNoDataValue(0)
+    ds.GetRasterBand(1).WriteRaster(0, 0, 256, 256, b'\x01' * (256 * 256))
+    ds = None
+
+    gdal_calc.Calc('A*2', A=out[0], NoDataValue=0, creation_options=['TILED=YES', 'SPARSE_OK=YES'],
+                   overwrite=True, quiet=True, outfile=out[1])
+
+    ds = gdal.Open(out[1])
+    bnd = ds.GetRasterBand(1)
+    data = bnd.ReadRaster()
+    assert data.count(b'\x02') == 256 * 256
+    assert data.count(b'\x00') == 512 * 512 - 256 * 256
+    flags, _ = bnd.GetDataCoverageStatus(256, 0, 256, 512)
+    assert flags == gdal.GDAL_DATA_COVERAGE_STATUS_EMPTY
+    ds = None
+
+
+def test_gdal_calc_py_14():
+    """ test nodata propagation with several bands and output types """
+
+    script_path = test_py_scripts.get_py_script('gdal_calc')
+    if script_path is None:
+        pytest.skip("gdal_calc script not found, skipping all tests", allow_module_level=True)
+
+    infile = get_input_file()
+    test_id, test_count = 14, 7
+    out = make_temp_filename_list(test_id, test_count)
+
+    gdal.Translate(out[0], infile, options='-a_nodata 0')
+    ds = gdal.Open(out[0])
+    a = [ds.GetRasterBand(i + 1).ReadAsArray() for i in range(4)]
+    ds = None
+    mask = a[0] == 0
+
+    # the result of the calculation is the input array itself
+    gdal_calc.Calc('A', A=out[0], allBands='A', NoDataValue=1, overwrite=True, quiet=True, outfile=out[1])
+    ds = gdal.Open(out[1])
+    for i in range(4):
+        expected = np.where(a[i] == 0, 1, a[i])
+        assert np.array_equal(ds.GetRasterBand(i + 1).ReadAsArray(), expected)
+    ds = None
+
+    # a float result with an integer output type, and a nodata value that does not fit in the input type
+    gdal_calc.Calc(['A/3', 'B'], A=out[0], B=out[0], B_band=2, type='Int16', NoDataValue=-1, overwrite=True, quiet=True, outfile=out[2])
+    ds = gdal.Open(out[2])
+    b_mask = mask | (a[1] == 0)
+    expected = np.where(b_mask, -1, np.floor(a[0] / 3 + 0.5))
+    assert np.array_equal(ds.GetRasterBand(1).ReadAsArray(), expected)
+    assert np.array_equal(ds.GetRasterBand(2).ReadAsArray(), np.where(b_mask, -1, a[1]))
+    ds = None
+
+    # a scalar result
+    gdal_calc.Calc('3', A=out[0], type='Float32', NoDataValue=-1.5, overwrite=True, quiet=True, outfile=out[3])
+    ds = gdal.Open(out[3])
+    assert np.array_equal(ds.GetRasterBand(1).ReadAsArray(), np.where(mask, -1.5, 3).astype(np.float32))
+    ds = None
+
+    # an array of the caller returned as is by the calculation is not modified (in a single block)
+    x = a[1].copy()
+    gdal_calc.Calc('X', A=out[0], user_namespace={'X': x}, window_size=x.shape[::-1], NoDataValue=1,
+                   overwrite=True, quiet=True, outfile=out[4])
+    assert np.array_equal(x, a[1])
+    ds = gdal.Open(out[4])
+    assert np.array_equal(ds.GetRasterBand(1).ReadAsArray(), np.where(mask, 1, a[1]))
+    ds = None
+
+    # signed byte input, read in the reused arrays
+    gdal.Translate(out[5], infile, options='-b 1 -co PIXELTYPE=SIGNEDBYTE')
+    gdal_calc.Calc('A', A=out[5], type='Int16', overwrite=True, quiet=True, outfile=out[6])
+    ds = gdal.Open(out[6])
+    assert np.array_equal(ds.GetRasterBand(1).ReadAsArray(), a[0].view(np.int8))
+    ds = None
+
+
+def test_gdal_calc_py_15():
+    """ test reductions """
+
+    script_path = test_py_scripts.get_py_script('gdal_calc')
+    if script_path is None:
+        pytest.skip("gdal_calc script not found, skipping all tests", allow_module_level=True)
+
+    infile = get_input_file()
+    test_id, test_count = 15, 1
+    out = make_temp_filename_list(test_id, test_count)
+
+    gdal.Translate(out[0], infile, options='-a_nodata 0')
+    ds = gdal.Open(out[0])
+    a = ds.GetRasterBand(1).ReadAsArray()
+    b = ds.GetRasterBand(2).ReadAsArray()
+    ds = None
+    valid = (a != 0) & (b != 0)
+
+    kwargs = dict(A=out[0], B=out[0], B_band=2, quiet=True)
+    assert gdal_calc.Calc('A*1.0', reduce='sum', **kwargs) == pytest.approx(a[valid].sum())
+    assert gdal_calc.Calc('logical_and(A>100,B<150)', reduce='count', **kwargs) == np.count_nonzero((a[valid] > 100) & (b[valid] < 150))
+    assert gdal_calc.Calc(['A', 'B'], reduce='min', **kwargs) == [a[valid].min(), b[valid].min()]
+    assert gdal_calc.Calc('B', reduce='max', num_threads=2, **kwargs) == b[valid].max()
+    assert gdal_calc.Calc('A*1.0', reduce='mean', **kwargs) == pytest.approx(a[valid].mean())
+    counts, edges = gdal_calc.Calc('A', reduce='histogram', hist_bins=16, hist_range=(0, 256), **kwargs)
+    expected_counts, expected_edges = np.histogram(a[valid], 16, (0, 256))
+    assert list(counts) == list(expected_counts)
+    assert list(edges) == list(expected_edges)
+
+
+def test_gdal_calc_py_16():
+    """ test inputs that are bands of the same file """
+
+    script_path = test_py_scripts.get_py_script('gdal_calc')
+    if script_path is None:
+        pytest.skip("gdal_calc script not found, skipping all tests", allow_module_level=True)
+
+    infile = get_input_file()
+    test_id, test_count = 16, 2
+    out = make_temp_filename_list(test_id, test_count)
+
+    ds = gdal.Open(infile)
+    a, b, c = (ds.GetRasterBand(i).ReadAsArray().astype(np.int32) for i in range(1, 4))
+    ds = None
+
+    for i, num_threads in enumerate((1, 2)):
+        ds = gdal_calc.Calc(['A+B+C', 'C-D', 'A*D'], A=infile, B=infile, B_band=2, C=infile, C_band=3, D=infile,
+                            type='Int32', num_threads=num_threads, overwrite=True, quiet=True, outfile=out[i])
+        assert np.array_equal(ds.GetRasterBand(1).ReadAsArray(), a + b + c)
+        assert np.array_equal(ds.GetRasterBand(2).ReadAsArray(), c - a)
+        assert np.array_equal(ds.GetRasterBand(3).ReadAsArray(), a * a)
+        ds = None
+
+
+def test_gdal_calc_py_17():
+    """ test the numexpr engine """
+
+    script_path = test_py_scripts.get_py_script('gdal_calc')
+    if script_path is None:
+        pytest.skip("gdal_calc script not found, skipping all tests", allow_module_level=True)
+    if not gdal_calc.numexpr_available:
+        pytest.skip("numexpr not available")
+
+    infile = get_input_file()
+    test_id, test_count = 17, 4
+    out = make_temp_filename_list(test_id, test_count)
+
+    gdal.Translate(out[0], infile, options='-ot Float32 -a_nodata 0')
+    for i, engine in enumerate(('numpy', 'numexpr')):
+        gdal_calc.Calc(['A*0.5+B*0.3+C*0.2', 'where(A>B,A,B)', 'sum([A,B],axis=0)'], A=out[0], B=out[0], B_band=2,
+                       C=out[0], C_band=3, engine=engine, overwrite=True, quiet=True, outfile=out[i+1])
+
+    # numexpr does not support Byte inputs, they are computed by numpy
+    ds = gdal_calc.Calc('A*2', A=infile, engine='numexpr', overwrite=True, quiet=True, outfile=out[3])
+    assert np.array_equal(ds.GetRasterBand(1).ReadAsArray(), gdal.Open(infile).GetRasterBand(1).ReadAsArray() * 2)
+    ds = None
+
+    ds1 = gdal.Open(out[1])
+    ds2 = gdal.Open(out[2])
+    for band_no in range(1, 4):
+        assert np.allclose(ds1.GetRasterBand(band_no).ReadAsArray(), ds2.GetRasterBand(band_no).ReadAsArray())
+    ds1 = None
+    ds2 = None
+
+    # a calculation that numexpr does not support is evaluated by numpy, without changing the expression
+    # that is shared by the threads
+    expr = gdal_calc.CalcExpression('numpy.abs(A-100)', 'numexpr')
+    a = np.arange(5, dtype=np.float32)
+    assert np.array_equal(expr.evaluate(dict(gdal_calc.get_global_namespace(), numpy=np), {'A': a}), np.abs(a - 100))
+    assert expr.use_numexpr
+
+
+def test_gdal_calc_py_18():
+    """ test --statistics and --histogram options """
+
+    script_path = test_py_scripts.get_py_script('gdal_calc')
+    if script_path is None:
+        pytest.skip("gdal_calc script not found, skipping all tests", allow_module_level=True)
+
+    infile = get_input_file()
+    test_id, test_count = 18, 2
+    out = make_temp_filename_list(test_id, test_count)
+
+    test_py_scripts.run_py_script(script_path, 'gdal_calc', '-A {} --calc=A --NoDataValue=0 --histogram --overwrite --outfile {}'.format(infile, out[0]))
+    gdal_calc.Calc('A*3-B', A=infile, B=infile, B_band=2, type='Int16', NoDataValue=0, statistics=True,
+                   histogram=True, hist_bins=100, overwrite=True, quiet=True, outfile=out[1])
+
+    for i, (calc, calc_type) in enumerate((('A', 'Byte'), ('A*3-B', 'Int16'))):
+        ref_ds = gdal_calc.Calc(calc, A=infile, B=infile, B_band=2, type=calc_type, NoDataValue=0,
+                                format='MEM', quiet=True)
+        ref_band = ref_ds.GetRasterBand(1)
+        ref_stats = ref_band.ComputeStatistics(False)
+
+        ds = gdal.Open(out[i])
+        band = ds.GetRasterBand(1)
+        assert band.GetStatistics(False, False) == pytest.approx(ref_stats)
+        hist = band.GetDefaultHistogram(force=False)
+        assert hist is not None
+        assert hist[0:2] == pytest.approx(ref_band.GetDefaultHistogram(force=True)[0:2])
+        assert hist[3] == ref_band.GetHistogram(hist[0], hist[1], hist[2], False, False)
+        ds = None
+
+
+def test_gdal_calc_py_19():
+    """ test --statistics with results out of the range of the output type """
+
+    script_path = test_py_scripts.get_py_script('gdal_calc')
+    if script_path is None:
+        pytest.skip("gdal_calc script not found, skipping all tests", allow_module_level=True)
+
+    infile = get_input_file()
+    test_id, test_count = 19, 2
+    out = make_temp_filename_list(test_id, test_count)
+
+    # Int16 input, so that A*100 is not computed in Byte
+    gdal.Translate(out[0], infile, options='-ot Int16 -b 1')
+    test_py_scripts.run_py_script(script_path, 'gdal_calc', '-A {} --type=Byte --calc="A*100" --statistics --histogram --overwrite --outfile {}'.format(out[0], out[1]))
+
+    ref_ds = gdal_calc.Calc('A*100', A=out[0], type='Byte', format='MEM', quiet=True)
+    ref_band = ref_ds.GetRasterBand(1)
+    ref_stats = ref_band.ComputeStatistics(False)
+    assert ref_stats[1] == 255
+
+    ds = gdal.Open(out[1])
+    band = ds.GetRasterBand(1)
+    assert band.GetStatistics(False, False) == pytest.approx(ref_stats)
+    hist = band.GetDefaultHistogram(force=False)
+    assert hist is not None
+    assert hist[3] == ref_band.GetHistogram(hist[0], hist[1], hist[2], False, False)
+    ds = None
+
+
 def test_gdal_calc_py_cleanup():
     """ cleanup all temporary files that were created in this pytest """
     global temp_counter_dict
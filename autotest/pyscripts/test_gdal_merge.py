@@ -211,6 +211,131 @@ def test_gdal_merge_5():
     assert ds.GetRasterBand(3).Checksum() == 0, 'Wrong checksum'
     assert ds.GetRasterBand(4).Checksum() == cs, 'Wrong checksum'
 
+###############################################################################
+# Test -windowed option
+
+
+def test_gdal_merge_6():
+    pytest.importorskip('numpy')
+
+    script_path = test_py_scripts.get_py_script('gdal_merge')
+    if script_path is None:
+        pytest.skip()
+
+    test_py_scripts.run_py_script(script_path, 'gdal_merge', '-q -windowed -o tmp/test_gdal_merge_6.tif tmp/in1.tif tmp/in2.tif tmp/in3.tif tmp/in4.tif')
+
+    ds = gdal.Open('tmp/test_gdal_merge_6.tif')
+    assert ds.RasterXSize == 20 and ds.RasterYSize == 20, \
+        ('Wrong raster dimensions : %d x %d' % (ds.RasterXSize, ds.RasterYSize))
+    assert ds.GetRasterBand(1).Checksum() == 3508, 'Wrong checksum'
+    ds = None
+
+    test_py_scripts.run_py_script(script_path, 'gdal_merge', '-q -windowed -init 255 -o tmp/test_gdal_merge_6_init.tif tmp/in2.tif tmp/in3.tif')
+
+    ds = gdal.Open('tmp/test_gdal_merge_6_init.tif')
+    assert ds.GetRasterBand(1).Checksum() == 4725, 'Wrong checksum'
+    ds = None
+
+    # alpha band
+    ds = gdal.Open('tmp/in6.tif')
+    cs = ds.GetRasterBand(4).Checksum()
+    ds = None
+
+    test_py_scripts.run_py_script(script_path, 'gdal_merge', '-q -windowed -o tmp/test_gdal_merge_6_alpha.tif tmp/in6.tif tmp/in5.tif')
+
+    ds = gdal.Open('tmp/test_gdal_merge_6_alpha.tif')
+    assert ds.GetRasterBand(1).Checksum() == 0, 'Wrong checksum'
+    assert ds.GetRasterBand(2).Checksum() == cs, 'Wrong checksum'
+    assert ds.GetRasterBand(3).Checksum() == 0, 'Wrong checksum'
+    assert ds.GetRasterBand(4).Checksum() == cs, 'Wrong checksum'
+    ds = None
+
+###############################################################################
+# Test -threads option
+
+
+def test_gdal_merge_7():
+    pytest.importorskip('numpy')
+
+    script_path = test_py_scripts.get_py_script('gdal_merge')
+    if script_path is None:
+        pytest.skip()
+
+    test_py_scripts.run_py_script(script_path, 'gdal_merge', '-q -threads 2 -co TILED=YES -co BLOCKXSIZE=16 -co BLOCKYSIZE=16 -o tmp/test_gdal_merge_7.tif tmp/in1.tif tmp/in2.tif tmp/in3.tif tmp/in4.tif')
+
+    ds = gdal.Open('tmp/test_gdal_merge_7.tif')
+    assert ds.GetRasterBand(1).Checksum() == 3508, 'Wrong checksum'
+    ds = None
+
+###############################################################################
+# Test -footprint_cache and -scan_threads options
+
+
+def test_gdal_merge_8():
+
+    script_path = test_py_scripts.get_py_script('gdal_merge')
+    if script_path is None:
+        pytest.skip()
+
+    # the second run uses the information of the input files from the cache
+    for options in ['-scan_threads 2', '']:
+        test_py_scripts.run_py_script(script_path, 'gdal_merge', '-q ' + options + ' -footprint_cache tmp/test_gdal_merge_8.sqlite -o tmp/test_gdal_merge_8.tif tmp/in1.tif tmp/in2.tif tmp/in3.tif tmp/in4.tif')
+        assert os.path.exists('tmp/test_gdal_merge_8.sqlite')
+
+        ds = gdal.Open('tmp/test_gdal_merge_8.tif')
+        assert ds.GetGeoTransform() == pytest.approx((2, 0.1, 0, 49, 0, -0.1))
+        assert ds.GetRasterBand(1).Checksum() == 3508, 'Wrong checksum'
+        ds = None
+        os.unlink('tmp/test_gdal_merge_8.tif')
+
+    # the files are cached under their absolute path
+    footprint_cache = pytest.importorskip('osgeo.utils.auxiliary.footprint_cache')
+    with footprint_cache.FootprintCache('tmp/test_gdal_merge_8.sqlite') as cache:
+        assert cache.get(os.path.abspath('tmp/in1.tif')) is not None
+        old_cwd = os.getcwd()
+        os.chdir('tmp')
+        try:
+            assert cache.get('in1.tif') is not None
+            assert cache.get('tmp/in1.tif') is None
+        finally:
+            os.chdir(old_cwd)
+
+###############################################################################
+# Test VRT output, and a CreateCopy() only format
+
+
+def test_gdal_merge_9():
+
+    script_path = test_py_scripts.get_py_script('gdal_merge')
+    if script_path is None:
+        pytest.skip()
+
+    test_py_scripts.run_py_script(script_path, 'gdal_merge', '-q -of VRT -o tmp/test_gdal_merge_9.vrt tmp/in1.tif tmp/in2.tif tmp/in3.tif tmp/in4.tif')
+
+    ds = gdal.Open('tmp/test_gdal_merge_9.vrt')
+    assert ds.GetDriver().ShortName == 'VRT'
+    assert ds.GetGeoTransform() == pytest.approx((2, 0.1, 0, 49, 0, -0.1))
+    assert ds.RasterXSize == 20 and ds.RasterYSize == 20, \
+        ('Wrong raster dimensions : %d x %d' % (ds.RasterXSize, ds.RasterYSize))
+    assert ds.GetRasterBand(1).Checksum() == 3508, 'Wrong checksum'
+    ds = None
+
+    test_py_scripts.run_py_script(script_path, 'gdal_merge', '-q -of VRT -init 255 -o tmp/test_gdal_merge_9_init.vrt tmp/in2.tif tmp/in3.tif')
+
+    ds = gdal.Open('tmp/test_gdal_merge_9_init.vrt')
+    assert ds.GetRasterBand(1).Checksum() == 4725, 'Wrong checksum'
+    ds = None
+
+    if gdal.GetDriverByName('COG') is None:
+        return
+
+    test_py_scripts.run_py_script(script_path, 'gdal_merge', '-q -of COG -o tmp/test_gdal_merge_9.tif tmp/in1.tif tmp/in2.tif tmp/in3.tif tmp/in4.tif')
+
+    ds = gdal.Open('tmp/test_gdal_merge_9.tif')
+    assert ds.GetMetadataItem('LAYOUT', 'IMAGE_STRUCTURE') == 'COG'
+    assert ds.GetRasterBand(1).Checksum() == 3508, 'Wrong checksum'
+    ds = None
+
 ###############################################################################
 # Cleanup
 
@@ -222,6 +347,14 @@ def test_gdal_merge_cleanup():
            'tmp/test_gdal_merge_3.tif',
            'tmp/test_gdal_merge_4.tif',
            'tmp/test_gdal_merge_5.tif',
+           'tmp/test_gdal_merge_6.tif',
+           'tmp/test_gdal_merge_6_init.tif',
+           'tmp/test_gdal_merge_6_alpha.tif',
+           'tmp/test_gdal_merge_7.tif',
+           'tmp/test_gdal_merge_8.sqlite',
+           'tmp/test_gdal_merge_9.vrt',
+           'tmp/test_gdal_merge_9_init.vrt',
+           'tmp/test_gdal_merge_9.tif',
            'tmp/in1.tif',
            'tmp/in2.tif',
            'tmp/in3.tif',
@@ -295,6 +295,74 @@ def test_gdal_retile_5():
     ds = None
 
 
+###############################################################################
+# Test gdal_retile.py -footprint_cache and -scan_threads
+
+
+def test_gdal_retile_6():
+
+    script_path = test_py_scripts.get_py_script('gdal_retile')
+    if script_path is None:
+        pytest.skip()
+
+    os.mkdir('tmp/outretile6')
+
+    # the second run uses the information of the input files from the cache
+    for options in ['-scan_threads 2', '']:
+        test_py_scripts.run_py_script(script_path, 'gdal_retile',
+                                      '-v -ps 8 8 -footprint_cache tmp/outretile6.sqlite ' + options +
+                                      ' -targetDir tmp/outretile6 ' +
+                                      test_py_scripts.get_data_path('gcore') + 'byte.tif')
+        assert os.path.exists('tmp/outretile6.sqlite')
+
+        ds = gdal.Open('tmp/outretile6/byte_1_1.tif')
+        assert ds.RasterXSize == 8 and ds.RasterYSize == 8
+        assert ds.GetGeoTransform() == pytest.approx((440720.0, 60.0, 0.0, 3751320.0, 0.0, -60.0))
+        ds = None
+        ds = gdal.Open('tmp/outretile6/byte_3_3.tif')
+        assert ds.RasterXSize == 4 and ds.RasterYSize == 4
+        ds = None
+        shutil.rmtree('tmp/outretile6')
+        os.mkdir('tmp/outretile6')
+
+
+###############################################################################
+# Test gdal_retile.py -processes and -threads
+
+
+def test_gdal_retile_7():
+
+    script_path = test_py_scripts.get_py_script('gdal_retile')
+    if script_path is None:
+        pytest.skip()
+
+    results = []
+    for options in ['', '-processes 2', '-threads 2']:
+        target_dir = 'tmp/outretile7_%d' % len(results)
+        os.mkdir(target_dir)
+        test_py_scripts.run_py_script(script_path, 'gdal_retile', '-v -levels 1 -ps 8 8 -csv tiles.csv ' + options +
+                                      ' -targetDir ' + target_dir + ' ' +
+                                      test_py_scripts.get_data_path('gcore') + 'byte.tif')
+
+        checksums = {}
+        for dirname in (target_dir, target_dir + '/1'):
+            for filename in os.listdir(dirname):
+                if filename.endswith('.tif'):
+                    ds = gdal.Open(dirname + '/' + filename)
+                    checksums[filename if dirname == target_dir else '1/' + filename] = \
+                        ds.GetRasterBand(1).Checksum()
+                    ds = None
+        with open(target_dir + '/tiles.csv') as f:
+            csv = f.read()
+        with open(target_dir + '/1/tiles.csv') as f:
+            csv_1 = f.read()
+        results.append((checksums, csv, csv_1))
+
+    assert len(results[0][0]) == 13
+    assert results[1] == results[0]
+    assert results[2] == results[0]
+
+
 ###############################################################################
 # Cleanup
 
@@ -336,3 +404,11 @@ def test_gdal_retile_cleanup():
     if os.path.exists('tmp/outretile5'):
         shutil.rmtree('tmp/outretile5')
 
+    if os.path.exists('tmp/outretile6'):
+        shutil.rmtree('tmp/outretile6')
+    if os.path.exists('tmp/outretile6.sqlite'):
+        os.remove('tmp/outretile6.sqlite')
+
+    for i in range(3):
+        if os.path.exists('tmp/outretile7_%d' % i):
+            shutil.rmtree('tmp/outretile7_%d' % i)
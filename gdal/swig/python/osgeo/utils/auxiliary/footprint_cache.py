@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ******************************************************************************
+#
+#  Project:  GDAL utils.auxiliary
+#  Purpose:  persistent cache of the footprints and metadata of raster files
+#
+# ******************************************************************************
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a
+#  copy of this software and associated documentation files (the "Software"),
+#  to deal in the Software without restriction, including without limitation
+#  the rights to use, copy, modify, merge, publish, distribute, sublicense,
+#  and/or sell copies of the Software, and to permit persons to whom the
+#  Software is furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included
+#  in all copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+#  OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+#  THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+#  FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+#  DEALINGS IN THE SOFTWARE.
+# ******************************************************************************
+
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence, List
+
+from osgeo import gdal
+from osgeo.utils.auxiliary.base import PathLike
+
+
+class FootprintCache:
+    """
+    A sqlite file caching the size, geotransform, band types, projection and color table of raster files,
+    keyed by their absolute path, modification time and size, to avoid opening them again on later runs.
+    """
+
+    def __init__(self, filename: PathLike):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(filename), check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS footprints '
+                          '(path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, info TEXT)')
+
+    def close(self):
+        if self.conn is not None:
+            with self.lock:
+                self.conn.commit()
+                self.conn.close()
+                self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def get_key(filename: PathLike):
+        """ returns the (absolute path, mtime, size) key of a file, or None if it can't be stat'ed """
+        path = str(filename)
+        stat = gdal.VSIStatL(path)
+        if stat is None:
+            return None
+        if not path.startswith('/vsi'):
+            # the same relative path from another directory is another file
+            path = os.path.abspath(path)
+        return path, stat.mtime, stat.size
+
+    def get(self, filename: PathLike) -> Optional[dict]:
+        """ returns the cached info of a file, or None if it is not cached or has changed """
+        key = self.get_key(filename)
+        if key is None:
+            return None
+        with self.lock:
+            row = self.conn.execute('SELECT info FROM footprints WHERE path = ? AND mtime = ? AND size = ?',
+                                    key).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, filename: PathLike, info: dict):
+        key = self.get_key(filename)
+        if key is None:
+            return
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO footprints VALUES (?, ?, ?, ?)', key + (json.dumps(info),))
+
+
+def get_raster_info(filename: PathLike, cache: Optional[FootprintCache] = None) -> Optional[dict]:
+    """
+    returns a dict with the xsize, ysize, bands, band_types, projection, geotransform and color_table
+    (a list of color entries, or None) of a raster file, from the cache if it is given and up to date.
+    returns None if the file can't be opened.
+    """
+    info = cache.get(filename) if cache is not None else None
+    if info is not None:
+        return info
+
+    ds = gdal.Open(str(filename))
+    if ds is None:
+        return None
+    ct = ds.GetRasterBand(1).GetRasterColorTable()
+    info = dict(
+        xsize=ds.RasterXSize,
+        ysize=ds.RasterYSize,
+        bands=ds.RasterCount,
+        band_types=[ds.GetRasterBand(i + 1).DataType for i in range(ds.RasterCount)],
+        projection=ds.GetProjection(),
+        geotransform=list(ds.GetGeoTransform()),
+        color_table=None if ct is None else [list(ct.GetColorEntry(i)) for i in range(ct.GetCount())])
+    ds = None
+
+    if cache is not None:
+        cache.put(filename, info)
+    return info
+
+
+def get_raster_infos(filenames: Sequence[PathLike], cache: Optional[FootprintCache] = None,
+                     num_threads: int = 1) -> List[Optional[dict]]:
+    """ returns the get_raster_info() of each file, opening the files that are not cached with num_threads threads """
+    if num_threads <= 1 or len(filenames) <= 1:
+        return [get_raster_info(filename, cache) for filename in filenames]
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        return list(executor.map(lambda filename: get_raster_info(filename, cache), filenames))
+
+
+def color_table_from_entries(entries: Optional[Sequence[Sequence[int]]]) -> Optional[gdal.ColorTable]:
+    """ returns a ColorTable with the given color entries, or None """
+    if entries is None:
+        return None
+    ct = gdal.ColorTable()
+    for i, entry in enumerate(entries):
+        ct.SetColorEntry(i, tuple(entry))
+    return ct
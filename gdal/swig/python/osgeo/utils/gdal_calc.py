@@ -53,15 +53,26 @@
 from numbers import Number
 from typing import Union, Tuple, Optional, Sequence
 from optparse import OptionParser, OptionConflictError, Values
+import math
 import os
 import os.path
 import sys
 import shlex
 import string
-from collections import defaultdict
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape, quoteattr
 
 import numpy
 
+try:
+    import numexpr
+    numexpr_available = True
+except ImportError:
+    # the numexpr engine is not available
+    numexpr_available = False
+
 from osgeo import gdal
 from osgeo import gdal_array
 from osgeo.utils.auxiliary.base import is_path_like, PathLike
@@ -85,6 +96,410 @@ DefaultNDVLookup = {gdal.GDT_Byte: 255, gdal.GDT_UInt16: 65535, gdal.GDT_Int16:
 GDALDataTypeNames = tuple(gdal.GetDataTypeName(dt) for dt in DefaultNDVLookup.keys())
 
 
+def get_window_size(block_sizes: Sequence[Sequence[int]], dimensions: Sequence[int],
+                    window_size: Optional[Sequence[int]] = None, max_memory: Optional[Number] = None,
+                    bytes_per_pixel: Number = 1) -> Optional[Tuple[int, int]]:
+    """
+    returns a processing window size (x, y) that is a multiple of all the given block sizes
+    (or that spans the whole raster), so that reading and writing it does not split any block.
+    window_size is the requested window size in pixels, it is rounded up to the block alignment.
+    max_memory is a memory budget in bytes, the largest window that fits in it is used,
+    preferring windows that span the whole width of the raster.
+    returns None if neither window_size nor max_memory is given.
+    """
+    align = [1, 1]
+    for block_size in block_sizes:
+        for i in range(2):
+            align[i] = align[i] * block_size[i] // math.gcd(align[i], block_size[i])
+    align = [min(a, d) for a, d in zip(align, dimensions)]
+
+    if window_size:
+        return tuple(min(-(-max(w, 1) // a) * a, d) for w, a, d in zip(window_size, align, dimensions))
+    elif max_memory:
+        max_pixels = max(1, int(max_memory / bytes_per_pixel))
+        if dimensions[0] * align[1] <= max_pixels:
+            x = dimensions[0]
+            y = min(max(align[1], max_pixels // x // align[1] * align[1]), dimensions[1])
+        else:
+            x = min(max(align[0], max_pixels // align[1] // align[0] * align[0]), dimensions[0])
+            y = align[1]
+        return x, y
+    return None
+
+
+class BlockBuffers:
+    """ numpy arrays that are reused from block to block, instead of allocating new ones for every block """
+
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, key, shape, dtype) -> numpy.ndarray:
+        """ returns the buffer of the given key, shape and dtype, its content is undefined """
+        dtype = numpy.dtype(dtype)
+        buf = self.buffers.get((key, shape, dtype))
+        if buf is None:
+            buf = numpy.empty(shape, dtype)
+            self.buffers[(key, shape, dtype)] = buf
+        return buf
+
+
+def read_block(ds, band_no, filename, xoff, yoff, xsize, ysize, lock=None, buf_obj=None):
+    """ reads a window of the given band of an input dataset, into buf_obj if it is given """
+    if lock is not None:
+        with lock:
+            return read_block(ds, band_no, filename, xoff, yoff, xsize, ysize, buf_obj=buf_obj)
+    myval = gdal_array.BandReadAsArray(ds.GetRasterBand(band_no),
+                                       xoff=xoff, yoff=yoff,
+                                       win_xsize=xsize, win_ysize=ysize, buf_obj=buf_obj)
+    if myval is None:
+        raise Exception('Input block reading failed from filename %s' % filename)
+    return myval
+
+
+def read_bands(ds, band_list, filename, xoff, yoff, xsize, ysize, lock=None, buf_obj=None):
+    """ reads a window of several bands of an input dataset at once, into buf_obj if it is given """
+    if lock is not None:
+        with lock:
+            return read_bands(ds, band_list, filename, xoff, yoff, xsize, ysize, buf_obj=buf_obj)
+    myval = gdal_array.DatasetReadAsArray(ds, xoff=xoff, yoff=yoff, win_xsize=xsize, win_ysize=ysize,
+                                          buf_obj=buf_obj, band_list=band_list)
+    if myval is None:
+        raise Exception('Input block reading failed from filename %s' % filename)
+    return myval
+
+
+def is_empty_block(ds, band_no, xoff, yoff, xsize, ysize, lock=None):
+    """ returns True if the given band reports that it has no data in the given window (i.e. sparse blocks) """
+    if lock is not None:
+        with lock:
+            return is_empty_block(ds, band_no, xoff, yoff, xsize, ysize)
+    flags, _ = ds.GetRasterBand(band_no).GetDataCoverageStatus(
+        xoff, yoff, xsize, ysize, gdal.GDAL_DATA_COVERAGE_STATUS_DATA)
+    return flags == gdal.GDAL_DATA_COVERAGE_STATUS_EMPTY
+
+
+def accumulate_ndv(myNDVs, myval, ndv, out=None, tmp=None):
+    """
+    marks the cells of myval that equal to ndv in the boolean myNDVs buffer.
+    the marks are accumulated into out, or in place if out is not given (a new buffer if myNDVs is None),
+    tmp is an optional boolean buffer for the intermediate comparison.
+    """
+    # myNDVs is a boolean buffer.
+    # a cell is True if there is NDV in any of the corresponding cells in input raster bands.
+    if myNDVs is None:
+        # this is the first band that has NDV set.
+        return numpy.equal(myval, ndv, out=out)
+    return numpy.logical_or(myNDVs, numpy.equal(myval, ndv, out=tmp), out=myNDVs if out is None else out)
+
+
+def ndv_fits_dtype(ndv: Number, dtype) -> bool:
+    """ returns True if the nodata value can be stored in an array of the given dtype """
+    dtype = numpy.dtype(dtype)
+    if dtype.kind == 'f':
+        return math.isnan(ndv) or abs(ndv) <= numpy.finfo(dtype).max or math.isinf(ndv)
+    elif dtype.kind in 'iu':
+        return float(ndv).is_integer() and numpy.iinfo(dtype).min <= ndv <= numpy.iinfo(dtype).max
+    return dtype.kind == 'c'
+
+
+def propagate_ndv(myResult, myNDVs, myOutNDV, xsize, ysize, out_dtype=numpy.float64, buf=None, own_result=False):
+    """
+    returns the result with the output nodata value in the cells that are marked in the boolean myNDVs buffer.
+    the result is converted to out_dtype if that does not change its values (otherwise to the type
+    that numpy promotes the result and the nodata value to).
+    buf(dtype) returns an array to put the result in, a new array is allocated if it is not given.
+    if own_result is True, the result array is modified in place when it is already of the right type.
+    """
+    if myNDVs is None or myOutNDV is None:
+        if not isinstance(myResult, numpy.ndarray):
+            myResult = numpy.full((ysize, xsize), myResult)
+        return myResult
+
+    result_dtype = numpy.asarray(myResult).dtype
+    if numpy.can_cast(result_dtype, out_dtype) and ndv_fits_dtype(myOutNDV, out_dtype):
+        dtype = numpy.dtype(out_dtype)
+    else:
+        dtype = numpy.result_type(result_dtype, numpy.asarray(myOutNDV).dtype)
+
+    if own_result and result_dtype == dtype and myResult.shape == (ysize, xsize):
+        out = myResult
+    else:
+        out = numpy.empty((ysize, xsize), dtype) if buf is None else buf(dtype)
+        numpy.copyto(out, myResult, casting='unsafe')
+    numpy.putmask(out, myNDVs, myOutNDV)
+    return out
+
+
+def get_hist_edges(hist_bins: Union[int, Sequence[Number]] = 256,
+                   hist_range: Optional[Tuple[Number, Number]] = None) -> Optional[numpy.ndarray]:
+    """
+    returns the bin edges of a histogram, given as a number of bins in hist_range, or as a sequence of edges.
+    returns None for a number of bins without hist_range.
+    """
+    if not isinstance(hist_bins, Number):
+        return numpy.asarray(hist_bins, dtype=numpy.float64)
+    if hist_range is None:
+        return None
+    return numpy.linspace(hist_range[0], hist_range[1], int(hist_bins) + 1)
+
+
+class BlockReducer:
+    """ computes an aggregate of the results of a calculation, block by block """
+
+    reductions = ('sum', 'count', 'min', 'max', 'mean', 'histogram')
+
+    def __init__(self, reduce: str, hist_bins: Union[int, Sequence[Number]] = 256,
+                 hist_range: Optional[Tuple[Number, Number]] = None):
+        if reduce not in self.reductions:
+            raise Exception("Error! Unknown reduction %s, must be one of %s" % (reduce, self.reductions))
+        self.reduce = reduce
+        self.n = 0  # number of valid values
+        self.value = None
+        self.hist_edges = None
+        if reduce == 'histogram':
+            self.hist_edges = get_hist_edges(hist_bins, hist_range)
+            if self.hist_edges is None:
+                raise Exception("Error! A histogram with a number of bins requires hist_range")
+            self.value = numpy.zeros(len(self.hist_edges) - 1, dtype=numpy.int64)
+
+    def add(self, values: numpy.ndarray):
+        """ adds the (valid) values of a block to the aggregate """
+        if values.size == 0:
+            return
+        self.n += values.size
+        if self.reduce in ('sum', 'mean'):
+            s = values.sum(dtype=numpy.float64 if values.dtype.kind == 'f' else None)
+            self.value = s if self.value is None else self.value + s
+        elif self.reduce == 'count':
+            self.value = (self.value or 0) + numpy.count_nonzero(values)
+        elif self.reduce == 'min':
+            m = values.min()
+            self.value = m if self.value is None else min(self.value, m)
+        elif self.reduce == 'max':
+            m = values.max()
+            self.value = m if self.value is None else max(self.value, m)
+        else:
+            self.value += numpy.histogram(values, bins=self.hist_edges)[0]
+
+    def result(self):
+        """
+        returns the aggregate: a number, None for min/max/mean without any valid value,
+        or (counts, bin edges) for a histogram
+        """
+        if self.reduce == 'histogram':
+            return self.value, self.hist_edges
+        elif self.reduce == 'mean':
+            return None if self.n == 0 else self.value / self.n
+        elif self.reduce in ('sum', 'count') and self.value is None:
+            return 0
+        return self.value
+
+
+class BandStatistics:
+    """
+    computes the statistics (and optionally the default histogram) of an output band from the blocks that are
+    written to it, and stores them in the band like ComputeStatistics() and GetDefaultHistogram() do.
+    """
+
+    def __init__(self, dtype, nodata: Optional[Number] = None, histogram: bool = False,
+                 hist_bins: Union[int, Sequence[Number]] = 256,
+                 hist_range: Optional[Tuple[Number, Number]] = None):
+        self.dtype = numpy.dtype(dtype)
+        if self.dtype.kind == 'c':
+            raise Exception("Error! Statistics of complex bands are not supported")
+        self.nodata = nodata
+        self.n = 0  # number of valid values
+        self.min = self.max = None
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of the squared differences from the mean
+        self.hist_edges = None
+        self.hist_counts = None
+        self.value_counts = None
+        if histogram:
+            if not isinstance(hist_bins, Number):
+                raise Exception("Error! The histogram of a band requires a number of bins")
+            self.hist_edges = get_hist_edges(hist_bins, hist_range)
+            if self.hist_edges is not None:
+                self.hist_counts = numpy.zeros(len(self.hist_edges) - 1, dtype=numpy.int64)
+            elif self.dtype.kind in 'iu' and self.dtype.itemsize <= 2:
+                # each value is counted, the default range of the histogram is only known at the end
+                self.hist_bins = int(hist_bins)
+                self.value_offset = numpy.iinfo(self.dtype).min
+                self.value_counts = numpy.zeros(numpy.iinfo(self.dtype).max - self.value_offset + 1,
+                                                dtype=numpy.int64)
+            else:
+                raise Exception("Error! The histogram of a %s band requires hist_range" % self.dtype.name)
+
+    def add(self, myResult: numpy.ndarray):
+        """ adds the values of a block, as they are written to the band """
+        values = numpy.asarray(myResult).ravel()
+        if values.dtype != self.dtype:
+            if self.dtype.kind in 'iu' and values.dtype.kind == 'f':
+                # round and clip like GDAL does
+                info = numpy.iinfo(self.dtype)
+                values = numpy.clip(numpy.trunc(values + numpy.copysign(0.5, values)), info.min, info.max)
+            elif self.dtype.kind in 'iu' and values.dtype.kind in 'iu':
+                # clip like GDAL does, the values of a wider type would wrap around with astype()
+                info = numpy.iinfo(self.dtype)
+                values_info = numpy.iinfo(values.dtype)
+                if values_info.min < info.min or values_info.max > info.max:
+                    values = numpy.clip(values, max(info.min, values_info.min), min(info.max, values_info.max))
+            values = values.astype(self.dtype)
+        if self.nodata is not None:
+            values = values[~numpy.isnan(values)] if math.isnan(self.nodata) else values[values != self.nodata]
+        if self.dtype.kind == 'f':
+            values = values[~numpy.isnan(values)]
+        if values.size == 0:
+            return
+
+        # combine the mean and variance of the block with the previous ones
+        n = values.size
+        mean = values.mean(dtype=numpy.float64)
+        m2 = numpy.square(values - mean, dtype=numpy.float64).sum()
+        delta = mean - self.mean
+        total = self.n + n
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.mean += delta * n / total
+        self.n = total
+        self.min = values.min() if self.min is None else min(self.min, values.min())
+        self.max = values.max() if self.max is None else max(self.max, values.max())
+
+        if self.hist_counts is not None:
+            self.hist_counts += numpy.histogram(values, bins=self.hist_edges)[0]
+        elif self.value_counts is not None:
+            self.value_counts += numpy.bincount(values.astype(numpy.int64) - self.value_offset,
+                                                minlength=len(self.value_counts))
+
+    def set_band(self, band):
+        """ stores the statistics and the histogram in the band """
+        if self.n == 0:
+            return  # no valid values
+        band.SetStatistics(float(self.min), float(self.max), self.mean, math.sqrt(self.m2 / self.n))
+        band.SetMetadataItem('STATISTICS_VALID_PERCENT', '%.4g' % (100.0 * self.n / (band.XSize * band.YSize)))
+        if self.value_counts is not None:
+            # the default histogram range of GDAL
+            if self.dtype == numpy.uint8:
+                hist_min, hist_max = -0.5, 255.5
+            else:
+                hist_min, hist_max = float(self.min), float(self.max)
+                half_bucket = (hist_max - hist_min) / (2.0 * (self.hist_bins - 1)) if hist_max > hist_min else 0.5
+                hist_min, hist_max = hist_min - half_bucket, hist_max + half_bucket
+            self.hist_edges = numpy.linspace(hist_min, hist_max, self.hist_bins + 1)
+            values = numpy.arange(len(self.value_counts)) + self.value_offset
+            self.hist_counts = numpy.histogram(values, bins=self.hist_edges, weights=self.value_counts)[0]
+        if self.hist_counts is not None:
+            band.SetDefaultHistogram(float(self.hist_edges[0]), float(self.hist_edges[-1]),
+                                     [int(count) for count in self.hist_counts])
+
+
+def get_global_namespace():
+    """ returns the global namespace for eval with all functions of gdal_array, numpy """
+    return {key: getattr(module, key)
+            for module in [gdal_array, numpy] for key in dir(module) if not key.startswith('__')}
+
+
+class CalcExpression:
+    """
+    a calculation that is compiled once and evaluated for each block.
+    with the numexpr engine, the calculation is evaluated by numexpr (in chunks, without the temporary array
+    of each operation) when numexpr supports it and the types of its inputs, otherwise it is evaluated by numpy.
+    """
+
+    engines = ('numpy', 'numexpr')
+    numexpr_types = (numpy.bool_, numpy.int32, numpy.int64, numpy.float32, numpy.float64, numpy.complex128)
+
+    def __init__(self, calc: str, engine: str = 'numpy'):
+        if engine not in self.engines:
+            raise Exception("Error! Unknown engine %s, must be one of %s" % (engine, self.engines))
+        if engine == 'numexpr' and not numexpr_available:
+            raise Exception("Error! The numexpr engine requires the numexpr module")
+        self.calc = calc
+        self.code = compile(calc, '<calc>', 'eval')
+        self.use_numexpr = engine == 'numexpr'
+
+    def evaluate(self, global_namespace, local_namespace):
+        if self.use_numexpr and all(isinstance(myval, numpy.ndarray) and myval.dtype.type in self.numexpr_types
+                                    for myval in local_namespace.values()):
+            try:
+                myResult = numexpr.evaluate(self.calc, local_dict=local_namespace, global_dict={})
+                return myResult[()] if myResult.ndim == 0 else myResult
+            except (KeyError, NotImplementedError, SyntaxError, TypeError, ValueError):
+                # not supported by numexpr, this call is evaluated by numpy
+                # (the expression is shared by the worker threads, so it is not changed)
+                pass
+        return eval(self.code, global_namespace, local_namespace)
+
+
+vrt_global_namespace = None
+vrt_expressions = {}  # compiled calculations of the VRT pixel function
+
+
+def vrt_pixel_function(in_ar, out_ar, xoff, yoff, xsize, ysize, raster_xsize, raster_ysize, buf_radius, gt,
+                       calc, alphas, alpha_lists, data_types, nodata, out_nodata, **kwargs):
+    """
+    VRT python pixel function that evaluates a gdal_calc expression, used by the VRT output format.
+    the sources are given as Float64 arrays, and are converted back to their original data types,
+    the arguments are the comma separated alpha letter, data type name and nodata value of each source.
+    """
+    # pylint: disable=unused-argument
+    global vrt_global_namespace
+    if vrt_global_namespace is None:
+        vrt_global_namespace = get_global_namespace()
+
+    # the buffers can be of another size than the window (overviews, RasterIO with a buffer size)
+    ysize, xsize = out_ar.shape
+    myNDVs = None
+    local_namespace = {}
+    val_lists = defaultdict(list)
+    myAlphaFileLists = alpha_lists.split(',') if alpha_lists else []
+    for myval, Alpha, dt, ndv in zip(in_ar, alphas.split(','), data_types.split(','), nodata.split(',')):
+        myval = myval.astype(gdal_array.GDALTypeCodeToNumericTypeCode(gdal.GetDataTypeByName(dt)), copy=False)
+        if ndv != 'None':
+            myNDVs = accumulate_ndv(myNDVs, myval, float(ndv))
+        if Alpha in myAlphaFileLists:
+            val_lists[Alpha].append(myval)
+        else:
+            local_namespace[Alpha] = myval
+    for lst in myAlphaFileLists:
+        local_namespace[lst] = val_lists[lst]
+
+    if calc not in vrt_expressions:
+        vrt_expressions[calc] = CalcExpression(calc)
+    myResult = vrt_expressions[calc].evaluate(vrt_global_namespace, local_namespace)
+    out_ar[:] = propagate_ndv(myResult, myNDVs, None if out_nodata == 'None' else float(out_nodata), xsize, ysize,
+                              out_ar.dtype)
+
+
+def get_vrt_xml(dimensions: Sequence[int], data_type: GDALDataType, calcs: Sequence[str],
+                band_sources: Sequence[Sequence[Tuple[str, int]]], alphas: Sequence[str],
+                alpha_lists: Sequence[str], data_types: Sequence[GDALDataType],
+                nodata: Sequence[Optional[Number]], out_nodata: Optional[Number]) -> str:
+    """
+    returns the xml of a VRT dataset with a VRTDerivedRasterBand for each calc.
+    band_sources holds the (filename, band) of each alpha for each output band.
+    """
+    vrt = ['<VRTDataset rasterXSize="%d" rasterYSize="%d">' % (dimensions[0], dimensions[1])]
+    for bandNo, (calc, sources) in enumerate(zip(calcs, band_sources), start=1):
+        args = dict(calc=calc, alphas=','.join(alphas), alpha_lists=','.join(alpha_lists),
+                    data_types=','.join(gdal.GetDataTypeName(dt) for dt in data_types),
+                    nodata=','.join(repr(v if v is None else float(v)) for v in nodata),
+                    out_nodata=repr(out_nodata if out_nodata is None else float(out_nodata)))
+        vrt.append('  <VRTRasterBand dataType="%s" band="%d" subClass="VRTDerivedRasterBand">' %
+                   (gdal.GetDataTypeName(data_type), bandNo))
+        vrt.append('    <PixelFunctionLanguage>Python</PixelFunctionLanguage>')
+        vrt.append('    <PixelFunctionType>osgeo.utils.gdal_calc.vrt_pixel_function</PixelFunctionType>')
+        vrt.append('    <PixelFunctionArguments %s/>' % ' '.join('%s=%s' % (k, quoteattr(v)) for k, v in args.items()))
+        vrt.append('    <SourceTransferType>Float64</SourceTransferType>')
+        for filename, band in sources:
+            vrt.append('    <SimpleSource>')
+            vrt.append('      <SourceFilename relativeToVRT="0">%s</SourceFilename>' % escape(filename))
+            vrt.append('      <SourceBand>%d</SourceBand>' % band)
+            vrt.append('    </SimpleSource>')
+        vrt.append('  </VRTRasterBand>')
+    vrt.append('</VRTDataset>')
+    return '\n'.join(vrt) + '\n'
+
+
 def doit(opts, args):
     # pylint: disable=unused-argument
 
@@ -92,23 +507,52 @@ def doit(opts, args):
         print("gdal_calc.py starting calculation %s" % (opts.calc))
 
     # set up global namespace for eval with all functions of gdal_array, numpy
-    global_namespace = {key: getattr(module, key)
-                        for module in [gdal_array, numpy] for key in dir(module) if not key.startswith('__')}
+    global_namespace = get_global_namespace()
 
     if opts.user_namespace:
         global_namespace.update(opts.user_namespace)
 
+    for key in ("reduce", "hist_range"):
+        if not hasattr(opts, key):
+            setattr(opts, key, None)
+    if not getattr(opts, "hist_bins", None):
+        opts.hist_bins = 256
+    if not getattr(opts, "engine", None):
+        opts.engine = 'numpy'
+    for key in ("statistics", "histogram"):
+        if not hasattr(opts, key):
+            setattr(opts, key, False)
+    opts.statistics = opts.statistics or opts.histogram
+
     if not opts.calc:
         raise Exception("No calculation provided.")
-    elif not opts.outF and opts.format.upper() != 'MEM':
+    elif not opts.outF and not opts.reduce and opts.format.upper() != 'MEM':
         raise Exception("No output file provided.")
 
+    # each calculation is compiled once, and evaluated for each block
+    myCalcs = [CalcExpression(calc, opts.engine) for calc in opts.calc]
+
     if opts.format is None:
         opts.format = GetOutputDriverFor(opts.outF)
 
+    # with the VRT format the calculation is not done here,
+    # but by a python pixel function whenever the output is read
+    myOutIsVRT = opts.format.upper() == 'VRT' and not opts.reduce
+    if myOutIsVRT and opts.user_namespace:
+        raise Exception("Error! user_namespace can not be used with the VRT format")
+    if opts.statistics and (myOutIsVRT or opts.reduce):
+        raise Exception("Error! statistics can not be computed with the VRT format or with a reduction")
+
     if not hasattr(opts, "color_table"):
         opts.color_table = None
 
+    if not getattr(opts, "num_threads", None):
+        opts.num_threads = 1
+
+    for key in ("window_size", "max_memory"):
+        if not hasattr(opts, key):
+            setattr(opts, key, None)
+
     if isinstance(opts.extent, GeoRectangle):
         pass
     elif opts.projwin:
@@ -154,6 +598,8 @@ def doit(opts, args):
     GeoTransforms = []  # GeoTransform of each input file
     GeoTransformDiffer = False  # True if we have inputs with different GeoTransforms
     myTempFileNames = []  # vrt filename from each input file
+    myOpenNames = []  # filename to reopen each input with, None if it was given as a Dataset
+    myOpenedFiles = {}  # input DataSets by filename
     myAlphaFileLists = []  # list of the Alphas which holds a list of inputs
 
     # loop through input files - checking dimensions
@@ -168,6 +614,8 @@ def doit(opts, args):
         else:
             # I guess this alphas should be in the global_namespace,
             # It would have been better to pass it as user_namepsace, but I'll accept it anyway
+            if myOutIsVRT:
+                raise Exception("Error! input %s is not a raster, this is not supported with the VRT format" % alphas)
             global_namespace[alphas] = filenames
             continue
         for alpha, filename in zip(alphas*len(filenames), filenames):
@@ -184,11 +632,14 @@ def doit(opts, args):
                     filename = None
                 else:
                     filename = str(filename)
-                    myFile = gdal.Open(filename, gdal.GA_ReadOnly)
+                    # a file that is used by several alphas is opened once, so its bands can be read together
+                    myFile = myOpenedFiles.get(filename) or gdal.Open(filename, gdal.GA_ReadOnly)
+                    myOpenedFiles[filename] = myFile
                 if not myFile:
                     raise IOError("No such file or directory: '%s'" % filename)
 
                 myFileNames.append(filename)
+                myOpenNames.append(filename)
                 myFiles.append(myFile)
                 myBands.append(myBand)
                 myAlphaList.append(alpha)
@@ -261,9 +712,16 @@ def doit(opts, args):
             GeoTransforms, Dimensions, opts.extent)
         if GeoTransformCheck is None:
             raise Exception("Error! The requested extent is empty. Cannot proceed")
+        if myOutIsVRT:
+            raise Exception("Error! mixing different extents is not supported with the VRT format")
+        myTempVRTs = {}  # a single vrt for each input dataset
         for i in range(len(myFileNames)):
-            temp_vrt_filename, temp_vrt_ds = extent_util.make_temp_vrt(myFiles[i], ExtentCheck)
-            myTempFileNames.append(temp_vrt_filename)
+            if id(myFiles[i]) not in myTempVRTs:
+                myTempVRTs[id(myFiles[i])] = extent_util.make_temp_vrt(myFiles[i], ExtentCheck)
+                myTempFileNames.append(myTempVRTs[id(myFiles[i])][0])
+            temp_vrt_filename, temp_vrt_ds = myTempVRTs[id(myFiles[i])]
+            if myOpenNames[i] is not None:
+                myOpenNames[i] = temp_vrt_filename
             myFiles[i] = None  # close original ds
             myFiles[i] = temp_vrt_ds  # replace original ds with vrt_ds
 
@@ -271,13 +729,24 @@ def doit(opts, args):
             GeoTransformCheck = temp_vrt_ds.GetGeoTransform()
             DimensionsCheck = [temp_vrt_ds.RasterXSize, temp_vrt_ds.RasterYSize]
         temp_vrt_ds = None
+        myTempVRTs = None
 
     ################################################################
     # set up output file
     ################################################################
 
+    if opts.reduce:
+        # no output file, the results are reduced to an aggregate for each output band
+        myReducers = [BlockReducer(opts.reduce, opts.hist_bins, opts.hist_range) for _ in range(allBandsCount)]
+        myOut = None
+        myOutIsNew = False
+        myOutNDV = None
+        myOutType = max(myDataTypeNum)
+
     # open output file exists
-    if opts.outF and os.path.isfile(opts.outF) and not opts.overwrite:
+    elif opts.outF and os.path.isfile(opts.outF) and not opts.overwrite:
+        if myOutIsVRT:
+            raise Exception("Error! VRT format was given but Output file exists, must use --overwrite option!")
         if allBandsIndex is not None:
             raise Exception("Error! allBands option was given but Output file exists, must use --overwrite option!")
         if len(opts.calc) > 1:
@@ -302,8 +771,10 @@ def doit(opts, args):
         myOutB = myOut.GetRasterBand(1)
         myOutNDV = myOutB.GetNoDataValue()
         myOutType = myOutB.DataType
+        myOutIsNew = False
 
     else:
+        myOutIsNew = True
         if opts.outF:
             # remove existing file and regenerate
             if os.path.isfile(opts.outF):
@@ -323,11 +794,42 @@ def doit(opts, args):
             if isinstance(myOutType, str):
                 myOutType = gdal.GetDataTypeByName(myOutType)
 
+        if opts.NoDataValue is None:
+            myOutNDV = None if opts.hideNoData else DefaultNDVLookup[myOutType]  # use the default noDataValue for this datatype
+        elif isinstance(opts.NoDataValue, str) and opts.NoDataValue.lower() == 'none':
+            myOutNDV = None  # not to set any noDataValue
+        else:
+            myOutNDV = opts.NoDataValue  # use the given noDataValue
+
         # create file
-        myOutDrv = gdal.GetDriverByName(opts.format)
-        myOut = myOutDrv.Create(
-            opts.outF, DimensionsCheck[0], DimensionsCheck[1], allBandsCount,
-            myOutType, opts.creation_options)
+        if myOutIsVRT:
+            # a VRTDerivedRasterBand for each output band, with all the inputs as its sources
+            myBandSources = []
+            for bandNo in range(1, allBandsCount + 1):
+                mySources = []
+                for i, (myOpenName, myFile) in enumerate(zip(myOpenNames, myFiles)):
+                    myVRTSourceName = myOpenName or myFile.GetDescription()
+                    if not myVRTSourceName or myFile.GetDriver().ShortName.upper() == 'MEM':
+                        raise Exception("Error! input %s is not backed by a file, this is not supported with "
+                                        "the VRT format" % myAlphaList[i])
+                    if os.path.isfile(myVRTSourceName):
+                        myVRTSourceName = os.path.abspath(myVRTSourceName)
+                    mySources.append((myVRTSourceName, bandNo if i == allBandsIndex else myBands[i]))
+                myBandSources.append(mySources)
+            myVRTCalcs = opts.calc if len(opts.calc) > 1 else opts.calc * allBandsCount
+            myVRTXml = get_vrt_xml(DimensionsCheck, myOutType, myVRTCalcs, myBandSources, myAlphaList,
+                                   myAlphaFileLists, myDataTypeNum, myNDV, myOutNDV)
+            f = gdal.VSIFOpenL(opts.outF, 'wb')
+            if f is None:
+                raise IOError("Cannot create %s" % opts.outF)
+            gdal.VSIFWriteL(myVRTXml, 1, len(myVRTXml), f)
+            gdal.VSIFCloseL(f)
+            myOut = gdal.Open(opts.outF, gdal.GA_Update)
+        else:
+            myOutDrv = gdal.GetDriverByName(opts.format)
+            myOut = myOutDrv.Create(
+                opts.outF, DimensionsCheck[0], DimensionsCheck[1], allBandsCount,
+                myOutType, opts.creation_options)
 
         # set output geo info based on first input layer
         if not GeoTransformCheck:
@@ -340,13 +842,6 @@ def doit(opts, args):
         if ProjectionCheck:
             myOut.SetProjection(ProjectionCheck)
 
-        if opts.NoDataValue is None:
-            myOutNDV = None if opts.hideNoData else DefaultNDVLookup[myOutType]  # use the default noDataValue for this datatype
-        elif isinstance(opts.NoDataValue, str) and opts.NoDataValue.lower() == 'none':
-            myOutNDV = None  # not to set any noDataValue
-        else:
-            myOutNDV = opts.NoDataValue  # use the given noDataValue
-
         for i in range(1, allBandsCount + 1):
             myOutB = myOut.GetRasterBand(i)
             if myOutNDV is not None:
@@ -361,19 +856,51 @@ def doit(opts, args):
             myOutB = None  # write to band
 
     myOutTypeName = gdal.GetDataTypeName(myOutType)
-    if opts.debug:
+    myOutNumpyType = gdal_array.GDALTypeCodeToNumericTypeCode(myOutType) or numpy.float64
+    if opts.debug and myOut is not None:
         print("output file: %s, dimensions: %s, %s, type: %s" % (opts.outF, myOut.RasterXSize, myOut.RasterYSize, myOutTypeName))
 
+    if myOutIsVRT:
+        myOut.FlushCache()
+        if not opts.quiet:
+            print("100 - Done")
+        return myOut
+
+    # the statistics of the output bands are computed from the written blocks
+    myStats = None
+    if opts.statistics:
+        myStats = []
+        for bandNo in range(1, allBandsCount + 1):
+            myOutB = myOut.GetRasterBand(bandNo)
+            myStats.append(BandStatistics(gdal_array.GDALTypeCodeToNumericTypeCode(myOutB.DataType),
+                                          myOutB.GetNoDataValue(), opts.histogram, opts.hist_bins, opts.hist_range))
+            myOutB = None
+
     ################################################################
     # find block size to chop grids into bite-sized chunks
     ################################################################
 
-    # use the block size of the first layer to read efficiently
+    # use the block size of the first layer to read efficiently,
+    # unless a window size or a memory budget is given.
     myBlockSize = myFiles[0].GetRasterBand(myBands[0]).GetBlockSize()
+    if opts.window_size or opts.max_memory:
+        # align the windows to the blocks of all the inputs and of the output
+        myBlockSizes = [myFile.GetRasterBand(myBand).GetBlockSize() for myFile, myBand in zip(myFiles, myBands)]
+        if myOut is not None:
+            myBlockSizes.append(myOut.GetRasterBand(1).GetBlockSize())
+        # estimate the memory used per pixel by the input arrays, the nodata buffer,
+        # two float64 temporaries of the calculation and the results waiting to be written
+        myBytesPerPixel = sum(gdal.GetDataTypeSize(dt) // 8 for dt in myDataTypeNum) + 8 + 16 + \
+            allBandsCount * gdal.GetDataTypeSize(myOutType) // 8
+        if opts.num_threads > 1:
+            myBytesPerPixel *= 2 * opts.num_threads  # number of blocks in flight
+        myBlockSize = get_window_size(
+            myBlockSizes, DimensionsCheck, window_size=opts.window_size,
+            max_memory=opts.max_memory * 1024 * 1024 if opts.max_memory else None,
+            bytes_per_pixel=myBytesPerPixel)
     # find total x and y blocks to be read
     nXBlocks = (int)((DimensionsCheck[0] + myBlockSize[0] - 1) / myBlockSize[0])
     nYBlocks = (int)((DimensionsCheck[1] + myBlockSize[1] - 1) / myBlockSize[1])
-    myBufSize = myBlockSize[0] * myBlockSize[1]
 
     if opts.debug:
         print("using blocksize %s x %s" % (myBlockSize[0], myBlockSize[1]))
@@ -381,124 +908,270 @@ def doit(opts, args):
     # variables for displaying progress
     ProgressCt = -1
     ProgressMk = -1
-    ProgressEnd = nXBlocks * nYBlocks * allBandsCount
+    ProgressEnd = nXBlocks * nYBlocks
 
     ################################################################
-    # start looping through each band in allBandsCount
+    # start looping through blocks of data
     ################################################################
 
-    for bandNo in range(1, allBandsCount + 1):
+    # each input block is read once and all the output bands are computed from it,
+    # only the allBands input has to be read once per output band
+    myStaticInputs = [i for i in range(len(myAlphaList)) if i != allBandsIndex]
+
+    # inputs that are bands (of the same type) of the same dataset are read together, with a single call per block.
+    # each group is (first input, list of bands to read, list of (input, index of its band in the list))
+    myReadGroups = defaultdict(list)
+    for i in myStaticInputs:
+        myReadGroups[(id(myFiles[i]), myFiles[i].GetRasterBand(myBands[i]).DataType)].append(i)
+    myReadGroups = [(myGroup[0], myBandList, [(i, myBandList.index(myBands[i])) for i in myGroup])
+                    for myGroup in myReadGroups.values()
+                    for myBandList in [sorted(set(myBands[i] for i in myGroup))]]
+
+    # blocks without any data in one of the inputs are nodata in the output, as long as it has a nodata value.
+    # a new GTiff output is filled with its nodata value, so such blocks don't need to be written at all
+    myCheckCoverage = (myOutNDV is not None or opts.reduce) and any(ndv is not None for ndv in myNDV)
+    mySkipEmptyWrites = myOutIsNew and opts.format.upper() == 'GTIFF'
+    myEmptyCt = 0
+
+    # the arrays of the caller (user_namespace or non raster inputs) that a calculation can return as is
+    myNamespaceArrays = set(id(myval) for value in global_namespace.values()
+                            for myval in (value if isinstance(value, (list, tuple)) else [value])
+                            if isinstance(myval, numpy.ndarray))
+
+    def calc_block(myInputs, myLocks, myBuffers, myReuseArrays, myX, myY, nXValid, nYValid):
+        """
+        computes the results of all the output bands for a single block,
+        the result of a band is None if all its cells are nodata.
+        the nodata marks are computed in arrays from myBuffers, and if myReuseArrays is True
+        so are the input and the result arrays, and the results are only valid until the next call.
+        """
+        myShape = (nYValid, nXValid)
+
+        def get_buf(key, dtype=bool):
+            return myBuffers.get(key, myShape, dtype)
+
+        def get_read_buf(i, band_no):
+            if not myReuseArrays:
+                return None
+            band_list = band_no if isinstance(band_no, list) else [band_no]
+            band = myInputs[i].GetRasterBand(band_list[0])
+            dtype = gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType)
+            if dtype is None:
+                return None
+            # like BandReadAsArray and DatasetReadAsArray, which check the first band of the dataset
+            if band_list is band_no:
+                band = myInputs[i].GetRasterBand(1)
+            if dtype == numpy.uint8 and band.GetMetadataItem('PIXELTYPE', 'IMAGE_STRUCTURE') == 'SIGNEDBYTE':
+                dtype = numpy.int8
+            shape = (len(band_list),) + myShape if band_list is band_no else myShape
+            return myBuffers.get(('input', i, tuple(band_list)), shape, dtype)
+
+        # if an input that has a nodata value has no data at all in this block,
+        # all the output cells are nodata, so there is no need to read and calculate anything
+        if myCheckCoverage and any(
+                myNDV[i] is not None and
+                is_empty_block(myInputs[i], myBands[i], myX, myY, nXValid, nYValid, myLocks[i])
+                for i in myStaticInputs):
+            return [None] * allBandsCount
+
+        # buffer to mark where nodata occurs, None until an input with nodata is read
+        myStaticNDVs = None
+
+        # arrays of values of this block for each input layer
+        myBlockVals = [None] * len(myAlphaList)
+
+        # fetch data for each input layer that is the same for all the output bands
+        for i0, myBandList, myGroup in myReadGroups:
+            if len(myBandList) == 1:
+                myval = read_block(myInputs[i0], myBandList[0], myFileNames[i0], myX, myY, nXValid, nYValid,
+                                   myLocks[i0], get_read_buf(i0, myBandList[0]))
+                for i, _ in myGroup:
+                    myBlockVals[i] = myval
+            else:
+                myval = read_bands(myInputs[i0], myBandList, myFileNames[i0], myX, myY, nXValid, nYValid,
+                                   myLocks[i0], get_read_buf(i0, myBandList))
+                for i, k in myGroup:
+                    myBlockVals[i] = myval[k]
+        myval = None
+
+        for i in myStaticInputs:
+            if myNDV[i] is not None:
+                myStaticNDVs = accumulate_ndv(myStaticNDVs, myBlockVals[i], myNDV[i],
+                                              get_buf('ndv') if myStaticNDVs is None else None, get_buf('tmp'))
+
+        myResults = []
 
         ################################################################
-        # start looping through blocks of data
+        # start looping through each band in allBandsCount
         ################################################################
 
-        # store these numbers in variables that may change later
-        nXValid = myBlockSize[0]
-        nYValid = myBlockSize[1]
-
-        # loop through X-lines
-        for X in range(0, nXBlocks):
-
-            # in case the blocks don't fit perfectly
-            # change the block size of the final piece
-            if X == nXBlocks - 1:
-                nXValid = DimensionsCheck[0] - X * myBlockSize[0]
-
-            # find X offset
-            myX = X * myBlockSize[0]
-
-            # reset buffer size for start of Y loop
-            nYValid = myBlockSize[1]
-            myBufSize = nXValid * nYValid
-
-            # loop through Y lines
-            for Y in range(0, nYBlocks):
-                ProgressCt += 1
-                if 10 * ProgressCt / ProgressEnd % 10 != ProgressMk and not opts.quiet:
-                    ProgressMk = 10 * ProgressCt / ProgressEnd % 10
-                    from sys import version_info
-                    if version_info >= (3, 0, 0):
-                        exec('print("%d.." % (10*ProgressMk), end=" ")')
-                    else:
-                        exec('print 10*ProgressMk, "..",')
-
-                # change the block size of the final piece
-                if Y == nYBlocks - 1:
-                    nYValid = DimensionsCheck[1] - Y * myBlockSize[1]
-                    myBufSize = nXValid * nYValid
-
-                # find Y offset
-                myY = Y * myBlockSize[1]
+        for bandNo in range(1, allBandsCount + 1):
 
-                # create empty buffer to mark where nodata occurs
-                myNDVs = None
+            myNDVs = myStaticNDVs
 
-                # make local namespace for calculation
-                local_namespace = {}
+            if allBandsIndex is not None:
+                i = allBandsIndex
+                if myCheckCoverage and myNDV[i] is not None and \
+                        is_empty_block(myInputs[i], bandNo, myX, myY, nXValid, nYValid, myLocks[i]):
+                    myResults.append(None)
+                    continue
+                myBlockVals[i] = read_block(myInputs[i], bandNo, myFileNames[i], myX, myY, nXValid, nYValid,
+                                            myLocks[i], get_read_buf(i, bandNo))
+                if myNDV[i] is not None:
+                    # keep the nodata marks of the other inputs for the next bands
+                    myNDVs = accumulate_ndv(myNDVs, myBlockVals[i], myNDV[i], get_buf('band_ndv'), get_buf('tmp'))
 
-                val_lists = defaultdict(list)
+            # make local namespace for calculation
+            local_namespace = {}
 
-                # fetch data for each input layer
-                for i, Alpha in enumerate(myAlphaList):
+            val_lists = defaultdict(list)
 
-                    # populate lettered arrays with values
-                    if allBandsIndex is not None and allBandsIndex == i:
-                        myBandNo = bandNo
-                    else:
-                        myBandNo = myBands[i]
-                    myval = gdal_array.BandReadAsArray(myFiles[i].GetRasterBand(myBandNo),
-                                                        xoff=myX, yoff=myY,
-                                                        win_xsize=nXValid, win_ysize=nYValid)
-                    if myval is None:
-                        raise Exception('Input block reading failed from filename %s' % filename[i])
-
-                    # fill in nodata values
-                    if myNDV[i] is not None:
-                        # myNDVs is a boolean buffer.
-                        # a cell equals to 1 if there is NDV in any of the corresponding cells in input raster bands.
-                        if myNDVs is None:
-                            # this is the first band that has NDV set. we initializes myNDVs to a zero buffer
-                            # as we didn't see any NDV value yet.
-                            myNDVs = numpy.zeros(myBufSize)
-                            myNDVs.shape = (nYValid, nXValid)
-                        myNDVs = 1 * numpy.logical_or(myNDVs == 1, myval == myNDV[i])
-
-                    # add an array of values for this block to the eval namespace
-                    if Alpha in myAlphaFileLists:
-                        val_lists[Alpha].append(myval)
+            # add an array of values for this block to the eval namespace
+            for Alpha, myval in zip(myAlphaList, myBlockVals):
+                if Alpha in myAlphaFileLists:
+                    val_lists[Alpha].append(myval)
+                else:
+                    local_namespace[Alpha] = myval
+
+            for lst in myAlphaFileLists:
+                local_namespace[lst] = val_lists[lst]
+
+            # try the calculation on the array blocks
+            calc = myCalcs[bandNo-1 if len(myCalcs) > 1 else 0]
+            try:
+                myResult = calc.evaluate(global_namespace, local_namespace)
+            except:
+                print("evaluation of calculation %s failed" % (calc.calc))
+                raise
+
+            # the result can be modified in place if it was created by the calculation
+            myOwnResult = isinstance(myResult, numpy.ndarray) and myResult.flags.owndata and \
+                myResult.flags.writeable and not any(myResult is myval for myval in myBlockVals) and \
+                id(myResult) not in myNamespaceArrays
+            if opts.reduce:
+                # only the valid cells take part in the reduction
+                myResult = numpy.broadcast_to(myResult, myShape)
+                myResults.append(myResult if myNDVs is None else myResult[~myNDVs])
+                continue
+
+            myResults.append(propagate_ndv(
+                myResult, myNDVs, myOutNDV, nXValid, nYValid, myOutNumpyType,
+                (lambda dtype: get_buf(('result', bandNo), dtype)) if myReuseArrays else None, myOwnResult))
+
+        return myResults
+
+    def write_block(myResults, myX, myY, nXValid, nYValid):
+        """ writes the results of all the output bands of a single block (or adds them to the reductions) """
+        nonlocal ProgressCt, ProgressMk, myEmptyCt
+        ProgressCt += 1
+        if 10 * ProgressCt / ProgressEnd % 10 != ProgressMk and not opts.quiet:
+            ProgressMk = 10 * ProgressCt / ProgressEnd % 10
+            print("%d.." % (10*ProgressMk), end=" ")
+
+        for bandNo, myResult in enumerate(myResults, start=1):
+            if myResult is None:
+                # a block without any data
+                myEmptyCt += 1
+                if mySkipEmptyWrites or opts.reduce:
+                    continue
+                myResult = numpy.full((nYValid, nXValid), myOutNDV)
+            if opts.reduce:
+                myReducers[bandNo-1].add(myResult)
+                continue
+            # write data block to the output file
+            myOutB = myOut.GetRasterBand(bandNo)
+            if gdal_array.BandWriteArray(myOutB, myResult, xoff=myX, yoff=myY) != 0:
+                raise Exception('Block writing failed')
+            myOutB = None  # write to band
+            if myStats is not None:
+                myStats[bandNo-1].add(myResult)
+
+    # list the blocks, in case the blocks don't fit perfectly
+    # change the block size of the final piece
+    myWindows = [(myX, myY,
+                  min(myBlockSize[0], DimensionsCheck[0] - myX),
+                  min(myBlockSize[1], DimensionsCheck[1] - myY))
+                 for myX in range(0, DimensionsCheck[0], myBlockSize[0])
+                 for myY in range(0, DimensionsCheck[1], myBlockSize[1])]
+
+    if opts.num_threads <= 1:
+        # each block is written before the next one is read, so the same arrays can be used for all the blocks
+        myBuffers = BlockBuffers()
+        for myX, myY, nXValid, nYValid in myWindows:
+            myResults = calc_block(myFiles, [None] * len(myFiles), myBuffers, True, myX, myY, nXValid, nYValid)
+            write_block(myResults, myX, myY, nXValid, nYValid)
+    else:
+        # GDAL datasets can not be shared between threads,
+        # so each worker thread reads the inputs using its own handles
+        myThreadInputs = threading.local()
+        myThreadInputsList = []  # keeps track of the handles, to close them at the end
+        myFileLocks = {}
+        myLocks = []
+
+        for myOpenName, myFile in zip(myOpenNames, myFiles):
+            if myOpenName is None:
+                # a Dataset object that can't be reopened: its reads are serialized
+                myLocks.append(myFileLocks.setdefault(id(myFile), threading.Lock()))
+            else:
+                myLocks.append(None)
+                if myOpenName in myTempFileNames:
+                    myFile.FlushCache()  # make sure the temp vrt is written before reopening it
+
+        def calc_block_in_thread(myX, myY, nXValid, nYValid):
+            myInputs = getattr(myThreadInputs, 'inputs', None)
+            if myInputs is None:
+                myThreadInputs.buffers = BlockBuffers()
+                myInputs = []
+                myThreadFiles = {}
+                for myOpenName, myFile in zip(myOpenNames, myFiles):
+                    if myOpenName is None:
+                        myInputs.append(myFile)
                     else:
-                        local_namespace[Alpha] = myval
-                    myval = None
-
-                for lst in myAlphaFileLists:
-                    local_namespace[lst] = val_lists[lst]
-
-                # try the calculation on the array blocks
-                calc = opts.calc[bandNo-1 if len(opts.calc) > 1 else 0]
-                try:
-                    myResult = eval(calc, global_namespace, local_namespace)
-                except:
-                    print("evaluation of calculation %s failed" % (calc))
-                    raise
-
-                # Propagate nodata values (set nodata cells to zero
-                # then add nodata value to these cells).
-                if myNDVs is not None and myOutNDV is not None:
-                    myResult = ((1 * (myNDVs == 0)) * myResult) + (myOutNDV * myNDVs)
-                elif not isinstance(myResult, numpy.ndarray):
-                    myResult = numpy.ones((nYValid, nXValid)) * myResult
-
-                # write data block to the output file
-                myOutB = myOut.GetRasterBand(bandNo)
-                if gdal_array.BandWriteArray(myOutB, myResult, xoff=myX, yoff=myY) != 0:
-                    raise Exception('Block writing failed')
-                myOutB = None  # write to band
+                        myThreadFile = myThreadFiles.get(myOpenName) or gdal.Open(myOpenName, gdal.GA_ReadOnly)
+                        if not myThreadFile:
+                            raise IOError("No such file or directory: '%s'" % myOpenName)
+                        myThreadFiles[myOpenName] = myThreadFile
+                        myInputs.append(myThreadFile)
+                myThreadInputs.inputs = myInputs
+                myThreadInputsList.append(myInputs)
+            # the results are kept until they are written, while the thread continues to the next block,
+            # so only the nodata marks can use the same arrays for all the blocks
+            return calc_block(myInputs, myLocks, myThreadInputs.buffers, False, myX, myY, nXValid, nYValid)
+
+        # bounded read/compute -> write pipeline:
+        # the blocks are read and computed by the workers, and written in order by this thread
+        max_pending = 2 * opts.num_threads
+        with ThreadPoolExecutor(max_workers=opts.num_threads) as executor:
+            pending = deque()
+            for myWindow in myWindows:
+                pending.append((myWindow, executor.submit(calc_block_in_thread, *myWindow)))
+                if len(pending) >= max_pending:
+                    myWindow, future = pending.popleft()
+                    write_block(future.result(), *myWindow)
+            while pending:
+                myWindow, future = pending.popleft()
+                write_block(future.result(), *myWindow)
+
+        myThreadInputsList.clear()  # close the handles of the worker threads
+
+    if opts.debug:
+        print("%d blocks of output bands were empty" % myEmptyCt)
 
     # remove temp files
-    for idx, tempFile in enumerate(myTempFileNames):
-        myFiles[idx] = None
-        os.remove(tempFile)
+    if myTempFileNames:
+        myFiles = None  # close the vrt datasets
+        for tempFile in myTempFileNames:
+            os.remove(tempFile)
+
+    if opts.reduce:
+        if not opts.quiet:
+            print("100 - Done")
+        myReductions = [myReducer.result() for myReducer in myReducers]
+        return myReductions[0] if allBandsCount == 1 else myReductions
+
+    if myStats is not None:
+        for bandNo, myBandStats in enumerate(myStats, start=1):
+            myBandStats.set_band(myOut.GetRasterBand(bandNo))
 
     gdal.ErrorReset()
     myOut.FlushCache()
@@ -519,6 +1192,10 @@ def Calc(calc: Union[str, Sequence[str]], outfile: Optional[PathLike] = None, No
          hideNoData: bool = False, projectionCheck: bool = False,
          color_table: Optional[Union[PathLike, gdal.ColorTable]] = None,
          extent: Optional[Extent] = None, projwin: Optional[Union[Tuple, GeoRectangle]] = None, user_namespace=None,
+         num_threads: Optional[int] = None, window_size: Optional[Tuple[int, int]] = None,
+         max_memory: Optional[Number] = None, reduce: Optional[str] = None,
+         hist_bins: Union[int, Sequence[Number]] = 256, hist_range: Optional[Tuple[Number, Number]] = None,
+         engine: str = 'numpy', statistics: bool = False, histogram: bool = False,
          debug: bool=False, quiet: bool = False, **input_files):
 
     """ Perform raster calculations with numpy syntax.
@@ -544,6 +1221,26 @@ def Calc(calc: Union[str, Sequence[str]], outfile: Optional[PathLike] = None, No
 
     sum all files with hidden noDataValue
         Calc(calc="sum(a,axis=0)", a=['0.tif','1.tif','2.tif'], outfile="sum.tif", hideNoData=True)
+
+    read and compute the blocks using 4 threads
+        Calc(calc="(A+B)/2", A="input1.tif", B="input2.tif", outfile="result.tif", num_threads=4)
+
+    process windows of up to 256MB (window_size=(xsize, ysize) may be given instead)
+        Calc(calc="(A+B)/2", A="input1.tif", B="input2.tif", outfile="result.tif", max_memory=256)
+
+    count the cells where A>0.3 and B<10, without writing an output file
+        Calc(calc="logical_and(A>0.3,B<10)", A="input1.tif", B="input2.tif", reduce="count")
+        (reduce may be one of sum, count (of non zero results), min, max, mean or histogram,
+        the nodata cells are ignored, and a list is returned if there are several output bands.
+        a histogram is returned as (counts, bin_edges), with the bins given by hist_bins and hist_range)
+
+    evaluate the calculation with numexpr, without the temporary arrays of each operation
+        Calc(calc="A*0.5+B*0.3+C*0.2", A="input1.tif", B="input2.tif", C="input3.tif", outfile="result.tif",
+             type="Float32", engine="numexpr")
+
+    compute and store the statistics and the default histogram of the output bands while writing them
+        Calc(calc="(A+B)/2", A="input1.tif", B="input2.tif", outfile="result.tif", statistics=True, histogram=True)
+        (the histogram of bands of other types than Byte, Int16 and UInt16 requires hist_range)
     """
     opts = Values()
     opts.input_files = input_files
@@ -566,6 +1263,15 @@ def Calc(calc: Union[str, Sequence[str]], outfile: Optional[PathLike] = None, No
     opts.extent = extent
     opts.projwin = projwin
     opts.user_namespace = user_namespace
+    opts.num_threads = num_threads
+    opts.window_size = window_size
+    opts.max_memory = max_memory
+    opts.reduce = reduce
+    opts.hist_bins = hist_bins
+    opts.hist_range = hist_range
+    opts.engine = engine
+    opts.statistics = statistics
+    opts.histogram = histogram
     opts.debug = debug
     opts.quiet = quiet
 
@@ -632,6 +1338,23 @@ def main(argv):
     parser.add_option("--projectionCheck", dest="projectionCheck", action="store_true",
                       help="check that all rasters share the same projection")
 
+    parser.add_option("--threads", dest="num_threads", type=int, metavar="n",
+                      help="number of threads used to read and compute the blocks (default 1)")
+    parser.add_option("--window-size", dest="window_size", type=int, nargs=2, metavar="xsize ysize",
+                      help="size of the processing window, rounded up to the block size of the inputs and the output")
+    parser.add_option("--max-memory", dest="max_memory", type=float, metavar="MB",
+                      help="use the largest block aligned processing window that fits in the given memory (in MB)")
+    parser.add_option("--engine", dest="engine", default="numpy", choices=CalcExpression.engines,
+                      help="engine used to evaluate the calculation, numpy (default) or numexpr")
+    parser.add_option("--statistics", dest="statistics", action="store_true",
+                      help="compute and store the statistics of the output bands while writing them")
+    parser.add_option("--histogram", dest="histogram", action="store_true",
+                      help="compute and store the default histogram of the output bands (implies --statistics)")
+    parser.add_option("--hist-bins", dest="hist_bins", type=int, default=256, metavar="n",
+                      help="number of buckets of the histogram (default 256)")
+    parser.add_option("--hist-range", dest="hist_range", type=float, nargs=2, metavar="min max",
+                      help="range of the histogram (default the range of the values, or -0.5 255.5 for Byte bands)")
+
     (opts, args) = parser.parse_args(argv[1:])
 
     if not hasattr(opts, "input_files"):
@@ -30,12 +30,19 @@
 # building the stack.
 # anssi.pekkarinen@fao.org
 
+import collections
 import math
+import os
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
 
 from osgeo import gdal
 from osgeo.utils.auxiliary.util import GetOutputDriverFor
+from osgeo.utils.auxiliary.footprint_cache import FootprintCache, get_raster_info, get_raster_infos, \
+    color_table_from_entries
 
 progress = gdal.TermProgress_nocb
 
@@ -135,20 +142,24 @@ def raster_copy_with_mask(s_fh, s_xoff, s_yoff, s_xsize, s_ysize, s_band_n,
 # =============================================================================
 
 
-def names_to_fileinfos(names):
+def names_to_fileinfos(names, cache=None, num_threads=1):
     """
     Translate a list of GDAL filenames, into file_info objects.
 
     names -- list of valid GDAL dataset names.
+    cache -- optional FootprintCache holding the information of the files
+    from previous runs.
+    num_threads -- number of threads opening the files (that are not cached).
 
     Returns a list of file_info objects.  There may be less file_info objects
     than names if some of the names could not be opened as GDAL files.
     """
 
     file_infos = []
-    for name in names:
-        fi = file_info()
-        if fi.init_from_name(name) == 1:
+    for name, info in zip(names, get_raster_infos(names, cache, num_threads)):
+        if info is not None:
+            fi = file_info()
+            fi.init_from_info(name, info)
             file_infos.append(fi)
 
     return file_infos
@@ -173,37 +184,41 @@ class file_info(object):
         self.xsize = None
         self.ysize = None
 
-    def init_from_name(self, filename):
+    def init_from_name(self, filename, cache=None):
         """
         Initialize file_info from filename
 
         filename -- Name of file to read.
+        cache -- optional FootprintCache holding the information of the file.
 
         Returns 1 on success or 0 if the file can't be opened.
         """
-        fh = gdal.Open(filename)
-        if fh is None:
+        info = get_raster_info(filename, cache)
+        if info is None:
             return 0
 
+        self.init_from_info(filename, info)
+        return 1
+
+    def init_from_info(self, filename, info):
+        """
+        Initialize file_info from the information of a file, as returned by
+        get_raster_info().
+
+        filename -- Name of the file.
+        """
         self.filename = filename
-        self.bands = fh.RasterCount
-        self.xsize = fh.RasterXSize
-        self.ysize = fh.RasterYSize
-        self.band_type = fh.GetRasterBand(1).DataType
-        self.projection = fh.GetProjection()
-        self.geotransform = fh.GetGeoTransform()
+        self.bands = info['bands']
+        self.xsize = info['xsize']
+        self.ysize = info['ysize']
+        self.band_type = info['band_types'][0]
+        self.projection = info['projection']
+        self.geotransform = tuple(info['geotransform'])
         self.ulx = self.geotransform[0]
         self.uly = self.geotransform[3]
         self.lrx = self.ulx + self.geotransform[1] * self.xsize
         self.lry = self.uly + self.geotransform[5] * self.ysize
-
-        ct = fh.GetRasterBand(1).GetRasterColorTable()
-        if ct is not None:
-            self.ct = ct.Clone()
-        else:
-            self.ct = None
-
-        return 1
+        self.ct = color_table_from_entries(info['color_table'])
 
     def report(self):
         print('Filename: ' + self.filename)
@@ -232,11 +247,33 @@ class file_info(object):
         Returns 1 on success (or if nothing needs to be copied), and zero one
         failure.
         """
-        t_geotransform = t_fh.GetGeoTransform()
+        windows = self.get_windows(t_fh.GetGeoTransform(), t_fh.RasterXSize, t_fh.RasterYSize)
+        if windows is None:
+            return 1
+        (tw_xoff, tw_yoff, tw_xsize, tw_ysize), (sw_xoff, sw_yoff, sw_xsize, sw_ysize) = windows
+
+        # Open the source file, and copy the selected region.
+        s_fh = gdal.Open(self.filename)
+
+        return raster_copy(s_fh, sw_xoff, sw_yoff, sw_xsize, sw_ysize, s_band,
+                           t_fh, tw_xoff, tw_yoff, tw_xsize, tw_ysize, t_band,
+                           nodata_arg, verbose)
+
+    def get_windows(self, t_geotransform, t_xsize, t_ysize):
+        """
+        Compute the overlap area of this file and a target raster.
+
+        t_geotransform -- geotransform of the target raster.
+        t_xsize, t_ysize -- size of the target raster.
+
+        Returns the ((xoff, yoff, xsize, ysize) target window,
+        (xoff, yoff, xsize, ysize) source window) pair in pixel coordinates,
+        or None if they do not intersect.
+        """
         t_ulx = t_geotransform[0]
         t_uly = t_geotransform[3]
-        t_lrx = t_geotransform[0] + t_fh.RasterXSize * t_geotransform[1]
-        t_lry = t_geotransform[3] + t_fh.RasterYSize * t_geotransform[5]
+        t_lrx = t_geotransform[0] + t_xsize * t_geotransform[1]
+        t_lry = t_geotransform[3] + t_ysize * t_geotransform[5]
 
         # figure out intersection region
         tgw_ulx = max(t_ulx, self.ulx)
@@ -250,11 +287,11 @@ class file_info(object):
 
         # do they even intersect?
         if tgw_ulx >= tgw_lrx:
-            return 1
+            return None
         if t_geotransform[5] < 0 and tgw_uly <= tgw_lry:
-            return 1
+            return None
         if t_geotransform[5] > 0 and tgw_uly >= tgw_lry:
-            return 1
+            return None
 
         # compute target window in pixel coordinates.
         tw_xoff = int((tgw_ulx - t_geotransform[0]) / t_geotransform[1] + 0.1)
@@ -265,7 +302,7 @@ class file_info(object):
             - tw_yoff
 
         if tw_xsize < 1 or tw_ysize < 1:
-            return 1
+            return None
 
         # Compute source window in pixel coordinates.
         sw_xoff = int((tgw_ulx - self.geotransform[0]) / self.geotransform[1] + 0.1)
@@ -276,14 +313,337 @@ class file_info(object):
                        self.geotransform[5] + 0.5) - sw_yoff
 
         if sw_xsize < 1 or sw_ysize < 1:
-            return 1
+            return None
 
-        # Open the source file, and copy the selected region.
-        s_fh = gdal.Open(self.filename)
+        return ((tw_xoff, tw_yoff, tw_xsize, tw_ysize),
+                (sw_xoff, sw_yoff, sw_xsize, sw_ysize))
 
-        return raster_copy(s_fh, sw_xoff, sw_yoff, sw_xsize, sw_ysize, s_band,
-                           t_fh, tw_xoff, tw_yoff, tw_xsize, tw_ysize, t_band,
-                           nodata_arg, verbose)
+# *****************************************************************************
+
+
+class dataset_cache(object):
+    """A cache of the most recently used source datasets."""
+
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.datasets = collections.OrderedDict()
+
+    def get(self, filename):
+        """
+        Return the gdal.Dataset object of filename, opening it if it is not
+        in the cache.
+        """
+        fh = self.datasets.pop(filename, None)
+        if fh is None:
+            fh = gdal.Open(filename)
+            if len(self.datasets) >= self.max_size:
+                self.datasets.popitem(last=False)
+        self.datasets[filename] = fh
+        return fh
+
+# =============================================================================
+
+
+def read_nearest(band, src_x, src_y):
+    """
+    Read the source pixels of the given columns and rows of a band.
+
+    src_x, src_y -- increasing numpy arrays of source column and row indices.
+
+    Returns the array of the pixels, like a RasterIO() with nearest neighbour
+    resampling into a buffer of len(src_y) x len(src_x) pixels.
+    """
+    import numpy as np
+
+    xsize = int(src_x[-1] - src_x[0]) + 1
+    ysize = int(src_y[-1] - src_y[0]) + 1
+    data = band.ReadAsArray(int(src_x[0]), int(src_y[0]), xsize, ysize)
+    if xsize != len(src_x) or ysize != len(src_y):
+        data = data[np.ix_(src_y - src_y[0], src_x - src_x[0])]
+    return data
+
+# =============================================================================
+
+
+def get_merge_window_size(t_fh, max_pixels=1024 * 1024):
+    """
+    Compute the size of the windows in which the target file is composited:
+    a multiple of its block size of about max_pixels pixels.
+    """
+    block_xsize, block_ysize = t_fh.GetRasterBand(1).GetBlockSize()
+    xsize = min(t_fh.RasterXSize,
+                block_xsize * max(1, int(math.sqrt(max_pixels)) // block_xsize))
+    ysize = min(t_fh.RasterYSize,
+                block_ysize * max(1, max_pixels // (xsize * block_ysize)))
+    return xsize, ysize
+
+# =============================================================================
+
+
+def init_window(t_band, xoff, yoff, xsize, ysize, init_value=None):
+    """
+    Return the initial content of a window of a target band: init_value, or
+    the current content of the band if init_value is None.
+    """
+    import numpy as np
+    from osgeo import gdal_array
+
+    if init_value is None:
+        return t_band.ReadAsArray(xoff, yoff, xsize, ysize)
+
+    # keep the initial value exact, it is converted like by Fill() on writing
+    t_type = gdal_array.GDALTypeCodeToNumericTypeCode(t_band.DataType)
+    if np.array(init_value).astype(t_type) != init_value:
+        t_type = np.float64
+    return np.full((ysize, xsize), init_value, dtype=t_type)
+
+# =============================================================================
+
+
+def composite_window(buf, xoff, yoff, window_layers, sources, nodata=None,
+                     verbose=0):
+    """
+    Composite the layers that intersect a window of a target band in memory.
+
+    buf -- initial content of the window (see init_window()).
+    xoff, yoff -- offset of the window in the target band.
+    window_layers -- list of (file_info, source band, (target window,
+    source window)) in compositing order.
+    sources -- dataset_cache used to open the source files.
+
+    Returns the composited array.
+    """
+    import numpy as np
+
+    ysize, xsize = buf.shape
+    for fi, s_band_n, windows in window_layers:
+        (tw_xoff, tw_yoff, tw_xsize, tw_ysize), (sw_xoff, sw_yoff, sw_xsize, sw_ysize) = windows
+        x0 = max(xoff, tw_xoff)
+        x1 = min(xoff + xsize, tw_xoff + tw_xsize)
+        y0 = max(yoff, tw_yoff)
+        y1 = min(yoff + ysize, tw_yoff + tw_ysize)
+        if x0 >= x1 or y0 >= y1:
+            continue
+
+        # source pixels of the target pixels, with the nearest neighbour
+        # rule of RasterIO()
+        src_x = sw_xoff + np.floor((np.arange(x0, x1) - tw_xoff + 0.5) * (sw_xsize / tw_xsize) + 1e-10).astype(int)
+        src_y = sw_yoff + np.floor((np.arange(y0, y1) - tw_yoff + 0.5) * (sw_ysize / tw_ysize) + 1e-10).astype(int)
+        src_x = np.minimum(src_x, sw_xoff + sw_xsize - 1)
+        src_y = np.minimum(src_y, sw_yoff + sw_ysize - 1)
+
+        if verbose != 0:
+            print('Copy %d,%d,%d,%d to %d,%d,%d,%d.'
+                  % (src_x[0], src_y[0], src_x[-1] - src_x[0] + 1, src_y[-1] - src_y[0] + 1,
+                     x0, y0, x1 - x0, y1 - y0))
+
+        s_band = sources.get(fi.filename).GetRasterBand(s_band_n)
+        data = read_nearest(s_band, src_x, src_y)
+
+        # same rules as raster_copy()
+        valid = None
+        if nodata is not None:
+            if not np.isnan(nodata):
+                valid = np.not_equal(data, nodata)
+            else:
+                valid = ~np.isnan(data)
+        else:
+            m_band = None
+            if s_band.GetMaskFlags() != gdal.GMF_ALL_VALID:
+                m_band = s_band.GetMaskBand()
+            elif s_band.GetColorInterpretation() == gdal.GCI_AlphaBand:
+                m_band = s_band
+            if m_band is not None:
+                valid = np.not_equal(read_nearest(m_band, src_x, src_y), 0)
+
+        # the values are converted to the target type on writing
+        if not np.can_cast(data.dtype, buf.dtype):
+            buf = buf.astype(np.result_type(data.dtype, buf.dtype))
+        dst = buf[y0 - yoff:y1 - yoff, x0 - xoff:x1 - xoff]
+        if valid is None:
+            dst[...] = data
+        else:
+            np.copyto(dst, data, where=valid)
+
+    return buf
+
+# =============================================================================
+
+
+def merge_by_windows(t_fh, layers, nodata=None, pre_init=None, verbose=0,
+                     callback=None, num_threads=1):
+    """
+    Composite layers into a target file, one window at a time.
+
+    The layers that intersect each window of the target file are found with
+    an index of the windows covered by each layer. Each window is built in
+    memory from these layers and written once, instead of reading back and
+    writing the target file for every layer.
+
+    t_fh -- gdal.Dataset object of the target file.
+    layers -- list of (file_info, source band, target band) in compositing
+    order.
+    nodata -- value of the source pixels that are not copied.
+    pre_init -- list of the initial values of the target bands (None for the
+    bands that start from their current content).
+    callback -- called with the completed fraction after each window.
+    num_threads -- number of threads compositing the windows. The target
+    file is only read and written by the calling thread, in window order.
+    """
+    t_geotransform = t_fh.GetGeoTransform()
+    win_xsize, win_ysize = get_merge_window_size(t_fh)
+    if pre_init is None:
+        pre_init = [None] * t_fh.RasterCount
+
+    # index of the layers that intersect each window, per target band
+    window_layers = collections.defaultdict(list)
+    for fi, s_band_n, t_band_n in layers:
+        windows = fi.get_windows(t_geotransform, t_fh.RasterXSize, t_fh.RasterYSize)
+        if windows is None:
+            continue
+        tw_xoff, tw_yoff, tw_xsize, tw_ysize = windows[0]
+        for win_y in range(tw_yoff // win_ysize, (tw_yoff + tw_ysize - 1) // win_ysize + 1):
+            for win_x in range(tw_xoff // win_xsize, (tw_xoff + tw_xsize - 1) // win_xsize + 1):
+                window_layers[(win_x, win_y, t_band_n)].append((fi, s_band_n, windows))
+
+    # GDAL datasets can not be shared between threads, so each thread opens
+    # the source files with its own cache.
+    thread_sources = threading.local()
+
+    def composite_bands(xoff, yoff, bands_init):
+        sources = getattr(thread_sources, 'sources', None)
+        if sources is None:
+            sources = thread_sources.sources = dataset_cache()
+        return [(t_band_n, composite_window(buf, xoff, yoff, band_layers, sources, nodata, verbose))
+                for t_band_n, buf, band_layers in bands_init]
+
+    windows = [(xoff, yoff, min(win_xsize, t_fh.RasterXSize - xoff), min(win_ysize, t_fh.RasterYSize - yoff))
+               for yoff in range(0, t_fh.RasterYSize, win_ysize)
+               for xoff in range(0, t_fh.RasterXSize, win_xsize)]
+
+    def read_window(xoff, yoff, xsize, ysize):
+        bands_init = []
+        for t_band_n in range(1, t_fh.RasterCount + 1):
+            band_layers = window_layers.get((xoff // win_xsize, yoff // win_ysize, t_band_n), [])
+            if band_layers or pre_init[t_band_n - 1] is not None:
+                buf = init_window(t_fh.GetRasterBand(t_band_n), xoff, yoff, xsize, ysize, pre_init[t_band_n - 1])
+                bands_init.append((t_band_n, buf, band_layers))
+        return bands_init
+
+    def write_window(window_idx, xoff, yoff, bands_data):
+        for t_band_n, data in bands_data:
+            t_fh.GetRasterBand(t_band_n).WriteArray(data, xoff, yoff)
+        if callback is not None:
+            callback((window_idx + 1) / float(len(windows)))
+
+    if num_threads <= 1:
+        for window_idx, (xoff, yoff, xsize, ysize) in enumerate(windows):
+            bands_data = composite_bands(xoff, yoff, read_window(xoff, yoff, xsize, ysize))
+            write_window(window_idx, xoff, yoff, bands_data)
+        return 0
+
+    # the windows are composited by the workers, and written in order by
+    # this thread, with a bounded number of pending windows
+    max_pending = 2 * num_threads
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        pending = collections.deque()
+        for window_idx, (xoff, yoff, xsize, ysize) in enumerate(windows):
+            bands_init = read_window(xoff, yoff, xsize, ysize)
+            pending.append((window_idx, xoff, yoff, executor.submit(composite_bands, xoff, yoff, bands_init)))
+            if len(pending) >= max_pending:
+                window_idx, xoff, yoff, future = pending.popleft()
+                write_window(window_idx, xoff, yoff, future.result())
+        while pending:
+            window_idx, xoff, yoff, future = pending.popleft()
+            write_window(window_idx, xoff, yoff, future.result())
+
+    return 0
+
+
+# =============================================================================
+
+
+def get_vrt_source_filename(filename, vrt_filename=None):
+    """
+    Return the <SourceFilename> element of a file in a VRT file, relative to
+    the VRT file when possible.
+    """
+    if vrt_filename and not os.path.isabs(filename) and not filename.startswith('/vsi') and \
+            os.path.exists(filename):
+        vrt_dir = os.path.dirname(os.path.abspath(vrt_filename))
+        return '<SourceFilename relativeToVRT="1">%s</SourceFilename>' % \
+            escape(os.path.relpath(os.path.abspath(filename), vrt_dir))
+    return '<SourceFilename relativeToVRT="0">%s</SourceFilename>' % escape(filename)
+
+# =============================================================================
+
+
+def add_vrt_sources(t_fh, layers, nodata=None, pre_init=None,
+                    vrt_filename=None, init_fi=None):
+    """
+    Add the layers as the sources of the bands of a VRT dataset, so that it
+    describes the mosaic that copy_into() or merge_by_windows() would build:
+    the last layers are drawn over the first ones, except their pixels that
+    are nodata (or masked, following the rules of raster_copy()).
+
+    t_fh -- gdal.Dataset object of the VRT dataset.
+    layers -- list of (file_info, source band, target band) in compositing
+    order.
+    nodata -- value of the source pixels that are not copied.
+    pre_init -- list of the initial values of the target bands (None for no
+    initial value), set with a constant source.
+    init_fi -- file_info of the file the constant sources refer to (the
+    first layer by default).
+    vrt_filename -- name of the VRT file, to refer to the sources relatively
+    to it.
+    """
+    t_geotransform = t_fh.GetGeoTransform()
+    band_sources = collections.defaultdict(list)
+    dst_rect = '<DstRect xOff="%d" yOff="%d" xSize="%d" ySize="%d"/>'
+    src_rect = '<SrcRect xOff="%d" yOff="%d" xSize="%d" ySize="%d"/>'
+
+    if init_fi is None and layers:
+        init_fi = layers[0][0]
+    for t_band_n, value in enumerate(pre_init or [], start=1):
+        if value is not None and init_fi is not None:
+            # a scaled source with a ratio of 0 is a constant, it is not read
+            fi = init_fi
+            band_sources[t_band_n].append(
+                '<ComplexSource>' + get_vrt_source_filename(fi.filename, vrt_filename) +
+                '<SourceBand>1</SourceBand>' +
+                src_rect % (0, 0, fi.xsize, fi.ysize) +
+                dst_rect % (0, 0, t_fh.RasterXSize, t_fh.RasterYSize) +
+                '<ScaleOffset>%.18g</ScaleOffset><ScaleRatio>0</ScaleRatio>' % value +
+                '</ComplexSource>')
+
+    sources = dataset_cache()
+    for fi, s_band_n, t_band_n in layers:
+        windows = fi.get_windows(t_geotransform, t_fh.RasterXSize, t_fh.RasterYSize)
+        if windows is None:
+            continue
+        source = get_vrt_source_filename(fi.filename, vrt_filename) + \
+            '<SourceBand>%d</SourceBand>' % s_band_n + \
+            src_rect % windows[1] + dst_rect % windows[0]
+
+        # same rules as raster_copy()
+        if nodata is not None:
+            source = '<ComplexSource>%s<NODATA>%.18g</NODATA></ComplexSource>' % (source, nodata)
+        else:
+            s_band = sources.get(fi.filename).GetRasterBand(s_band_n)
+            if s_band.GetMaskFlags() != gdal.GMF_ALL_VALID:
+                source = '<ComplexSource>%s<UseMaskBand>true</UseMaskBand></ComplexSource>' % source
+            elif s_band.GetColorInterpretation() == gdal.GCI_AlphaBand:
+                # the band is its own mask
+                source = '<ComplexSource>%s<NODATA>0</NODATA></ComplexSource>' % source
+            else:
+                source = '<SimpleSource>%s</SimpleSource>' % source
+        band_sources[t_band_n].append(source)
+
+    for t_band_n, band_source_list in band_sources.items():
+        t_fh.GetRasterBand(t_band_n).SetMetadata(
+            {'source_%d' % i: source for i, source in enumerate(band_source_list)}, 'new_vrt_sources')
+
+    return 0
 
 
 # =============================================================================
@@ -292,7 +652,8 @@ def Usage():
     print('                     [-ps pixelsize_x pixelsize_y] [-tap] [-separate] [-q] [-v] [-pct]')
     print('                     [-ul_lr ulx uly lrx lry] [-init "value [value...]"]')
     print('                     [-n nodata_value] [-a_nodata output_nodata_value]')
-    print('                     [-ot datatype] [-createonly] input_files')
+    print('                     [-ot datatype] [-createonly] [-windowed] [-threads n]')
+    print('                     [-scan_threads n] [-footprint_cache filename] input_files')
     print('                     [--help-general]')
     print('')
     return 1
@@ -315,6 +676,10 @@ def main(argv=None):
     pre_init = []
     band_type = None
     createonly = 0
+    windowed = 0
+    num_threads = 1
+    scan_threads = None
+    footprint_cache = None
     bTargetAlignedPixels = False
     start_time = time.time()
 
@@ -342,6 +707,22 @@ def main(argv=None):
         elif arg == '-createonly':
             createonly = 1
 
+        elif arg == '-windowed':
+            windowed = 1
+
+        elif arg == '-threads':
+            i = i + 1
+            num_threads = int(argv[i])
+            windowed = 1
+
+        elif arg == '-scan_threads':
+            i = i + 1
+            scan_threads = int(argv[i])
+
+        elif arg == '-footprint_cache':
+            i = i + 1
+            footprint_cache = argv[i]
+
         elif arg == '-separate':
             separate = 1
 
@@ -417,12 +798,23 @@ def main(argv=None):
         return 1
 
     DriverMD = Driver.GetMetadata()
-    if 'DCAP_CREATE' not in DriverMD:
+    # With the VRT format, the mosaic is described by a VRT file. The formats
+    # that only support CreateCopy() (e.g. COG) are written from such a VRT,
+    # so that the pixels are only written once.
+    vrt_output = frmt.upper() == 'VRT'
+    create_copy = 'DCAP_CREATE' not in DriverMD and 'DCAP_CREATECOPY' in DriverMD
+    if 'DCAP_CREATE' not in DriverMD and not create_copy:
         print('Format driver %s does not support creation and piecewise writing.\nPlease select a format that does, such as GTiff (the default) or HFA (Erdas Imagine).' % frmt)
         return 1
 
     # Collect information on all the source files.
-    file_infos = names_to_fileinfos(names)
+    if scan_threads is None:
+        scan_threads = num_threads
+    if footprint_cache is not None:
+        with FootprintCache(footprint_cache) as cache:
+            file_infos = names_to_fileinfos(names, cache, scan_threads)
+    else:
+        file_infos = names_to_fileinfos(names, None, scan_threads)
 
     if ulx is None:
         ulx = file_infos[0].ulx
@@ -444,9 +836,11 @@ def main(argv=None):
         band_type = file_infos[0].band_type
 
     # Try opening as an existing file.
-    gdal.PushErrorHandler('CPLQuietErrorHandler')
-    t_fh = gdal.Open(out_file, gdal.GA_Update)
-    gdal.PopErrorHandler()
+    t_fh = None
+    if not vrt_output and not create_copy:
+        gdal.PushErrorHandler('CPLQuietErrorHandler')
+        t_fh = gdal.Open(out_file, gdal.GA_Update)
+        gdal.PopErrorHandler()
 
     # Create output file if it does not already exist.
     if t_fh is None:
@@ -470,8 +864,11 @@ def main(argv=None):
         else:
             bands = file_infos[0].bands
 
-        t_fh = Driver.Create(out_file, xsize, ysize, bands,
-                             band_type, create_options)
+        if create_copy:
+            t_fh = gdal.GetDriverByName('VRT').Create('', xsize, ysize, bands, band_type)
+        else:
+            t_fh = Driver.Create(out_file, xsize, ysize, bands,
+                                 band_type, create_options)
         if t_fh is None:
             print('Creation failed, terminating gdal_merge.')
             return 1
@@ -498,13 +895,42 @@ def main(argv=None):
             t_fh.GetRasterBand(i + 1).SetNoDataValue(a_nodata)
 
     # Do we need to pre-initialize the whole mosaic file to some value?
+    band_init = [None] * t_fh.RasterCount
     if pre_init is not None:
         if t_fh.RasterCount <= len(pre_init):
-            for i in range(t_fh.RasterCount):
-                t_fh.GetRasterBand(i + 1).Fill(pre_init[i])
+            band_init = pre_init[:t_fh.RasterCount]
         elif len(pre_init) == 1:
-            for i in range(t_fh.RasterCount):
-                t_fh.GetRasterBand(i + 1).Fill(pre_init[0])
+            band_init = pre_init * t_fh.RasterCount
+
+    # The (source file, source band, target band) to copy, in order.
+    layers = []
+    t_band = 1
+    for fi in file_infos:
+        if separate == 0:
+            for band in range(1, bands + 1):
+                layers.append((fi, band, band))
+        else:
+            for band in range(1, fi.bands + 1):
+                layers.append((fi, band, t_band))
+                t_band = t_band + 1
+
+    if vrt_output or create_copy:
+        add_vrt_sources(t_fh, layers if createonly == 0 else [], nodata, band_init,
+                        out_file if vrt_output else None, file_infos[0])
+        if create_copy:
+            out_fh = Driver.CreateCopy(out_file, t_fh, 0, create_options,
+                                       callback=progress if quiet == 0 and verbose == 0 else None)
+            if out_fh is None:
+                print('Creation failed, terminating gdal_merge.')
+                return 1
+            out_fh = None
+        t_fh = None
+        return 0
+
+    if windowed == 0 or createonly != 0:
+        for i, value in enumerate(band_init):
+            if value is not None:
+                t_fh.GetRasterBand(i + 1).Fill(value)
 
     # Copy data from source files into output file.
     t_band = 1
@@ -513,8 +939,14 @@ def main(argv=None):
         progress(0.0)
     fi_processed = 0
 
+    if windowed != 0 and createonly == 0:
+        # Composite the output window by window, from the initial values.
+        merge_by_windows(t_fh, layers, nodata, band_init, verbose,
+                         progress if quiet == 0 and verbose == 0 else None,
+                         num_threads)
+
     for fi in file_infos:
-        if createonly != 0:
+        if createonly != 0 or windowed != 0:
             continue
 
         if verbose != 0:
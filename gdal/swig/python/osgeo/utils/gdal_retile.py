@@ -32,13 +32,20 @@ from __future__ import print_function
 import os
 import sys
 import shutil
+import threading
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 
 from osgeo import gdal
 from osgeo import ogr
 from osgeo import osr
+from osgeo.utils.auxiliary.footprint_cache import FootprintCache, get_raster_infos
 
 progress = gdal.TermProgress_nocb
 
+# Globals and mosaic of the worker processes or threads (see initTileWorker())
+workerLocal = threading.local()
+
 
 class AffineTransformDecorator(object):
     """ A class providing some useful methods for affine Transformations """
@@ -290,17 +297,21 @@ def getTileIndexFromFiles(g):
         print("Building internal Index for %d tile(s) ..." % len(g.Names), end=" ")
 
     ogrTileIndexDS = createTileIndex(g.Verbose,  "TileIndex", g.TileIndexFieldName, None, g.TileIndexDriverTyp)
-    for inputTile in g.Names:
+    scan_threads = g.Threads if g.ScanThreads is None else g.ScanThreads
+    if g.FootprintCache is not None:
+        with FootprintCache(g.FootprintCache) as cache:
+            infos = get_raster_infos(g.Names, cache, num_threads=scan_threads)
+    else:
+        infos = get_raster_infos(g.Names, num_threads=scan_threads)
+    for inputTile, info in zip(g.Names, infos):
 
-        fhInputTile = gdal.Open(inputTile)
-        if fhInputTile is None:
+        if info is None:
             return None
 
-        dec = AffineTransformDecorator(fhInputTile.GetGeoTransform())
-        points = dec.pointsFor(fhInputTile.RasterXSize, fhInputTile.RasterYSize)
+        dec = AffineTransformDecorator(info['geotransform'])
+        points = dec.pointsFor(info['xsize'], info['ysize'])
 
         addFeature(g.TileIndexFieldName, ogrTileIndexDS, inputTile, points[0], points[1])
-        del fhInputTile
 
     if g.Verbose:
         print("finished")
@@ -334,6 +345,9 @@ def tileImage(g, minfo, ti):
         processed = 0
         total = len(xRange) * len(yRange)
 
+    parallel = isTilePoolEnabled(g)
+    jobs = []
+
     for yIndex in yRange:
         for xIndex in xRange:
             offsetY = (yIndex - 1) * (ti.tileHeight - ti.overlap)
@@ -351,12 +365,24 @@ def tileImage(g, minfo, ti):
                 height = ti.height - offsetY
 
             feature_only = g.Resume and os.path.exists(tilename)
-            createTile(g, minfo, offsetX, offsetY, width, height, tilename, OGRDS, feature_only)
+            if parallel:
+                # The feature is added to the tile index here, and the tile created by a worker
+                createTile(g, minfo, offsetX, offsetY, width, height, tilename, OGRDS, True)
+                if not feature_only:
+                    jobs.append((False, offsetX, offsetY, width, height, tilename))
+                    continue
+            else:
+                createTile(g, minfo, offsetX, offsetY, width, height, tilename, OGRDS, feature_only)
 
             if not g.Quiet and not g.Verbose:
                 processed += 1
                 progress(processed / float(total))
 
+    for _ in runTileJobs(g, minfo, jobs):
+        if not g.Quiet and not g.Verbose:
+            processed += 1
+            progress(processed / float(total))
+
     if g.TileIndexName is not None:
         if g.UseDirForEachRow and not g.PyramidOnly:
             shapeName = getTargetDir(g, 0) + g.TileIndexName
@@ -633,6 +659,82 @@ def closeTileIndex(OGRDataSource):
     OGRDataSource.Destroy()
 
 
+def getTileIndexFeatures(OGRDS):
+    """ returns the (location, geometry WKT) of the features of a tile index """
+    features = []
+    OGRDS.GetLayer().ResetReading()
+    while True:
+        feature = OGRDS.GetLayer().GetNextFeature()
+        if feature is None:
+            break
+        features.append((feature.GetField(0), feature.GetGeometryRef().ExportToWkt()))
+    return features
+
+
+def initTileWorker(g, filename, features):
+    """
+
+    Pool initializer: builds the mosaic of the tile index features in the worker process
+    or thread, since the OGR and GDAL datasets can't be shared between them
+
+    """
+    OGRDS = createTileIndex(False, "TileIndex_%d" % threading.get_ident(), g.TileIndexFieldName, None,
+                            g.TileIndexDriverTyp)
+    OGRLayer = OGRDS.GetLayer()
+    for location, wkt in features:
+        OGRFeature = ogr.Feature(OGRLayer.GetLayerDefn())
+        OGRFeature.SetField(g.TileIndexFieldName, location)
+        OGRFeature.SetGeometryDirectly(ogr.CreateGeometryFromWkt(wkt))
+        OGRLayer.CreateFeature(OGRFeature)
+        OGRFeature.Destroy()
+    workerLocal.g = g
+    workerLocal.minfo = mosaic_info(filename, OGRDS)
+
+
+def createTileJob(job):
+    """ creates a tile (or a pyramid tile) in a worker """
+    pyramid, offsetX, offsetY, width, height, tilename = job
+    if pyramid:
+        return createPyramidTile(workerLocal.g, workerLocal.minfo, offsetX, offsetY, width, height,
+                                 tilename, None, False)
+    return createTile(workerLocal.g, workerLocal.minfo, offsetX, offsetY, width, height, tilename, None, False)
+
+
+def isTilePoolEnabled(g):
+    """ returns True if the tiles are created by a pool of processes or threads """
+    return g.Processes > 1 or g.Threads > 1
+
+
+def createTilePool(g, minfo):
+    """ returns a pool of g.Processes processes or g.Threads threads creating the tiles read from minfo """
+    if g.Processes > 1:
+        pool_class, count = Pool, g.Processes
+    else:
+        pool_class, count = ThreadPool, g.Threads
+    return pool_class(count, initializer=initTileWorker,
+                      initargs=(g, minfo.filename, getTileIndexFeatures(minfo.ogrTileIndexDS)))
+
+
+def runTileJobs(g, minfo, jobs):
+    """ creates the tiles of the jobs in a pool, if there are any, and yields as they are done """
+    if not jobs:
+        return
+    pool = createTilePool(g, minfo)
+    try:
+        # Consecutive tiles of a row are mostly read from the same input files, which the
+        # DataSetCache of the worker keeps open
+        for result in pool.imap_unordered(createTileJob, jobs, chunksize=8):
+            yield result
+    except BaseException:
+        # do not wait for the other jobs (or leave the workers behind) after an error
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+
 def buildPyramid(g, minfo, createdTileIndexDS, tileWidth, tileHeight, overlap):
     inputDS = createdTileIndexDS
     for level in range(1, g.Levels + 1):
@@ -648,6 +750,9 @@ def buildPyramidLevel(g, levelMosaicInfo, levelOutputTileInfo, level):
 
     OGRDS = createTileIndex(g.Verbose,  "TileResult_" + str(level), g.TileIndexFieldName, g.Source_SRS, g.TileIndexDriverTyp)
 
+    parallel = isTilePoolEnabled(g)
+    jobs = []
+
     for yIndex in yRange:
         for xIndex in xRange:
             offsetY = (yIndex - 1) * (levelOutputTileInfo.tileHeight - levelOutputTileInfo.overlap)
@@ -663,7 +768,16 @@ def buildPyramidLevel(g, levelMosaicInfo, levelOutputTileInfo, level):
             tilename = getTileName(g, levelMosaicInfo, levelOutputTileInfo, xIndex, yIndex, level)
 
             feature_only = g.Resume and os.path.exists(tilename)
-            createPyramidTile(g, levelMosaicInfo, offsetX, offsetY, width, height, tilename, OGRDS, feature_only)
+            if parallel:
+                # The feature is added to the tile index here, and the tile created by a worker
+                createPyramidTile(g, levelMosaicInfo, offsetX, offsetY, width, height, tilename, OGRDS, True)
+                if not feature_only:
+                    jobs.append((True, offsetX, offsetY, width, height, tilename))
+            else:
+                createPyramidTile(g, levelMosaicInfo, offsetX, offsetY, width, height, tilename, OGRDS, feature_only)
+
+    for _ in runTileJobs(g, levelMosaicInfo, jobs):
+        pass
 
     if g.TileIndexName is not None:
         shapeName = getTargetDir(g, level) + g.TileIndexName
@@ -730,7 +844,8 @@ def Usage():
     print('        [ -csv fileName [-csvDelim delimiter]]')
     print('        [-s_srs srs_def]  [-pyramidOnly] -levels numberoflevels')
     print('        [-r {near/bilinear/cubic/cubicspline/lanczos}]')
-    print('        [-useDirForEachRow] [-resume]')
+    print('        [-useDirForEachRow] [-resume] [-footprint_cache filename]')
+    print('        [-scan_threads N] [-processes N | -threads N]')
     print('        -targetDir TileDirectory input_files')
     return 1
 
@@ -842,6 +957,18 @@ def main(args=None, g=None):
             g.UseDirForEachRow = True
         elif arg == "-resume":
             g.Resume = True
+        elif arg == '-footprint_cache':
+            i += 1
+            g.FootprintCache = argv[i]
+        elif arg == '-scan_threads':
+            i += 1
+            g.ScanThreads = int(argv[i])
+        elif arg == '-processes':
+            i += 1
+            g.Processes = int(argv[i])
+        elif arg == '-threads':
+            i += 1
+            g.Threads = int(argv[i])
         elif arg[:1] == '-':
             print('Unrecognized command option: %s' % arg)
             return Usage()
@@ -865,6 +992,10 @@ def main(args=None, g=None):
         print("Missing Directory for Tiles -targetDir")
         return Usage()
 
+    if g.Processes > 1 and g.Threads > 1:
+        print("-processes and -threads are mutually exclusive")
+        return Usage()
+
     # create level 0 directory if needed
     if g.UseDirForEachRow and not g.PyramidOnly:
         leveldir = g.TargetDir + str(0) + os.sep
@@ -950,7 +1081,11 @@ class RetileGlobals():
         'PyramidOnly',
         'LastRowIndx',
         'UseDirForEachRow',
-        'Resume']
+        'Resume',
+        'FootprintCache',
+        'ScanThreads',
+        'Processes',
+        'Threads']
 
     def __init__(self):
         """ Only used for unit tests """
@@ -980,6 +1115,28 @@ class RetileGlobals():
         self.LastRowIndx = -1
         self.UseDirForEachRow = False
         self.Resume = False
+        self.FootprintCache = None
+        self.ScanThreads = None
+        self.Processes = 1
+        self.Threads = 1
+
+    def __getstate__(self):
+        """ The drivers and the SRS are passed to the worker processes by name and WKT """
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state['Driver'] = state['MemDriver'] = None
+        if self.Source_SRS is not None:
+            state['Source_SRS'] = self.Source_SRS.ExportToWkt()
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.Driver = gdal.GetDriverByName(self.Format)
+        if 'DCAP_CREATE' not in self.Driver.GetMetadata():
+            self.MemDriver = gdal.GetDriverByName("MEM")
+        if self.Source_SRS is not None:
+            self.Source_SRS = osr.SpatialReference()
+            self.Source_SRS.ImportFromWkt(state['Source_SRS'])
 
 
 if __name__ == '__main__':
@@ -39,18 +39,26 @@
 
 from __future__ import print_function, division
 
+import collections
+import contextlib
 import glob
+import hashlib
 import json
 import math
 import optparse
 import os
+import queue
 import shutil
+import sqlite3
+import struct
 import sys
 import tempfile
 import threading
-from functools import partial
-from multiprocessing import Pool
-from typing import List, NoReturn, Tuple, Optional, Any
+import time
+from functools import lru_cache, partial
+from multiprocessing import Manager, Pool
+from multiprocessing.pool import ThreadPool
+from typing import Dict, Iterator, List, NoReturn, Tuple, Optional, Any
 from uuid import uuid4
 from xml.etree import ElementTree
 
@@ -60,9 +68,7 @@ from osgeo import osr
 Options = Any
 
 try:
-    from PIL import Image
     import numpy
-    import osgeo.gdal_array as gdalarray
     numpy_available = True
 except ImportError:
     # 'antialias' resampling is not available
@@ -206,6 +212,94 @@ if filename:
 
 threadLocal = threading.local()
 
+
+class TilingProfile(object):
+    """
+    Timers (in seconds) and counters of the stages of the tiling in a worker, for --profiling.
+    The profile of the current thread is threadLocal.profile, updated with profile_stage()
+    and profile_count() (which do nothing without --profiling).
+    """
+
+    def __init__(self) -> None:
+        self.timers = collections.Counter()
+        self.counters = collections.Counter()
+
+    def merge(self, other: 'TilingProfile') -> None:
+        self.timers.update(other.timers)
+        self.counters.update(other.counters)
+
+
+@contextlib.contextmanager
+def profile_stage(name: str) -> Iterator[None]:
+    """Adds the time spent in the with block to the timer of a stage"""
+    profile = getattr(threadLocal, 'profile', None)
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.timers[name] += time.perf_counter() - start
+
+
+def profile_count(name: str, count: int = 1) -> None:
+    profile = getattr(threadLocal, 'profile', None)
+    if profile is not None:
+        profile.counters[name] += count
+
+
+def run_profiled(func: Any, *args: Any) -> Tuple[Any, TilingProfile]:
+    """Runs a task of a worker with its own TilingProfile, and returns its result and profile"""
+    previous = getattr(threadLocal, 'profile', None)
+    threadLocal.profile = profile = TilingProfile()
+    try:
+        return func(*args), profile
+    finally:
+        threadLocal.profile = previous
+
+
+def map_tasks(func: Any, iterable: Any, pool: Optional[Pool] = None,
+              profile: Optional[TilingProfile] = None, chunksize: int = 1) -> Iterator[Any]:
+    """
+    Runs func on the items of iterable, in the pool if it is given (in any order), and yields
+    the results. With a profile, the profiles of the tasks are merged into it.
+    """
+    if profile is not None:
+        func = partial(run_profiled, func)
+    if pool is None:
+        results = map(func, iterable)
+    else:
+        results = pool.imap_unordered(func, iterable, chunksize=chunksize)
+    for result in results:
+        if profile is not None:
+            result, task_profile = result
+            profile.merge(task_profile)
+        yield result
+
+
+def write_profiling_report(filename: str, profile: TilingProfile, wall_times: Dict[str, float],
+                           mode: str, nb_workers: int) -> None:
+    """Writes the JSON report of --profiling"""
+    wall_time = sum(wall_times.values())
+    nb_tiles = profile.counters['base_tiles'] + profile.counters['overview_tiles']
+    report = {
+        'mode': mode,
+        'workers': nb_workers,
+        'wall_time': wall_time,
+        'wall_time_per_step': dict(wall_times),
+        'tiles_per_second': nb_tiles / wall_time if wall_time else None,
+        'base_tiles_per_second': (profile.counters['base_tiles'] / wall_times['base_tiles']
+                                  if wall_times.get('base_tiles') else None),
+        'overview_tiles_per_second': (profile.counters['overview_tiles'] / wall_times['overview_tiles']
+                                      if wall_times.get('overview_tiles') else None),
+        # Summed over the workers
+        'stage_time': dict(sorted(profile.timers.items())),
+        'counters': dict(sorted(profile.counters.items())),
+    }
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=2)
+
 # =============================================================================
 # =============================================================================
 # =============================================================================
@@ -741,8 +835,87 @@ def generate_kml(tx, ty, tz, tileext, tile_size, tileswne, options, children=Non
     return s
 
 
+@lru_cache(maxsize=8)
+def antialias_weights(src_size: int, dst_size: int) -> List[Tuple[slice, slice, 'numpy.ndarray']]:
+    """
+    Returns the weights of a downsampling by a Lanczos filter with a support widened by the
+    scale factor (the ANTIALIAS filter of PIL), as blocks of 64 destination pixels: the slices
+    of the destination and of the source pixels, and the matrix of their weights.
+    """
+    scale = src_size / dst_size
+    filterscale = max(scale, 1.0)
+    support = 3 * filterscale
+    centers = (numpy.arange(dst_size) + 0.5) * scale
+    first = numpy.maximum(numpy.trunc(centers - support + 0.5).astype(int), 0)
+    indices = first[:, None] + numpy.arange(int(math.ceil(2 * support)) + 1)[None, :]
+    x = (indices + 0.5 - centers[:, None]) / filterscale
+    weights = numpy.sinc(x) * numpy.sinc(x / 3)
+    weights[(numpy.abs(x) >= 3) | (indices >= src_size)] = 0
+    weights /= weights.sum(axis=1, keepdims=True)
+    indices = numpy.minimum(indices, src_size - 1)
+
+    blocks = []
+    for start in range(0, dst_size, 64):
+        stop = min(start + 64, dst_size)
+        src_start = indices[start:stop].min()
+        src_stop = indices[start:stop].max() + 1
+        matrix = numpy.zeros((stop - start, src_stop - src_start), numpy.float32)
+        numpy.add.at(matrix, (numpy.arange(stop - start)[:, None], indices[start:stop] - src_start),
+                     weights[start:stop])
+        blocks.append((slice(start, stop), slice(src_start, src_stop), matrix))
+    return blocks
+
+
+def antialias_downsample(array: 'numpy.ndarray', width: int, height: int) -> 'numpy.ndarray':
+    """
+    Downsamples the (bands, rows, columns) array of a tile or a metatile, with the alpha in its
+    last band, to width x height with the 'antialias' filter (separable, on the colors
+    premultiplied by the alpha). Returns an array of bytes.
+    """
+    data = array.astype(numpy.float32)
+    data[:-1] *= data[-1] / 255
+
+    columns = numpy.empty(data.shape[:2] + (width,), numpy.float32)
+    for dst, src, matrix in antialias_weights(data.shape[2], width):
+        columns[:, :, dst] = numpy.matmul(data[:, :, src], matrix.T)
+
+    result = numpy.empty((data.shape[0], height, width), numpy.float32)
+    for dst, src, matrix in antialias_weights(data.shape[1], height):
+        result[:, dst, :] = numpy.matmul(matrix, columns[:, src, :])
+
+    alpha = numpy.clip(result[-1], 0, 255)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        result[:-1] = numpy.where(alpha > 0, result[:-1] * 255 / alpha, 0)
+    result[-1] = alpha
+    return numpy.clip(numpy.round(result), 0, 255).astype(numpy.uint8)
+
+
+def antialias_composite(array: 'numpy.ndarray', tilefilename: str) -> 'numpy.ndarray':
+    """
+    Composites the (bands, rows, columns) array of an 'antialias' tile over the tile file of the
+    same name if it exists (e.g. written from another input file into the same directory), with
+    the alpha of the tile as the mask, like Image.composite() of PIL did. Returns an array of bytes.
+    """
+    if not tilefilename or not os.path.isfile(tilefilename):
+        return array
+    ds = gdal.Open(tilefilename)
+    if (ds is None or ds.RasterCount != array.shape[0] or ds.RasterXSize != array.shape[2] or
+            ds.RasterYSize != array.shape[1]):
+        return array
+    existing = numpy.frombuffer(ds.ReadRaster(0, 0, ds.RasterXSize, ds.RasterYSize),
+                                numpy.uint8).reshape(array.shape)
+    ds = None
+    mask = array[-1].astype(numpy.float32) / 255
+    return numpy.round(array * mask + existing * (1 - mask)).astype(numpy.uint8)
+
+
 def scale_query_to_tile(dsquery, dstile, tiledriver, options, tilefilename=''):
     """Scales down query dataset to the tile dataset"""
+    with profile_stage('resample'):
+        _scale_query_to_tile(dsquery, dstile, tiledriver, options, tilefilename)
+
+
+def _scale_query_to_tile(dsquery, dstile, tiledriver, options, tilefilename):
 
     querysize = dsquery.RasterXSize
     tile_size = dstile.RasterXSize
@@ -761,17 +934,11 @@ def scale_query_to_tile(dsquery, dstile, tiledriver, options, tilefilename=''):
 
     elif options.resampling == 'antialias' and numpy_available:
 
-        # Scaling by PIL (Python Imaging Library) - improved Lanczos
-        array = numpy.zeros((querysize, querysize, tilebands), numpy.uint8)
-        for i in range(tilebands):
-            array[:, :, i] = gdalarray.BandReadAsArray(dsquery.GetRasterBand(i + 1),
-                                                       0, 0, querysize, querysize)
-        im = Image.fromarray(array, 'RGBA')     # Always four bands
-        im1 = im.resize((tile_size, tile_size), Image.ANTIALIAS)
-        if os.path.exists(tilefilename):
-            im0 = Image.open(tilefilename)
-            im1 = Image.composite(im1, im0, im1)
-        im1.save(tilefilename, tiledriver)
+        array = numpy.frombuffer(dsquery.ReadRaster(0, 0, querysize, querysize), numpy.uint8)
+        array = antialias_downsample(array.reshape(tilebands, querysize, querysize),
+                                     tile_size, tile_size)
+        array = antialias_composite(array, tilefilename)
+        dstile.WriteRaster(0, 0, tile_size, tile_size, array.tobytes())
 
     else:
 
@@ -1079,6 +1246,112 @@ def update_alpha_value_for_non_alpha_inputs(warped_vrt_dataset: gdal.Dataset, op
     return warped_vrt_dataset
 
 
+def get_footprint(input_dataset: gdal.Dataset, warped_dataset: gdal.Dataset,
+                  from_srs: osr.SpatialReference, to_srs: osr.SpatialReference) -> Optional[List[Tuple[float, float]]]:
+    """
+    Returns the outline of the input dataset in the output SRS (its edges densified every 256
+    pixels), or None if it can not be trusted: GCPs, points out of the area of use of the output
+    SRS, or edges cut by the antimeridian.
+    """
+    if input_dataset.GetGCPCount() != 0:
+        return None
+
+    gt = input_dataset.GetGeoTransform()
+    xsize, ysize = input_dataset.RasterXSize, input_dataset.RasterYSize
+    nx = max(16, min(1024, xsize // 256))
+    ny = max(16, min(1024, ysize // 256))
+    pixels = ([(xsize * i / nx, 0) for i in range(nx)] +
+              [(xsize, ysize * i / ny) for i in range(ny)] +
+              [(xsize * (nx - i) / nx, ysize) for i in range(nx)] +
+              [(0, ysize * (ny - i) / ny) for i in range(ny)])
+    points = [(gt[0] + px * gt[1] + py * gt[2], gt[3] + px * gt[4] + py * gt[5])
+              for px, py in pixels]
+
+    ct = osr.CoordinateTransformation(from_srs, to_srs)
+    try:
+        footprint = [tuple(p[:2]) for p in ct.TransformPoints(points)]
+    except RuntimeError:
+        return None
+    if not all(math.isfinite(x) and math.isfinite(y) for x, y in footprint):
+        return None
+
+    # The outline must span the extent of the warped dataset (computed by the same sampling of
+    # the edges), without jumps between consecutive points
+    wgt = warped_dataset.GetGeoTransform()
+    width = warped_dataset.RasterXSize * wgt[1]
+    height = warped_dataset.RasterYSize * -wgt[5]
+    xs = [x for x, _ in footprint]
+    ys = [y for _, y in footprint]
+    tolerance = 0.01 * max(width, height)
+    if (abs(min(xs) - wgt[0]) > tolerance or abs(max(xs) - (wgt[0] + width)) > tolerance or
+            abs(max(ys) - wgt[3]) > tolerance or abs(min(ys) - (wgt[3] - height)) > tolerance):
+        return None
+    for (x0, y0), (x1, y1) in zip(footprint, footprint[1:] + footprint[:1]):
+        if abs(x1 - x0) > width / 4 or abs(y1 - y0) > height / 4:
+            return None
+
+    return footprint
+
+
+class FootprintCoverage(object):
+    """
+    Coverage of a grid of tiles by a footprint polygon, for --exclude to drop the base tiles
+    outside of the input dataset without reading them.
+    The columns of tiles covered in each row are the x extents of the parts of the edges inside
+    the row, and of the inside of the polygon along the middle line of the row. A tile is taken
+    as covered if it or one of its 8 neighbours is.
+    """
+
+    def __init__(self, footprint: List[Tuple[float, float]], ulx: float, uly: float,
+                 tile_width: float, tile_height: float) -> None:
+        extents = collections.defaultdict(list)
+        crossings = collections.defaultdict(list)
+
+        for (x0, y0), (x1, y1) in zip(footprint, footprint[1:] + footprint[:1]):
+            first_row = int(math.floor((uly - max(y0, y1)) / tile_height))
+            last_row = int(math.floor((uly - min(y0, y1)) / tile_height))
+            for row in range(first_row, last_row + 1):
+                top = uly - row * tile_height
+                bottom = top - tile_height
+                if y0 == y1:
+                    extents[row].append((min(x0, x1), max(x0, x1)))
+                else:
+                    # Part of the edge between the bottom and the top of the row
+                    t0, t1 = sorted(((bottom - y0) / (y1 - y0), (top - y0) / (y1 - y0)))
+                    xa = x0 + max(t0, 0) * (x1 - x0)
+                    xb = x0 + min(t1, 1) * (x1 - x0)
+                    extents[row].append((min(xa, xb), max(xa, xb)))
+
+                    middle = top - tile_height / 2
+                    if (y0 > middle) != (y1 > middle):
+                        crossings[row].append(x0 + (middle - y0) / (y1 - y0) * (x1 - x0))
+
+        for row, xs in crossings.items():
+            xs.sort()
+            extents[row].extend(zip(xs[::2], xs[1::2]))
+
+        # Sorted and merged ranges of columns of each row
+        self.rows = {}
+        for row, row_extents in extents.items():
+            columns = sorted((int(math.floor((xa - ulx) / tile_width)),
+                              int(math.floor((xb - ulx) / tile_width))) for xa, xb in row_extents)
+            merged = [list(columns[0])]
+            for c0, c1 in columns[1:]:
+                if c0 <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], c1)
+                else:
+                    merged.append([c0, c1])
+            self.rows[row] = merged
+
+    def __contains__(self, tile: Tuple[int, int]) -> bool:
+        column, row = tile
+        for r in (row - 1, row, row + 1):
+            for c0, c1 in self.rows.get(r, ()):
+                if c0 <= column + 1 and c1 >= column - 1:
+                    return True
+        return False
+
+
 def nb_data_bands(dataset: gdal.Dataset) -> int:
     """
     Return the number of data (non-alpha) bands of a gdal dataset
@@ -1090,6 +1363,474 @@ def nb_data_bands(dataset: gdal.Dataset) -> int:
         return dataset.RasterCount - 1
     return dataset.RasterCount
 
+
+class TileCache(object):
+    """
+    Bounded LRU cache of the raw pixels (as returned by ReadRaster()) of the tiles just generated,
+    keyed by (tz, tx, ty) as in the tile file names, so that the overview tiles can be built from
+    them without reading and decoding the tile files again
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.tiles = collections.OrderedDict()
+
+    def put(self, key: Tuple[int, int, int], data: bytes) -> None:
+        self.tiles[key] = data
+        self.tiles.move_to_end(key)
+        while len(self.tiles) > self.max_size:
+            self.tiles.popitem(last=False)
+
+    def pop(self, key: Tuple[int, int, int]) -> Optional[bytes]:
+        # A tile is only used once, by its overview tile
+        return self.tiles.pop(key, None)
+
+
+def get_tile_database_format(output: str) -> Optional[str]:
+    """Returns 'MBTiles' or 'GPKG' if the tiles are written to such a file, None for a directory"""
+    ext = os.path.splitext(output)[1].lower()
+    if ext == '.mbtiles':
+        return 'MBTiles'
+    if ext == '.gpkg':
+        return 'GPKG'
+    return None
+
+
+class TileDatabase(object):
+    """
+    Tile table of a MBTiles or GeoPackage file (created by GDAL2Tiles.generate_tile_database()),
+    with the tiles in TMS numbering. The tiles are only inserted by the TileDatabaseWriter of the
+    main process, the workers only read the tiles they build the overview tiles from.
+    """
+
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        # Closed by the main thread with close_tile_database() in --threads mode
+        self.conn = sqlite3.connect(filename, timeout=60, check_same_thread=False)
+        self.images = False
+        if get_tile_database_format(filename) == 'MBTiles':
+            self.table = 'tiles'
+            self.matrix_heights = None
+            # With --dedup, tiles is a view of the map and images tables
+            self.images = self.conn.execute(
+                "SELECT type FROM sqlite_master WHERE name = 'tiles'").fetchone()[0] == 'view'
+        else:
+            self.table = self.conn.execute(
+                "SELECT table_name FROM gpkg_contents WHERE data_type = 'tiles'").fetchone()[0]
+            self.matrix_heights = dict(self.conn.execute(
+                'SELECT zoom_level, matrix_height FROM gpkg_tile_matrix WHERE table_name = ?',
+                (self.table,)))
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def tile_row(self, tz: int, ty: int) -> int:
+        # MBTiles use the TMS numbering, GeoPackage has its rows from the top
+        if self.matrix_heights is None:
+            return ty
+        return self.matrix_heights[tz] - 1 - ty
+
+    def select_tile(self, column: str, tz: int, tx: int, ty: int) -> Optional[tuple]:
+        return self.conn.execute(
+            'SELECT %s FROM "%s" WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?' % (
+                column, self.table.replace('"', '""')),
+            (tz, tx, self.tile_row(tz, ty))).fetchone()
+
+    def has_tile(self, tz: int, tx: int, ty: int) -> bool:
+        return self.select_tile('1', tz, tx, ty) is not None
+
+    def get_tile(self, tz: int, tx: int, ty: int) -> Optional[bytes]:
+        row = self.select_tile('tile_data', tz, tx, ty)
+        return None if row is None else row[0]
+
+    def put_tiles(self, tiles: List[Tuple[int, int, int, bytes, Optional[str]]]) -> None:
+        """
+        Inserts (or replaces) the (tz, tx, ty, data, content hash) tiles in a single transaction.
+        In the images table, the tiles with the same hash share the same row.
+        """
+        with self.conn:
+            if self.images:
+                rows = [(tz, tx, self.tile_row(tz, ty), tile_hash or hashlib.sha1(data).hexdigest(), data)
+                        for tz, tx, ty, data, tile_hash in tiles]
+                self.conn.executemany('INSERT OR IGNORE INTO images (tile_id, tile_data) VALUES (?, ?)',
+                                      [row[3:] for row in rows])
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO map (zoom_level, tile_column, tile_row, tile_id) '
+                    'VALUES (?, ?, ?, ?)', [row[:4] for row in rows])
+            else:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO "%s" (zoom_level, tile_column, tile_row, tile_data) '
+                    'VALUES (?, ?, ?, ?)' % self.table.replace('"', '""'),
+                    [(tz, tx, self.tile_row(tz, ty), data) for tz, tx, ty, data, _ in tiles])
+
+
+class TileDatabaseWriter(threading.Thread):
+    """
+    Thread of the main process inserting the tiles that the workers send to a queue into the
+    MBTiles or GeoPackage file, by batches of BATCH_SIZE tiles per transaction, so that the file
+    has a single writer.
+    """
+
+    BATCH_SIZE = 512
+    FLUSH = 'flush'
+
+    def __init__(self, filename: str, tiles_queue: Any) -> None:
+        super(TileDatabaseWriter, self).__init__()
+        self.daemon = True
+        self.filename = filename
+        self.queue = tiles_queue
+        self.flushed = threading.Event()
+        self.error = None
+        self.profile = TilingProfile()
+
+    def run(self) -> None:
+        # Time of the inserts, for --profiling
+        threadLocal.profile = self.profile
+        try:
+            tile_db = TileDatabase(self.filename)
+            tiles = []
+            while True:
+                item = self.queue.get()
+                if isinstance(item, tuple):
+                    tiles.append(item)
+                    if len(tiles) < self.BATCH_SIZE:
+                        continue
+                with profile_stage('db_insert'):
+                    tile_db.put_tiles(tiles)
+                tiles = []
+                if item is None:
+                    break
+                if item == self.FLUSH:
+                    self.flushed.set()
+            # Leave a file readable without its -wal and -shm files
+            tile_db.conn.execute('PRAGMA journal_mode=DELETE')
+            tile_db.close()
+        except Exception as e:
+            self.error = e
+            self.flushed.set()
+
+    def flush(self) -> None:
+        """Waits until all the tiles sent so far are committed"""
+        if self.error is None and self.is_alive():
+            self.flushed.clear()
+            self.queue.put(self.FLUSH)
+            # The thread may have failed (and set the event) just before it was cleared
+            while not self.flushed.wait(1):
+                if not self.is_alive():
+                    break
+        if self.error is not None:
+            exit_with_error("Cannot write the tiles to %s: %s" % (self.filename, self.error))
+
+    def close(self) -> None:
+        self.queue.put(None)
+        self.join()
+        if self.error is not None:
+            exit_with_error("Cannot write the tiles to %s: %s" % (self.filename, self.error))
+
+
+# Queue the tiles are sent to when they are written to a MBTiles or GeoPackage file
+# (see TileDatabaseWriter)
+tiles_queue = None
+
+
+def set_tiles_queue(q: Any) -> None:
+    """Sets the queue the tiles are sent to (in the pool initializer of the worker processes)"""
+    global tiles_queue
+    tiles_queue = q
+
+
+# TileDatabase readers opened by the threads of the process
+tile_databases = []
+tile_databases_lock = threading.Lock()
+
+
+def get_tile_database(filename: str) -> TileDatabase:
+    """Returns the TileDatabase of the current thread to read the tiles of a file"""
+    tile_db = getattr(threadLocal, 'tile_db', None)
+    if tile_db is None or tile_db.filename != filename:
+        tile_db = TileDatabase(filename)
+        threadLocal.tile_db = tile_db
+        with tile_databases_lock:
+            tile_databases.append(tile_db)
+    return tile_db
+
+
+def close_tile_database() -> None:
+    """
+    Closes the TileDatabase readers of all the threads of the process, once they are done,
+    so that the writer can leave the WAL mode
+    """
+    with tile_databases_lock:
+        for tile_db in tile_databases:
+            tile_db.close()
+        del tile_databases[:]
+    if getattr(threadLocal, 'tile_db', None) is not None:
+        del threadLocal.tile_db
+
+
+class ResumeManifest(object):
+    """
+    Record of the tiles written to an output directory, for --resume without a stat() per tile.
+    Each thread appends the (tz, tx, ty) in TMS numbering of the tiles it writes to its own
+    journal file, and merge() gathers the journals in a bitmap of the tiles of each zoom level.
+    The manifest is only created with the output directory, so that the tiles written by an
+    older version (or another program) are still looked for on disk.
+    """
+
+    DIRNAME = '.gdal2tiles_resume'
+    RECORD = struct.Struct('<III')
+    HEADER = struct.Struct('<IIIII')
+
+    def __init__(self) -> None:
+        # By zoom level: (minx, miny, width, height, bitmap with rows of (width + 7) // 8 bytes)
+        self.bitmaps = {}
+
+    @staticmethod
+    def get_dirname(output: str) -> str:
+        return os.path.join(output, ResumeManifest.DIRNAME)
+
+    @staticmethod
+    def create(output: str) -> None:
+        """Creates an empty manifest if there is none"""
+        filename = os.path.join(ResumeManifest.get_dirname(output), 'manifest')
+        if not os.path.exists(filename):
+            os.makedirs(ResumeManifest.get_dirname(output), exist_ok=True)
+            ResumeManifest().write(filename)
+
+    @staticmethod
+    def read(output: str) -> Optional['ResumeManifest']:
+        """Reads the manifest of an output directory, or returns None if it has none"""
+        filename = os.path.join(ResumeManifest.get_dirname(output), 'manifest')
+        if not os.path.exists(filename):
+            return None
+        manifest = ResumeManifest()
+        with open(filename, 'rb') as f:
+            data = f.read()
+        pos = 0
+        while pos < len(data):
+            tz, minx, miny, width, height = ResumeManifest.HEADER.unpack_from(data, pos)
+            pos += ResumeManifest.HEADER.size
+            size = (width + 7) // 8 * height
+            manifest.bitmaps[tz] = (minx, miny, width, height, bytearray(data[pos:pos + size]))
+            pos += size
+        return manifest
+
+    def write(self, filename: str) -> None:
+        with open(filename + '.tmp', 'wb') as f:
+            for tz, (minx, miny, width, height, bitmap) in sorted(self.bitmaps.items()):
+                f.write(ResumeManifest.HEADER.pack(tz, minx, miny, width, height))
+                f.write(bitmap)
+        os.replace(filename + '.tmp', filename)
+
+    @staticmethod
+    def read_journal(filename: str) -> Iterator[Tuple[int, int, int]]:
+        with open(filename, 'rb') as f:
+            while True:
+                data = f.read(ResumeManifest.RECORD.size * 65536)
+                # A record may have been partially written by an interrupted run
+                data = data[:len(data) - len(data) % ResumeManifest.RECORD.size]
+                if not data:
+                    return
+                yield from ResumeManifest.RECORD.iter_unpack(data)
+
+    @staticmethod
+    def merge(output: str) -> Optional['ResumeManifest']:
+        """
+        Merges the journals of an output directory in its manifest, and returns the manifest, or
+        None if the directory has none
+        """
+        old = ResumeManifest.read(output)
+        if old is None:
+            return None
+        dirname = ResumeManifest.get_dirname(output)
+        journals = glob.glob(os.path.join(dirname, '*.journal'))
+        if not journals:
+            return old
+
+        # Extend the bitmaps to the tiles of the journals
+        ranges = {tz: [minx, miny, minx + width - 1, miny + height - 1]
+                  for tz, (minx, miny, width, height, _) in old.bitmaps.items()}
+        for journal in journals:
+            for tz, tx, ty in ResumeManifest.read_journal(journal):
+                r = ranges.setdefault(tz, [tx, ty, tx, ty])
+                r[0], r[1], r[2], r[3] = min(r[0], tx), min(r[1], ty), max(r[2], tx), max(r[3], ty)
+
+        manifest = ResumeManifest()
+        for tz, (minx, miny, maxx, maxy) in ranges.items():
+            width, height = maxx - minx + 1, maxy - miny + 1
+            if tz in old.bitmaps and old.bitmaps[tz][:4] == (minx, miny, width, height):
+                manifest.bitmaps[tz] = old.bitmaps[tz]
+            else:
+                manifest.bitmaps[tz] = (minx, miny, width, height,
+                                        bytearray((width + 7) // 8 * height))
+                if tz in old.bitmaps:
+                    for tx, ty in old.tiles(tz):
+                        manifest.add(tz, tx, ty)
+        for journal in journals:
+            for tz, tx, ty in ResumeManifest.read_journal(journal):
+                manifest.add(tz, tx, ty)
+
+        manifest.write(os.path.join(dirname, 'manifest'))
+        for journal in journals:
+            os.remove(journal)
+        return manifest
+
+    def tiles(self, tz: int) -> Iterator[Tuple[int, int]]:
+        minx, miny, width, height, bitmap = self.bitmaps[tz]
+        stride = (width + 7) // 8
+        for i, byte in enumerate(bitmap):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield minx + i % stride * 8 + bit, miny + i // stride
+
+    def add(self, tz: int, tx: int, ty: int) -> None:
+        minx, miny, width, height, bitmap = self.bitmaps[tz]
+        x, y = tx - minx, ty - miny
+        bitmap[y * ((width + 7) // 8) + x // 8] |= 1 << (x % 8)
+
+    def __contains__(self, tile: Tuple[int, int, int]) -> bool:
+        tz, tx, ty = tile
+        if tz not in self.bitmaps:
+            return False
+        minx, miny, width, height, bitmap = self.bitmaps[tz]
+        x, y = tx - minx, ty - miny
+        if not (0 <= x < width and 0 <= y < height):
+            return False
+        return bool(bitmap[y * ((width + 7) // 8) + x // 8] & (1 << (x % 8)))
+
+
+# Manifests of the output directories, read once per process
+resume_manifests = {}
+
+
+def get_resume_manifest(output: str) -> Optional[ResumeManifest]:
+    if output not in resume_manifests:
+        resume_manifests[output] = ResumeManifest.read(output)
+    return resume_manifests[output]
+
+
+def record_tile(output: str, tz: int, tx: int, ty: int) -> None:
+    """Appends a tile just written to the journal of the current thread, if the output has a manifest"""
+    journal = getattr(threadLocal, 'resume_journal', None)
+    if journal is None or journal[0] != output:
+        if journal is not None and journal[1] is not None:
+            journal[1].close()
+        dirname = ResumeManifest.get_dirname(output)
+        f = None
+        if os.path.isdir(dirname):
+            # Unbuffered: the records of the tiles written are kept even if the process is killed.
+            # The file is closed with the thread (in --threads mode) or the process.
+            f = open(os.path.join(dirname, '%s.journal' % uuid4()), 'ab', buffering=0)
+        journal = threadLocal.resume_journal = (output, f)
+    if journal[1] is not None:
+        journal[1].write(ResumeManifest.RECORD.pack(tz, tx, ty))
+
+
+def tile_exists(output: str, options: Options, tz: int, tx: int, ytile: int, tileext: str) -> bool:
+    """Returns whether a tile (numbered as in the tile file names) is already in the output"""
+    ty = GDAL2Tiles.getYTile(ytile, tz, options)
+    if get_tile_database_format(output) is None:
+        manifest = get_resume_manifest(output)
+        if manifest is not None:
+            return (tz, tx, ty) in manifest
+        return os.path.exists(os.path.join(output, str(tz), str(tx), "%s.%s" % (ytile, tileext)))
+    return get_tile_database(output).has_tile(tz, tx, ty)
+
+
+def read_tile(tile_job_info: 'TileJobInfo', tz: int, tx: int, ytile: int) -> Optional[bytes]:
+    """Returns the pixels (as returned by ReadRaster()) of a tile of the output, or None"""
+    output = tile_job_info.output_file_path
+    if get_tile_database_format(output) is None:
+        filename = os.path.join(output, str(tz), str(tx),
+                                "%s.%s" % (ytile, tile_job_info.tile_extension))
+        if not os.path.isfile(filename):
+            return None
+    else:
+        data = get_tile_database(output).get_tile(
+            tz, tx, GDAL2Tiles.getYTile(ytile, tz, tile_job_info.options))
+        if data is None:
+            return None
+        filename = '/vsimem/%s.%s' % (uuid4(), tile_job_info.tile_extension)
+        gdal.FileFromMemBuffer(filename, data)
+
+    with profile_stage('read_tiles'):
+        ds = gdal.Open(filename, gdal.GA_ReadOnly)
+        data = ds.ReadRaster(0, 0, tile_job_info.tile_size, tile_job_info.tile_size)
+        ds = None
+    if filename.startswith('/vsimem/'):
+        gdal.Unlink(filename)
+    return data
+
+
+def write_tile(tile_job_info: 'TileJobInfo', out_drv: gdal.Driver, dstile: gdal.Dataset,
+               tz: int, tx: int, ytile: int, tilefilename: str) -> None:
+    """
+    Writes a tile to its file, or encodes it and sends it to the tiles queue for the
+    TileDatabaseWriter.
+    With --dedup, a tile with the same pixels as one of the last tiles written by the thread is
+    not encoded again: its file is a hardlink to the file of this tile, or its encoded data is
+    sent again along with the content hash.
+    """
+    options = tile_job_info.options
+    tile_hash = written = None
+    if options.dedup:
+        tile_hash = hashlib.sha1(dstile.ReadRaster(0, 0, dstile.RasterXSize,
+                                                   dstile.RasterYSize)).hexdigest()
+        written_tiles = getattr(threadLocal, 'written_tiles', None)
+        if written_tiles is None:
+            written_tiles = threadLocal.written_tiles = collections.OrderedDict()
+        written_key = (tile_job_info.output_file_path, tile_hash)
+        written = written_tiles.get(written_key)
+
+    if get_tile_database_format(tile_job_info.output_file_path) is None:
+        # Do not write through a hardlink of a --dedup run, into the other tiles of its content
+        try:
+            os.remove(tilefilename)
+        except OSError:
+            pass
+        data = None
+        if written is not None:
+            try:
+                os.link(written, tilefilename)
+                data = written
+                profile_count('dedup_hits')
+            except OSError:
+                # e.g. too many links: the tile becomes the file of its content
+                pass
+        if data is None:
+            with profile_stage('encode_write'):
+                out_drv.CreateCopy(tilefilename, dstile, strict=0)
+            data = tilefilename
+            if getattr(threadLocal, 'profile', None) is not None:
+                profile_count('bytes_written', os.path.getsize(tilefilename))
+        record_tile(tile_job_info.output_file_path, tz, tx, GDAL2Tiles.getYTile(ytile, tz, options))
+
+    else:
+        data = written
+        if data is None:
+            with profile_stage('encode'):
+                filename = '/vsimem/%s.%s' % (uuid4(), tile_job_info.tile_extension)
+                out_drv.CreateCopy(filename, dstile, strict=0)
+                f = gdal.VSIFOpenL(filename, 'rb')
+                data = gdal.VSIFReadL(1, gdal.VSIStatL(filename).size, f)
+                gdal.VSIFCloseL(f)
+                gdal.Unlink(filename)
+            profile_count('bytes_written', len(data))
+        else:
+            profile_count('dedup_hits')
+
+        tiles_queue.put((tz, tx, GDAL2Tiles.getYTile(ytile, tz, options), data, tile_hash))
+
+    if tile_hash is not None:
+        # Uniform tiles (nodata, sea...) are the most frequent duplicates, only the last
+        # contents are kept
+        written_tiles[written_key] = data
+        written_tiles.move_to_end(written_key)
+        while len(written_tiles) > 64:
+            written_tiles.popitem(last=False)
+
+
 def create_base_tile(tile_job_info: 'TileJobInfo', tile_detail: 'TileDetail') -> None:
 
     dataBandsCount = tile_job_info.nb_data_bands
@@ -1111,8 +1852,6 @@ def create_base_tile(tile_job_info: 'TileJobInfo', tile_detail: 'TileDetail') ->
     out_drv = gdal.GetDriverByName(tile_job_info.tile_driver)
     alphaband = ds.GetRasterBand(1).GetMaskBand()
 
-    tx = tile_detail.tx
-    ty = tile_detail.ty
     tz = tile_detail.tz
     rx = tile_detail.rx
     ry = tile_detail.ry
@@ -1123,11 +1862,11 @@ def create_base_tile(tile_job_info: 'TileJobInfo', tile_detail: 'TileDetail') ->
     wxsize = tile_detail.wxsize
     wysize = tile_detail.wysize
     querysize = tile_detail.querysize
+    metasize = tile_detail.metasize
 
-    # Tile dataset in memory
-    tilefilename = os.path.join(
-        output, str(tz), str(tx), "%s.%s" % (ty, tileext))
-    dstile = mem_drv.Create('', tile_size, tile_size, tilebands)
+    # Metatile dataset in memory, the queries of its tiles are cut from it.
+    # It is a transparent file by default.
+    dsmeta = mem_drv.Create('', metasize, metasize, tilebands)
 
     data = alpha = None
 
@@ -1139,195 +1878,366 @@ def create_base_tile(tile_job_info: 'TileJobInfo', tile_detail: 'TileDetail') ->
     # We scale down the query to the tile_size by supplied algorithm.
 
     if rxsize != 0 and rysize != 0 and wxsize != 0 and wysize != 0:
-        alpha = alphaband.ReadRaster(rx, ry, rxsize, rysize, wxsize, wysize)
+        # Reading the mask of a reprojected input runs the warper
+        with profile_stage('read_mask'):
+            alpha = alphaband.ReadRaster(rx, ry, rxsize, rysize, wxsize, wysize)
 
         # Detect totally transparent tile and skip its creation
         if tile_job_info.exclude_transparent and len(alpha) == alpha.count('\x00'.encode('ascii')):
+            profile_count('transparent_tiles_skipped', len(tile_detail.tiles))
             return
 
-        data = ds.ReadRaster(rx, ry, rxsize, rysize, wxsize, wysize,
-                             band_list=list(range(1, dataBandsCount + 1)))
+        with profile_stage('read_data'):
+            data = ds.ReadRaster(rx, ry, rxsize, rysize, wxsize, wysize,
+                                 band_list=list(range(1, dataBandsCount + 1)))
 
-    # The tile in memory is a transparent file by default. Write pixel values into it if
-    # any
+    # Write pixel values into the metatile if any
     if data:
+        dsmeta.WriteRaster(wx, wy, wxsize, wysize, data,
+                           band_list=list(range(1, dataBandsCount + 1)))
+        dsmeta.WriteRaster(wx, wy, wxsize, wysize, alpha, band_list=[tilebands])
+
+    del data
+
+    # With 'antialias', the metatile is downsampled at once, and its tiles cut from the result
+    antialias_meta = None
+
+    for tx, ty, qx, qy in tile_detail.tiles:
+
+        tilefilename = os.path.join(
+            output, str(tz), str(tx), "%s.%s" % (ty, tileext))
+
+        if metasize == querysize:
+            dsquery = dsmeta
+        else:
+            dsquery = mem_drv.Create('', querysize, querysize, tilebands)
+            if alpha:
+                dsquery.WriteRaster(0, 0, querysize, querysize,
+                                    dsmeta.ReadRaster(qx, qy, querysize, querysize))
+
+                # Detect totally transparent tile of the metatile and skip its creation
+                if tile_job_info.exclude_transparent:
+                    tile_alpha = dsquery.ReadRaster(0, 0, querysize, querysize, band_list=[tilebands])
+                    if len(tile_alpha) == tile_alpha.count('\x00'.encode('ascii')):
+                        profile_count('transparent_tiles_skipped')
+                        continue
+
         if tile_size == querysize:
             # Use the ReadRaster result directly in tiles ('nearest neighbour' query)
-            dstile.WriteRaster(wx, wy, wxsize, wysize, data,
-                               band_list=list(range(1, dataBandsCount + 1)))
-            dstile.WriteRaster(wx, wy, wxsize, wysize, alpha, band_list=[tilebands])
+            dstile = dsquery
 
             # Note: For source drivers based on WaveLet compression (JPEG2000, ECW,
             # MrSID) the ReadRaster function returns high-quality raster (not ugly
             # nearest neighbour)
             # TODO: Use directly 'near' for WaveLet files
         else:
-            # Big ReadRaster query in memory scaled to the tile_size - all but 'near'
-            # algo
-            dsquery = mem_drv.Create('', querysize, querysize, tilebands)
-            # TODO: fill the null value in case a tile without alpha is produced (now
-            # only png tiles are supported)
-            dsquery.WriteRaster(wx, wy, wxsize, wysize, data,
-                                band_list=list(range(1, dataBandsCount + 1)))
-            dsquery.WriteRaster(wx, wy, wxsize, wysize, alpha, band_list=[tilebands])
+            # Tile dataset in memory
+            dstile = mem_drv.Create('', tile_size, tile_size, tilebands)
 
-            scale_query_to_tile(dsquery, dstile, tile_job_info.tile_driver, options,
-                                tilefilename=tilefilename)
-            del dsquery
-
-    del data
+            if options.resampling == 'antialias':
+                if not alpha:
+                    array = numpy.zeros((tilebands, tile_size, tile_size), numpy.uint8)
+                else:
+                    if antialias_meta is None:
+                        with profile_stage('resample'):
+                            array = numpy.frombuffer(dsmeta.ReadRaster(0, 0, metasize, metasize),
+                                                     numpy.uint8)
+                            meta_tile_size = metasize * tile_size // querysize
+                            antialias_meta = antialias_downsample(
+                                array.reshape(tilebands, metasize, metasize),
+                                meta_tile_size, meta_tile_size)
+                    x = qx * tile_size // querysize
+                    y = qy * tile_size // querysize
+                    array = antialias_meta[:, y:y + tile_size, x:x + tile_size]
+                dstile.WriteRaster(0, 0, tile_size, tile_size, numpy.ascontiguousarray(
+                    antialias_composite(array, tilefilename)).tobytes())
+            elif alpha:
+                # Big ReadRaster query in memory scaled to the tile_size - all but 'near'
+                # algo
+                # TODO: fill the null value in case a tile without alpha is produced (now
+                # only png tiles are supported)
+                scale_query_to_tile(dsquery, dstile, tile_job_info.tile_driver, options,
+                                    tilefilename=tilefilename)
+        del dsquery
 
-    if options.resampling != 'antialias':
         # Write a copy of tile to png/jpg
-        out_drv.CreateCopy(tilefilename, dstile, strict=0)
+        write_tile(tile_job_info, out_drv, dstile, tz, tx, ty, tilefilename)
+        profile_count('base_tiles')
+
+        tile_cache = getattr(threadLocal, 'tile_cache', None)
+        if tile_cache is not None:
+            tile_cache.put((tz, tx, ty), dstile.ReadRaster(0, 0, tile_size, tile_size))
+
+        del dstile
+
+        # Create a KML file for this tile.
+        if tile_job_info.kml:
+            swne = get_tile_swne(tile_job_info, options)
+            if swne is not None:
+                kmlfilename = os.path.join(output, str(tz), str(tx), '%d.kml' % GDAL2Tiles.getYTile(ty, tz, options))
+                if not options.resume or not os.path.exists(kmlfilename):
+                    with open(kmlfilename, 'wb') as f:
+                        f.write(generate_kml(
+                            tx, ty, tz, tile_job_info.tile_extension, tile_job_info.tile_size,
+                            swne, tile_job_info.options
+                        ).encode('utf-8'))
 
-    del dstile
 
-    # Create a KML file for this tile.
-    if tile_job_info.kml:
-        swne = get_tile_swne(tile_job_info, options)
-        if swne is not None:
-            kmlfilename = os.path.join(output, str(tz), str(tx), '%d.kml' % GDAL2Tiles.getYTile(ty, tz, options))
-            if not options.resume or not os.path.exists(kmlfilename):
-                with open(kmlfilename, 'wb') as f:
-                    f.write(generate_kml(
-                        tx, ty, tz, tile_job_info.tile_extension, tile_job_info.tile_size,
-                        swne, tile_job_info.options
-                    ).encode('utf-8'))
+def get_base_tiles(tile_job_info: 'TileJobInfo', tz: int, tx: int, ty: int) -> List[Tuple[int, int]]:
+    """Returns the (x, y) of the underlying tiles of zoom level tz + 1 of a tile"""
+    minx, miny, maxx, maxy = tile_job_info.tminmax[tz + 1]
+    return [(x, y)
+            for y in range(max(2 * ty, miny), min(2 * ty + 1, maxy) + 1)
+            for x in range(max(2 * tx, minx), min(2 * tx + 1, maxx) + 1)]
+
+
+def overview_base_tiles(base_tz: int, tile_job_info: 'TileJobInfo') -> Iterator[Tuple[int, int, List[Tuple[int, int]]]]:
+    """
+    Generate the (tx, ty, base tiles) of the overview tiles of the zoom level base_tz - 1, where
+    base tiles is the list of the (x, y) of the underlying tiles of zoom level base_tz
+    """
+    tz = base_tz - 1
+    tminx, tminy, tmaxx, tmaxy = tile_job_info.tminmax[tz]
+    for ty in range(tmaxy, tminy - 1, -1):
+        for tx in range(tminx, tmaxx + 1):
+            yield tx, ty, get_base_tiles(tile_job_info, tz, tx, ty)
+
+
+def count_overview_tiles(tile_job_info: 'TileJobInfo', base_tz: Optional[int] = None) -> int:
+    if base_tz is None:
+        base_tz = tile_job_info.tmaxz
+    tcount = 0
+    for tz in range(base_tz - 1, tile_job_info.tminz - 1, -1):
+        tminx, tminy, tmaxx, tmaxy = tile_job_info.tminmax[tz]
+        tcount += (1 + abs(tmaxx - tminx)) * (1 + abs(tmaxy - tminy))
+    return tcount
+
 
+def create_overview_tile(base_tz: int, output_folder: str, tile_job_info: 'TileJobInfo', options: Options,
+                         overview_tile: Tuple[int, int, List[Tuple[int, int]]]) -> None:
+    """Generation of an overview tile of zoom level base_tz - 1 from its (up to 4) underlying tiles"""
+    tx, ty, base_tiles = overview_tile
+    tz = base_tz - 1
 
+    ytile = GDAL2Tiles.getYTile(ty, tz, options)
+    tilefilename = os.path.join(output_folder,
+                                str(tz),
+                                str(tx),
+                                "%s.%s" % (ytile, tile_job_info.tile_extension))
+
+    if options.verbose:
+        print(tilefilename)
+
+    if options.resume and tile_exists(output_folder, options, tz, tx, ytile,
+                                      tile_job_info.tile_extension):
+        if options.verbose:
+            print("Tile generation skipped because of --resume")
+        profile_count('resumed_tiles_skipped')
+        return
+
+    if not base_tiles:
+        return
 
-def create_overview_tiles(tile_job_info: 'TileJobInfo', output_folder: str, options: Options) -> None:
-    """Generation of the overview tiles (higher in the pyramid) based on existing tiles"""
     mem_driver = gdal.GetDriverByName('MEM')
     tile_driver = tile_job_info.tile_driver
     out_driver = gdal.GetDriverByName(tile_driver)
 
     tilebands = tile_job_info.nb_data_bands + 1
 
-    # Usage of existing tiles: from 4 underlying tiles generate one as overview.
+    dsquery = mem_driver.Create('', 2 * tile_job_info.tile_size,
+                                2 * tile_job_info.tile_size, tilebands)
+    # TODO: fill the null value
+    dstile = mem_driver.Create('', tile_job_info.tile_size, tile_job_info.tile_size,
+                               tilebands)
+
+    # The underlying tiles are taken from the tile cache if they have just been generated
+    # (see create_tile_subtree())
+    tile_cache = getattr(threadLocal, 'tile_cache', None)
+
+    children = []
+    # Read the tiles and write them to query window
+    for x, y in base_tiles:
+        ytile2 = GDAL2Tiles.getYTile(y, base_tz, options)
+        data = tile_cache.pop((base_tz, x, ytile2)) if tile_cache is not None else None
+        if data is not None:
+            profile_count('tile_cache_hits')
+        else:
+            data = read_tile(tile_job_info, base_tz, x, ytile2)
+            if data is None:
+                continue
 
-    tcount = 0
-    for tz in range(tile_job_info.tmaxz - 1, tile_job_info.tminz - 1, -1):
-        tminx, tminy, tmaxx, tmaxy = tile_job_info.tminmax[tz]
-        tcount += (1 + abs(tmaxx - tminx)) * (1 + abs(tmaxy - tminy))
+        if x == 2*tx:
+            tileposx = 0
+        else:
+            tileposx = tile_job_info.tile_size
 
-    ti = 0
+        if options.xyz and options.profile == 'raster':
+            if y == 2*ty:
+                tileposy = 0
+            else:
+                tileposy = tile_job_info.tile_size
+        else:
+            if y == 2*ty:
+                tileposy = tile_job_info.tile_size
+            else:
+                tileposy = 0
 
-    if tcount == 0:
+        dsquery.WriteRaster(
+            tileposx, tileposy, tile_job_info.tile_size,
+            tile_job_info.tile_size, data,
+            band_list=list(range(1, tilebands + 1)))
+        children.append([x, y, base_tz])
+
+    if not children:
         return
 
-    if not options.quiet:
-        print("Generating Overview Tiles:")
+    # Create directories for the tile
+    if get_tile_database_format(output_folder) is None:
+        os.makedirs(os.path.dirname(tilefilename), exist_ok=True)
 
-    progress_bar = ProgressBar(tcount)
-    progress_bar.start()
+    scale_query_to_tile(dsquery, dstile, tile_driver, options,
+                        tilefilename=tilefilename)
+    # Write a copy of tile to png/jpg
+    write_tile(tile_job_info, out_driver, dstile, tz, tx, ytile, tilefilename)
+    profile_count('overview_tiles')
 
-    for tz in range(tile_job_info.tmaxz - 1, tile_job_info.tminz - 1, -1):
+    if tile_cache is not None:
+        tile_cache.put((tz, tx, ytile), dstile.ReadRaster(0, 0, tile_job_info.tile_size,
+                                                          tile_job_info.tile_size))
+
+    if options.verbose:
+        print("\tbuild from zoom", base_tz,
+              " tiles:", (2 * tx, 2 * ty), (2 * tx + 1, 2 * ty),
+              (2 * tx, 2 * ty + 1), (2 * tx + 1, 2 * ty + 1))
+
+    # Create a KML file for this tile.
+    if tile_job_info.kml:
+        swne = get_tile_swne(tile_job_info, options)
+        if swne is not None:
+            with open(os.path.join(
+                output_folder,
+                '%d/%d/%d.kml' % (tz, tx, ytile)
+            ), 'wb') as f:
+                f.write(generate_kml(
+                    tx, ty, tz, tile_job_info.tile_extension, tile_job_info.tile_size,
+                    swne, options, children
+                ).encode('utf-8'))
+
+
+def get_subtree_zoom(tile_job_info: 'TileJobInfo', nb_subtrees: int) -> int:
+    """
+    Returns the lowest zoom level with at least nb_subtrees tiles (or the max zoom level), or the
+    zoom level of the tiles the size of a metatile if it is higher
+    """
+    metatile_tz = tile_job_info.tmaxz - (tile_job_info.metatile.bit_length() - 1)
+    for tz in range(tile_job_info.tminz, tile_job_info.tmaxz):
         tminx, tminy, tmaxx, tmaxy = tile_job_info.tminmax[tz]
+        if (1 + abs(tmaxx - tminx)) * (1 + abs(tmaxy - tminy)) >= nb_subtrees:
+            return min(tz, metatile_tz)
+    return metatile_tz
+
+
+def group_tile_details(tile_job_info: 'TileJobInfo', tile_details: List['TileDetail'],
+                       subtree_tz: int) -> List[Tuple[int, int, int, Dict[Tuple[int, int], 'TileDetail']]]:
+    """
+    Group the base tiles by the tile of zoom level subtree_tz they are under. Returns the list of
+    the (tz, tx, ty, base tiles) of these tiles, where base tiles is a dict of the tile details
+    (of their metatile) by their (tx, ty)
+    """
+    shift = tile_job_info.tmaxz - subtree_tz
+    subtrees = collections.OrderedDict()
+    for tile_detail in tile_details:
+        ty = GDAL2Tiles.getYTile(tile_detail.ty, tile_job_info.tmaxz, tile_job_info.options)
+        subtree = subtrees.setdefault((tile_detail.tx >> shift, ty >> shift), {})
+        for tile in tile_detail.tiles:
+            subtree[tile[:2]] = tile_detail
+    if tile_job_info.options.resume:
+        # Overview tiles may be missing above base tiles which all exist
+        tminx, tminy, tmaxx, tmaxy = tile_job_info.tminmax[subtree_tz]
         for ty in range(tmaxy, tminy - 1, -1):
             for tx in range(tminx, tmaxx + 1):
+                subtrees.setdefault((tx, ty), {})
+    return [(subtree_tz, tx, ty, subtree) for (tx, ty), subtree in subtrees.items()]
+
+
+def create_tile_subtree(tile_job_info: 'TileJobInfo',
+                        subtree: Tuple[int, int, int, Dict[Tuple[int, int], 'TileDetail']]) -> int:
+    """
+    Generation of the base tiles under a tile of group_tile_details(), and of the overview tiles
+    between them and this tile, depth first (in Z-order): each overview tile is generated as soon
+    as its underlying tiles are, from the pixels kept in a tile cache. Returns the number of base
+    tiles.
+    """
+    subtree_tz, subtree_tx, subtree_ty, tile_details = subtree
+    options = tile_job_info.options
+    nb_tiles = len(tile_details)
+
+    def create_tile(tz, tx, ty):
+        if tz == tile_job_info.tmaxz:
+            # The first tile of a metatile generates all of its tiles
+            tile_detail = tile_details.pop((tx, GDAL2Tiles.getYTile(ty, tz, options)), None)
+            if tile_detail is not None:
+                create_base_tile(tile_job_info, tile_detail)
+                for tile in tile_detail.tiles:
+                    tile_details.pop(tile[:2], None)
+            return
 
-                ti += 1
-                ytile = GDAL2Tiles.getYTile(ty, tz, options)
-                tilefilename = os.path.join(output_folder,
-                                            str(tz),
-                                            str(tx),
-                                            "%s.%s" % (ytile, tile_job_info.tile_extension))
+        base_tiles = get_base_tiles(tile_job_info, tz, tx, ty)
+        for x, y in base_tiles:
+            create_tile(tz + 1, x, y)
 
-                if options.verbose:
-                    print(ti, '/', tcount, tilefilename)
+        tminx, tminy, tmaxx, tmaxy = tile_job_info.tminmax[tz]
+        if tz >= tile_job_info.tminz and tminx <= tx <= tmaxx and tminy <= ty <= tmaxy:
+            create_overview_tile(tz + 1, tile_job_info.output_file_path, tile_job_info, options,
+                                 (tx, ty, base_tiles))
 
-                if options.resume and os.path.exists(tilefilename):
-                    if options.verbose:
-                        print("Tile generation skipped because of --resume")
-                    else:
-                        progress_bar.log_progress()
-                    continue
+    # At most 3 tiles per zoom level wait for their overview tile, besides the tiles of a metatile
+    threadLocal.tile_cache = TileCache(4 * (tile_job_info.tmaxz - subtree_tz + 1) +
+                                       tile_job_info.metatile ** 2)
+    try:
+        create_tile(subtree_tz, subtree_tx, subtree_ty)
+    finally:
+        del threadLocal.tile_cache
 
-                # Create directories for the tile
-                if not os.path.exists(os.path.dirname(tilefilename)):
-                    os.makedirs(os.path.dirname(tilefilename))
-
-                dsquery = mem_driver.Create('', 2 * tile_job_info.tile_size,
-                                            2 * tile_job_info.tile_size, tilebands)
-                # TODO: fill the null value
-                dstile = mem_driver.Create('', tile_job_info.tile_size, tile_job_info.tile_size,
-                                           tilebands)
-
-                # TODO: Implement more clever walking on the tiles with cache functionality
-                # probably walk should start with reading of four tiles from top left corner
-                # Hilbert curve
-
-                children = []
-                # Read the tiles and write them to query window
-                for y in range(2 * ty, 2 * ty + 2):
-                    for x in range(2 * tx, 2 * tx + 2):
-                        minx, miny, maxx, maxy = tile_job_info.tminmax[tz + 1]
-                        if x >= minx and x <= maxx and y >= miny and y <= maxy:
-                            ytile2 = GDAL2Tiles.getYTile(y, tz+1, options)
-                            base_tile_path = os.path.join(output_folder, str(tz + 1), str(x),
-                                                          "%s.%s" % (ytile2, tile_job_info.tile_extension))
-                            if not os.path.isfile(base_tile_path):
-                                continue
-
-                            dsquerytile = gdal.Open(
-                                base_tile_path,
-                                gdal.GA_ReadOnly)
-
-                            if x == 2*tx:
-                                tileposx = 0
-                            else:
-                                tileposx = tile_job_info.tile_size
-
-                            if options.xyz and options.profile == 'raster':
-                                if y == 2*ty:
-                                    tileposy = 0
-                                else:
-                                    tileposy = tile_job_info.tile_size
-                            else:
-                                if y == 2*ty:
-                                    tileposy = tile_job_info.tile_size
-                                else:
-                                    tileposy = 0
-
-                            dsquery.WriteRaster(
-                                tileposx, tileposy, tile_job_info.tile_size,
-                                tile_job_info.tile_size,
-                                dsquerytile.ReadRaster(0, 0,
-                                                       tile_job_info.tile_size,
-                                                       tile_job_info.tile_size),
-                                band_list=list(range(1, tilebands + 1)))
-                            children.append([x, y, tz + 1])
-
-                if children:
-                    scale_query_to_tile(dsquery, dstile, tile_driver, options,
-                                        tilefilename=tilefilename)
-                    # Write a copy of tile to png/jpg
-                    if options.resampling != 'antialias':
-                        # Write a copy of tile to png/jpg
-                        out_driver.CreateCopy(tilefilename, dstile, strict=0)
-
-                    if options.verbose:
-                        print("\tbuild from zoom", tz + 1,
-                              " tiles:", (2 * tx, 2 * ty), (2 * tx + 1, 2 * ty),
-                              (2 * tx, 2 * ty + 1), (2 * tx + 1, 2 * ty + 1))
-
-                    # Create a KML file for this tile.
-                    if tile_job_info.kml:
-                        swne = get_tile_swne(tile_job_info, options)
-                        if swne is not None:
-                            with open(os.path.join(
-                                output_folder,
-                                '%d/%d/%d.kml' % (tz, tx, ytile)
-                            ), 'wb') as f:
-                                f.write(generate_kml(
-                                    tx, ty, tz, tile_job_info.tile_extension, tile_job_info.tile_size,
-                                    swne, options, children
-                                ).encode('utf-8'))
-
-                if not options.verbose and not options.quiet:
-                    progress_bar.log_progress()
+    return nb_tiles
+
+
+def create_overview_tiles(tile_job_info: 'TileJobInfo', output_folder: str, options: Options,
+                          pool: Optional[Pool] = None, base_tz: Optional[int] = None,
+                          tile_writer: Optional[TileDatabaseWriter] = None,
+                          profile: Optional[TilingProfile] = None) -> None:
+    """
+    Generation of the overview tiles (higher in the pyramid) based on existing tiles, from those
+    of zoom level base_tz (the max zoom level by default).
+    The tiles of a zoom level are generated in parallel by the pool if it is given, once all the
+    tiles of the zoom level below are generated (and committed by the tile_writer if the output
+    is a MBTiles or GeoPackage file). The profiles of the tasks are merged into profile if given.
+    """
+
+    if base_tz is None:
+        base_tz = tile_job_info.tmaxz
+
+    # Usage of existing tiles: from 4 underlying tiles generate one as overview.
+
+    tcount = count_overview_tiles(tile_job_info, base_tz)
+
+    if tcount == 0:
+        return
+
+    if not options.quiet:
+        print("Generating Overview Tiles:")
+
+    progress_bar = ProgressBar(tcount)
+    progress_bar.start()
+
+    for base_tz in range(base_tz, tile_job_info.tminz, -1):
+        overview_tiles = overview_base_tiles(base_tz, tile_job_info)
+        create_tile = partial(create_overview_tile, base_tz, output_folder, tile_job_info, options)
+        for _ in map_tasks(create_tile, overview_tiles, pool, profile, chunksize=16):
+            if not options.verbose and not options.quiet:
+                progress_bar.log_progress()
+        if tile_writer is not None:
+            tile_writer.flush()
 
 
 def optparse_init() -> optparse.OptionParser:
@@ -1369,9 +2279,19 @@ def optparse_init() -> optparse.OptionParser:
                  dest="nb_processes",
                  type='int',
                  help="Number of processes to use for tiling")
+    p.add_option("--threads", dest="threads", action="store_true",
+                 help=("Use threads of a single process instead of processes for tiling "
+                       "(as many as --processes), which share the GDAL block cache"))
     p.add_option("--tilesize", dest="tilesize",  metavar="PIXELS", default=256,
                  type='int',
                  help="Width and height in pixel of a tile")
+    p.add_option("--metatile", dest="metatile", metavar="N", default=1,
+                 type='int',
+                 help="Read the base tiles by blocks of NxN tiles (N power of 2)")
+    p.add_option("--dedup", dest="dedup", action="store_true",
+                 help="Encode and store the tiles with identical content only once")
+    p.add_option("--profiling", dest="profiling", metavar="FILE",
+                 help="Write a JSON report of the time spent in each stage of the tiling to FILE")
 
     # KML options
     g = optparse.OptionGroup(p, "KML (Google Earth) options",
@@ -1487,9 +2407,19 @@ def options_post_processing(options: Options, input_file: str, output_folder: st
         options.url += os.path.basename(out_path) + '/'
 
     # Supported options
+    if options.metatile < 1 or options.metatile & (options.metatile - 1):
+        exit_with_error("--metatile must be a power of 2")
+
+    tile_db_format = get_tile_database_format(output_folder)
+    if tile_db_format is not None:
+        if options.profile == 'raster':
+            exit_with_error("%s output is not supported with the 'raster' profile" % tile_db_format)
+        if tile_db_format == 'MBTiles' and options.profile != 'mercator':
+            exit_with_error("MBTiles output requires the 'mercator' profile")
+
     if options.resampling == 'antialias' and not numpy_available:
         exit_with_error("'antialias' resampling algorithm is not available.",
-                        "Install PIL (Python Imaging Library) and numpy.")
+                        "Install numpy.")
 
     try:
         os.path.basename(input_file).encode('ascii')
@@ -1531,6 +2461,8 @@ class TileDetail(object):
     wxsize = 0
     wysize = 0
     querysize = 0
+    metasize = 0
+    tiles = []
 
     def __init__(self, **kwargs):
         for key in kwargs:
@@ -1567,6 +2499,7 @@ class TileJobInfo(object):
     is_epsg_4326 = False
     options = None
     exclude_transparent = False
+    metatile = 1
 
     def __init__(self, **kwargs):
         for key in kwargs:
@@ -1594,6 +2527,7 @@ class GDAL2Tiles(object):
         self.out_drv = None
         self.mem_drv = None
         self.warped_input_dataset = None
+        self.footprint = None
         self.out_srs = None
         self.nativezoom = None
         self.tminmax = None
@@ -1645,6 +2579,9 @@ class GDAL2Tiles(object):
         self.output_folder = output_folder
         self.options = options
 
+        # Tiles written to a MBTiles or GeoPackage file rather than to a directory
+        self.tile_db_format = get_tile_database_format(output_folder)
+
         if self.options.resampling == 'near':
             self.querysize = self.tile_size
 
@@ -1653,8 +2590,8 @@ class GDAL2Tiles(object):
 
         self.tminz, self.tmaxz = self.options.zoom
 
-        # KML generation
-        self.kml = self.options.kml
+        # KML generation (not for the tiles of a MBTiles or GeoPackage file)
+        self.kml = self.options.kml and self.tile_db_format is None
 
     # -------------------------------------------------------------------------
     def open_input(self) -> None:
@@ -1746,6 +2683,10 @@ class GDAL2Tiles(object):
                 self.warped_input_dataset = reproject_dataset(
                     input_dataset, self.in_srs, self.out_srs)
 
+                if self.options.exclude_transparent:
+                    self.footprint = get_footprint(input_dataset, self.warped_input_dataset,
+                                                   self.in_srs, self.out_srs)
+
                 if in_nodata:
                     self.warped_input_dataset = update_no_data_values(
                         self.warped_input_dataset, in_nodata, options=self.options)
@@ -1775,7 +2716,7 @@ class GDAL2Tiles(object):
         srs4326.ImportFromEPSG(4326)
         srs4326.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
         if self.out_srs and srs4326.ExportToProj4() == self.out_srs.ExportToProj4():
-            self.kml = True
+            self.kml = self.tile_db_format is None
             self.isepsg4326 = True
             if self.options.verbose:
                 print("KML autotest OK!")
@@ -1991,9 +2932,16 @@ class GDAL2Tiles(object):
         tiles are generated during the tile processing).
         """
 
+        if self.tile_db_format is not None:
+            self.generate_tile_database()
+            return
+
         if not os.path.exists(self.output_folder):
             os.makedirs(self.output_folder)
 
+        if not self.options.resume:
+            ResumeManifest.create(self.output_folder)
+
         if self.options.profile == 'mercator':
 
             south, west = self.mercator.MetersToLatLon(self.ominx, self.ominy)
@@ -2074,6 +3022,161 @@ class GDAL2Tiles(object):
                             self.options, children
                         ).encode('utf-8'))
 
+    def generate_tile_database(self) -> None:
+        """
+        Creation of the MBTiles or GeoPackage file of the tiles, with its metadata (and for
+        GeoPackage the definition of its tile matrix set). It is kept with --resume.
+        """
+
+        if not self.options.resume:
+            for suffix in ('', '-journal', '-wal', '-shm'):
+                if os.path.exists(self.output_folder + suffix):
+                    os.remove(self.output_folder + suffix)
+
+        conn = sqlite3.connect(self.output_folder)
+
+        if self.tile_db_format == 'MBTiles':
+
+            south, west = self.mercator.MetersToLatLon(self.ominx, self.ominy)
+            north, east = self.mercator.MetersToLatLon(self.omaxx, self.omaxy)
+            south, west = max(-85.05112878, south), max(-180.0, west)
+            north, east = min(85.05112878, north), min(180.0, east)
+            self.swne = (south, west, north, east)
+
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT);
+                CREATE UNIQUE INDEX IF NOT EXISTS name ON metadata (name);
+            """)
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'tiles'").fetchone() is None:
+                if self.options.dedup:
+                    # The tiles with the same content share a row of the images table
+                    conn.executescript("""
+                        CREATE TABLE map (zoom_level INTEGER, tile_column INTEGER,
+                                          tile_row INTEGER, tile_id TEXT);
+                        CREATE UNIQUE INDEX map_index ON map (zoom_level, tile_column, tile_row);
+                        CREATE TABLE images (tile_data BLOB, tile_id TEXT);
+                        CREATE UNIQUE INDEX images_id ON images (tile_id);
+                        CREATE VIEW tiles AS
+                            SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+                                   map.tile_row AS tile_row, images.tile_data AS tile_data
+                            FROM map JOIN images ON images.tile_id = map.tile_id;
+                    """)
+                else:
+                    conn.executescript("""
+                        CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER,
+                                            tile_row INTEGER, tile_data BLOB);
+                        CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column,
+                                                                 tile_row);
+                    """)
+            metadata = {
+                'name': self.options.title,
+                'type': 'overlay',
+                'version': '1.1',
+                'description': self.options.title,
+                'format': self.tileext,
+                'bounds': '%.14f,%.14f,%.14f,%.14f' % (west, south, east, north),
+                'minzoom': str(self.tminz),
+                'maxzoom': str(self.tmaxz),
+            }
+            if self.options.copyright:
+                metadata['attribution'] = self.options.copyright
+            conn.executemany('INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)',
+                             metadata.items())
+
+        else:
+
+            # Tile matrix set: bounds and size of the tile matrix of zoom level 0
+            if self.options.profile == 'mercator':
+                matrix_width, matrix_height = 1, 1
+                minx, miny, maxx, maxy = self.mercator.TileBounds(0, 0, 0)
+            elif self.options.profile == 'geodetic':
+                matrix_width, matrix_height = (2 if self.options.tmscompatible else 1), 1
+                minx, miny = self.geodetic.TileBounds(0, 0, 0)[:2]
+                maxx, maxy = self.geodetic.TileBounds(matrix_width - 1, 0, 0)[2:]
+            else:
+                tms = tmsMap[self.options.profile]
+                matrix_width, matrix_height = tms.matrix_width, tms.matrix_height
+                minx, miny = tms.TileBounds(0, 0, 0, self.tile_size)[:2]
+                maxx, maxy = tms.TileBounds(matrix_width - 1, matrix_height - 1, 0,
+                                            self.tile_size)[2:]
+
+            srs4326 = osr.SpatialReference()
+            srs4326.ImportFromEPSG(4326)
+            if self.out_srs.GetAuthorityName(None) == 'EPSG':
+                srs_id = int(self.out_srs.GetAuthorityCode(None))
+                organization = 'EPSG'
+            else:
+                srs_id = 100000
+                organization = 'NONE'
+
+            table = os.path.splitext(os.path.basename(self.output_folder))[0]
+
+            conn.execute('PRAGMA application_id = 1196444487')    # 'GPKG'
+            conn.execute('PRAGMA user_version = 10200')
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+                    srs_name TEXT NOT NULL, srs_id INTEGER NOT NULL PRIMARY KEY,
+                    organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL,
+                    definition TEXT NOT NULL, description TEXT);
+                CREATE TABLE IF NOT EXISTS gpkg_contents (
+                    table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL,
+                    identifier TEXT UNIQUE, description TEXT DEFAULT '',
+                    last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+                    min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER,
+                    CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id)
+                        REFERENCES gpkg_spatial_ref_sys(srs_id));
+                CREATE TABLE IF NOT EXISTS gpkg_tile_matrix_set (
+                    table_name TEXT NOT NULL PRIMARY KEY, srs_id INTEGER NOT NULL,
+                    min_x DOUBLE NOT NULL, min_y DOUBLE NOT NULL,
+                    max_x DOUBLE NOT NULL, max_y DOUBLE NOT NULL,
+                    CONSTRAINT fk_gtms_table_name FOREIGN KEY (table_name)
+                        REFERENCES gpkg_contents(table_name),
+                    CONSTRAINT fk_gtms_srs FOREIGN KEY (srs_id)
+                        REFERENCES gpkg_spatial_ref_sys (srs_id));
+                CREATE TABLE IF NOT EXISTS gpkg_tile_matrix (
+                    table_name TEXT NOT NULL, zoom_level INTEGER NOT NULL,
+                    matrix_width INTEGER NOT NULL, matrix_height INTEGER NOT NULL,
+                    tile_width INTEGER NOT NULL, tile_height INTEGER NOT NULL,
+                    pixel_x_size DOUBLE NOT NULL, pixel_y_size DOUBLE NOT NULL,
+                    CONSTRAINT pk_ttm PRIMARY KEY (table_name, zoom_level),
+                    CONSTRAINT fk_tmm_table_name FOREIGN KEY (table_name)
+                        REFERENCES gpkg_contents(table_name));
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS "%s" (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, zoom_level INTEGER NOT NULL,
+                    tile_column INTEGER NOT NULL, tile_row INTEGER NOT NULL,
+                    tile_data BLOB NOT NULL, UNIQUE (zoom_level, tile_column, tile_row))
+            """ % table.replace('"', '""'))
+
+            conn.executemany('INSERT OR REPLACE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)', [
+                ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', None),
+                ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', None),
+                ('WGS 84 geodetic', 4326, 'EPSG', 4326, srs4326.ExportToWkt(), None),
+                (self.out_srs.GetName() or 'Unknown', srs_id, organization, srs_id,
+                 self.out_srs.ExportToWkt(), None),
+            ])
+            conn.execute(
+                "INSERT OR REPLACE INTO gpkg_contents (table_name, data_type, identifier, "
+                "description, min_x, min_y, max_x, max_y, srs_id) "
+                "VALUES (?, 'tiles', ?, ?, ?, ?, ?, ?, ?)",
+                (table, self.options.title, self.options.title,
+                 self.ominx, self.ominy, self.omaxx, self.omaxy, srs_id))
+            conn.execute('INSERT OR REPLACE INTO gpkg_tile_matrix_set VALUES (?, ?, ?, ?, ?, ?)',
+                         (table, srs_id, minx, miny, maxx, maxy))
+            conn.executemany(
+                'INSERT OR REPLACE INTO gpkg_tile_matrix VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(table, tz, matrix_width * 2**tz, matrix_height * 2**tz,
+                  self.tile_size, self.tile_size,
+                  (maxx - minx) / (matrix_width * 2**tz * self.tile_size),
+                  (maxy - miny) / (matrix_height * 2**tz * self.tile_size))
+                 for tz in range(self.tminz, self.tmaxz + 1)])
+
+        conn.commit()
+        # So that the worker processes read the tiles while they are written
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.close()
+
     def generate_base_tiles(self) -> Tuple[TileJobInfo, List[TileDetail]]:
         """
         Generation of the base tiles (the lowest in the pyramid) directly from the input raster
@@ -2105,37 +3208,89 @@ class GDAL2Tiles(object):
         tile_details = []
 
         tz = self.tmaxz
-        for ty in range(tmaxy, tminy - 1, -1):
-            for tx in range(tminx, tmaxx + 1):
 
-                ti += 1
-                ytile = GDAL2Tiles.getYTile(ty, tz, self.options)
-                tilefilename = os.path.join(
-                    self.output_folder, str(tz), str(tx), "%s.%s" % (ytile, self.tileext))
-                if self.options.verbose:
-                    print(ti, '/', tcount, tilefilename)
+        if self.options.resume and self.tile_db_format is None:
+            # Tiles written by the interrupted runs
+            resume_manifests[self.output_folder] = ResumeManifest.merge(self.output_folder)
 
-                if self.options.resume and os.path.exists(tilefilename):
-                    if self.options.verbose:
-                        print("Tile generation skipped because of --resume")
-                    continue
+        if self.options.profile == 'raster':
+            querysize = self.tile_size
 
-                # Create directories for the tile
-                if not os.path.exists(os.path.dirname(tilefilename)):
-                    os.makedirs(os.path.dirname(tilefilename))
+        # Metatiles of metatile x metatile tiles are read at once. They are aligned on the
+        # tiles of zoom level 0, so that each one is under a single tile of the zoom levels
+        # above it
+        metatile = min(self.options.metatile, 2**tz)
+        metasize = metatile * querysize
 
-                if self.options.profile == 'mercator':
-                    # Tile bounds in EPSG:3857
-                    b = self.mercator.TileBounds(tx, ty, tz)
-                elif self.options.profile == 'geodetic':
-                    b = self.geodetic.TileBounds(tx, ty, tz)
-                elif self.options.profile != 'raster':
-                    b = tmsMap[self.options.profile].TileBounds(tx, ty, tz, self.tile_size)
+        def tile_bounds(tx, ty):
+            if self.options.profile == 'mercator':
+                # Tile bounds in EPSG:3857
+                return self.mercator.TileBounds(tx, ty, tz)
+            elif self.options.profile == 'geodetic':
+                return self.geodetic.TileBounds(tx, ty, tz)
+            return tmsMap[self.options.profile].TileBounds(tx, ty, tz, self.tile_size)
+
+        # With --exclude, the tiles outside of the footprint of a reprojected input are dropped
+        # before reading them
+        coverage = None
+        if self.footprint is not None and self.options.profile != 'raster':
+            ulx, miny, maxx, uly = tile_bounds(tminx, tmaxy)
+            coverage = FootprintCoverage(self.footprint, ulx, uly, maxx - ulx, uly - miny)
+
+        for mty in range(tmaxy // metatile, tminy // metatile - 1, -1):
+            for mtx in range(tminx // metatile, tmaxx // metatile + 1):
+
+                # Tiles of the metatile and their offset in the metatile query
+                tiles = []
+                for ty in range(min(tmaxy, mty * metatile + metatile - 1),
+                                max(tminy, mty * metatile) - 1, -1):
+                    for tx in range(max(tminx, mtx * metatile),
+                                    min(tmaxx, mtx * metatile + metatile - 1) + 1):
+
+                        ti += 1
+                        ytile = GDAL2Tiles.getYTile(ty, tz, self.options)
+                        tilefilename = os.path.join(
+                            self.output_folder, str(tz), str(tx), "%s.%s" % (ytile, self.tileext))
+                        if self.options.verbose:
+                            print(ti, '/', tcount, tilefilename)
+
+                        if coverage is not None and (tx - tminx, tmaxy - ty) not in coverage:
+                            if self.options.verbose:
+                                print("Tile generation skipped because it is outside of the "
+                                      "input dataset")
+                            profile_count('footprint_tiles_skipped')
+                            continue
+
+                        if self.options.resume and tile_exists(self.output_folder, self.options,
+                                                               tz, tx, ytile, self.tileext):
+                            if self.options.verbose:
+                                print("Tile generation skipped because of --resume")
+                            profile_count('resumed_tiles_skipped')
+                            continue
+
+                        # Create directories for the tile
+                        if (self.tile_db_format is None and
+                                not os.path.exists(os.path.dirname(tilefilename))):
+                            os.makedirs(os.path.dirname(tilefilename))
+
+                        qx = (tx - mtx * metatile) * querysize
+                        if self.options.xyz and self.options.profile == 'raster':
+                            qy = (ty - mty * metatile) * querysize
+                        else:
+                            qy = (metatile - 1 - (ty - mty * metatile)) * querysize
+                        tiles.append((tx, ytile, qx, qy))
+
+                if not tiles:
+                    continue
 
                 # Don't scale up by nearest neighbour, better change the querysize
                 # to the native resolution (and return smaller query tile) for scaling
 
                 if self.options.profile != 'raster':
+                    # Bounds of the metatile, from its lower left and upper right tiles
+                    b = tile_bounds(mtx * metatile, mty * metatile)[:2] + \
+                        tile_bounds(mtx * metatile + metatile - 1, mty * metatile + metatile - 1)[2:]
+
                     rb, wb = self.geo_query(ds, b[0], b[3], b[2], b[1])
 
                     # Pixel size in the raster covering query geo extent
@@ -2144,7 +3299,7 @@ class GDAL2Tiles(object):
                         print("\tNative Extent (querysize", nativesize, "): ", rb, wb)
 
                     # Tile bounds in raster coordinates for ReadRaster query
-                    rb, wb = self.geo_query(ds, b[0], b[3], b[2], b[1], querysize=querysize)
+                    rb, wb = self.geo_query(ds, b[0], b[3], b[2], b[1], querysize=metasize)
 
                     rx, ry, rxsize, rysize = rb
                     wx, wy, wxsize, wysize = wb
@@ -2154,37 +3309,32 @@ class GDAL2Tiles(object):
                     tsize = int(self.tsize[tz])   # tile_size in raster coordinates for actual zoom
                     xsize = self.warped_input_dataset.RasterXSize     # size of the raster in pixels
                     ysize = self.warped_input_dataset.RasterYSize
-                    querysize = self.tile_size
-
-                    rx = tx * tsize
-                    rxsize = 0
-                    if tx == tmaxx:
-                        rxsize = xsize % tsize
-                    if rxsize == 0:
-                        rxsize = tsize
-
-                    ry = ty * tsize
-                    rysize = 0
-                    if ty == tmaxy:
-                        rysize = ysize % tsize
-                    if rysize == 0:
-                        rysize = tsize
+
+                    rx = mtx * metatile * tsize
+                    rxsize = min(metatile * tsize, xsize - rx)
+
+                    if self.options.xyz:
+                        ry = mty * metatile * tsize
+                        rysize = min(metatile * tsize, ysize - ry)
+                    else:
+                        rysize = min(metatile * tsize, ysize - mty * metatile * tsize)
+                        ry = ysize - (mty * metatile * tsize) - rysize
 
                     wx, wy = 0, 0
                     wxsize = int(rxsize / float(tsize) * self.tile_size)
                     wysize = int(rysize / float(tsize) * self.tile_size)
 
                     if not self.options.xyz:
-                        ry = ysize - (ty * tsize) - rysize
-                        if wysize != self.tile_size:
-                            wy = self.tile_size - wysize
+                        if wysize != metasize:
+                            wy = metasize - wysize
 
                 # Read the source raster if anything is going inside the tile as per the computed
                 # geo_query
                 tile_details.append(
                     TileDetail(
-                        tx=tx, ty=ytile, tz=tz, rx=rx, ry=ry, rxsize=rxsize, rysize=rysize, wx=wx,
-                        wy=wy, wxsize=wxsize, wysize=wysize, querysize=querysize,
+                        tx=tiles[0][0], ty=tiles[0][1], tz=tz, rx=rx, ry=ry, rxsize=rxsize,
+                        rysize=rysize, wx=wx, wy=wy, wxsize=wxsize, wysize=wysize,
+                        querysize=querysize, metasize=metasize, tiles=tiles,
                     )
                 )
 
@@ -2205,6 +3355,7 @@ class GDAL2Tiles(object):
             is_epsg_4326=self.isepsg4326,
             options=self.options,
             exclude_transparent=self.options.exclude_transparent,
+            metatile=min(self.options.metatile, 2**self.tmaxz),
         )
 
         return conf, tile_details
@@ -2217,9 +3368,16 @@ class GDAL2Tiles(object):
 
         raises Gdal2TilesError if the dataset does not contain anything inside this geo_query
         """
+        def to_pixel(x):
+            # Pixel offsets within 0.001 of an integer are rounded to it, including negative
+            # ones (left or above the raster, as with metatiles)
+            if abs(x - round(x)) < 0.001:
+                return int(round(x))
+            return int(x)
+
         geotran = ds.GetGeoTransform()
-        rx = int((ulx - geotran[0]) / geotran[1] + 0.001)
-        ry = int((uly - geotran[3]) / geotran[5] + 0.001)
+        rx = to_pixel((ulx - geotran[0]) / geotran[1])
+        ry = to_pixel((uly - geotran[3]) / geotran[5])
         rxsize = max(1, int((lrx - ulx) / geotran[1] + 0.5))
         rysize = max(1, int((lry - uly) / geotran[5] + 0.5))
 
@@ -3169,6 +4327,13 @@ def single_threaded_tiling(input_file: str, output_folder: str, options: Options
     Keep a single threaded version that stays clear of multiprocessing, for platforms that would not
     support it
     """
+    profile = wall_times = None
+    if options.profiling:
+        # The tiles skipped while computing the tile details are counted by the main thread
+        profile = threadLocal.profile = TilingProfile()
+        wall_times = {}
+        start = time.perf_counter()
+
     if options.verbose:
         print("Begin tiles details calc")
     conf, tile_details = worker_tile_details(input_file, output_folder, options)
@@ -3176,33 +4341,91 @@ def single_threaded_tiling(input_file: str, output_folder: str, options: Options
     if options.verbose:
         print("Tiles details calc complete.")
 
+    if profile is not None:
+        wall_times['tile_details'] = time.perf_counter() - start
+        start = time.perf_counter()
+
+    tile_writer = None
+    if get_tile_database_format(output_folder) is not None:
+        set_tiles_queue(queue.Queue())
+        tile_writer = TileDatabaseWriter(output_folder, tiles_queue)
+        tile_writer.start()
+
     if not options.verbose and not options.quiet:
-        progress_bar = ProgressBar(len(tile_details))
+        progress_bar = ProgressBar(sum(len(tile_detail.tiles) for tile_detail in tile_details))
         progress_bar.start()
 
-    for tile_detail in tile_details:
-        create_base_tile(conf, tile_detail)
-
+    # The overview tiles up to the subtree zoom level are generated with the base tiles
+    subtree_tz = get_subtree_zoom(conf, 64)
+    subtrees = group_tile_details(conf, tile_details, subtree_tz)
+    for nb_tiles in map_tasks(partial(create_tile_subtree, conf), subtrees, profile=profile):
         if not options.verbose and not options.quiet:
-            progress_bar.log_progress()
+            progress_bar.log_progress(nb_tiles)
 
     if getattr(threadLocal, 'cached_ds', None):
         del threadLocal.cached_ds
 
-    create_overview_tiles(conf, output_folder, options)
+    if tile_writer is not None:
+        tile_writer.flush()
+
+    if profile is not None:
+        wall_times['base_tiles'] = time.perf_counter() - start
+        start = time.perf_counter()
+
+    create_overview_tiles(conf, output_folder, options, base_tz=subtree_tz,
+                          tile_writer=tile_writer, profile=profile)
+
+    if tile_writer is not None:
+        close_tile_database()
+        tile_writer.close()
+        set_tiles_queue(None)
 
     shutil.rmtree(os.path.dirname(conf.src_file))
 
+    if profile is not None:
+        wall_times['overview_tiles'] = time.perf_counter() - start
+        if tile_writer is not None:
+            profile.merge(tile_writer.profile)
+        del threadLocal.profile
+        write_profiling_report(options.profiling, profile, wall_times, 'single', 1)
+
 
 def multi_threaded_tiling(input_file: str, output_folder: str, options: Options) -> None:
     nb_processes = options.nb_processes or 1
 
-    # Make sure that all processes do not consume more than `gdal.GetCacheMax()`
     gdal_cache_max = gdal.GetCacheMax()
-    gdal_cache_max_per_process = max(1024 * 1024, math.floor(gdal_cache_max / nb_processes))
-    set_cache_max(gdal_cache_max_per_process)
-
-    pool = Pool(processes=nb_processes)
+    if not options.threads:
+        # Make sure that all processes do not consume more than `gdal.GetCacheMax()`
+        gdal_cache_max_per_process = max(1024 * 1024, math.floor(gdal_cache_max / nb_processes))
+        set_cache_max(gdal_cache_max_per_process)
+
+    # With a MBTiles or GeoPackage output, the workers send the tiles to the writer thread of
+    # the main process
+    manager = tile_writer = tiles_db_queue = None
+    if get_tile_database_format(output_folder) is not None:
+        if options.threads:
+            tiles_db_queue = queue.Queue()
+        else:
+            manager = Manager()
+            tiles_db_queue = manager.Queue()
+
+    profile = wall_times = None
+    if options.profiling:
+        # The tiles skipped while computing the tile details are counted by the main thread
+        profile = threadLocal.profile = TilingProfile()
+        wall_times = {}
+        start = time.perf_counter()
+
+    if options.threads:
+        # Each thread opens its own handle of the source dataset (see create_base_tile()), but
+        # the blocks read and warped are kept once in the block cache of the process
+        set_tiles_queue(tiles_db_queue)
+        pool = ThreadPool(processes=nb_processes)
+    elif tiles_db_queue is not None:
+        pool = Pool(processes=nb_processes, initializer=set_tiles_queue,
+                    initargs=(tiles_db_queue,))
+    else:
+        pool = Pool(processes=nb_processes)
 
     if options.verbose:
         print("Begin tiles details calc")
@@ -3212,26 +4435,61 @@ def multi_threaded_tiling(input_file: str, output_folder: str, options: Options)
     if options.verbose:
         print("Tiles details calc complete.")
 
+    if profile is not None:
+        wall_times['tile_details'] = time.perf_counter() - start
+        start = time.perf_counter()
+
+    if tiles_db_queue is not None:
+        tile_writer = TileDatabaseWriter(output_folder, tiles_db_queue)
+        tile_writer.start()
+
     if not options.verbose and not options.quiet:
-        progress_bar = ProgressBar(len(tile_details))
+        progress_bar = ProgressBar(sum(len(tile_detail.tiles) for tile_detail in tile_details))
         progress_bar.start()
 
     # TODO: gbataille - check the confs for which each element is an array... one useless level?
     # TODO: gbataille - assign an ID to each job for print in verbose mode "ReadRaster Extent ..."
-    for _ in pool.imap_unordered(partial(create_base_tile, conf), tile_details, chunksize=128):
+    # The overview tiles up to the subtree zoom level are generated with the base tiles
+    subtree_tz = get_subtree_zoom(conf, 64 * nb_processes)
+    subtrees = group_tile_details(conf, tile_details, subtree_tz)
+    for nb_tiles in map_tasks(partial(create_tile_subtree, conf), subtrees, pool, profile):
         if not options.verbose and not options.quiet:
-            progress_bar.log_progress()
+            progress_bar.log_progress(nb_tiles)
+
+    if not options.threads:
+        # Set the maximum cache back to the original value
+        set_cache_max(gdal_cache_max)
+
+    if tile_writer is not None:
+        tile_writer.flush()
+
+    if profile is not None:
+        wall_times['base_tiles'] = time.perf_counter() - start
+        start = time.perf_counter()
+
+    create_overview_tiles(conf, output_folder, options, pool, base_tz=subtree_tz,
+                          tile_writer=tile_writer, profile=profile)
 
     pool.close()
     pool.join()     # Jobs finished
 
-    # Set the maximum cache back to the original value
-    set_cache_max(gdal_cache_max)
-
-    create_overview_tiles(conf, output_folder, options)
+    if tile_writer is not None:
+        close_tile_database()
+        tile_writer.close()
+        if manager is not None:
+            manager.shutdown()
+        set_tiles_queue(None)
 
     shutil.rmtree(os.path.dirname(conf.src_file))
 
+    if profile is not None:
+        wall_times['overview_tiles'] = time.perf_counter() - start
+        if tile_writer is not None:
+            profile.merge(tile_writer.profile)
+        del threadLocal.profile
+        write_profiling_report(options.profiling, profile, wall_times,
+                               'threads' if options.threads else 'processes', nb_processes)
+
 
 def main(argv: List[str]) -> int:
     # TODO: gbataille - use mkdtemp to work in a temp directory